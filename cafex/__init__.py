@@ -1 +1,2 @@
 from cafex.version import __version__
+from cafex.case_control_filter import CaseControlFilter
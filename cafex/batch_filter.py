@@ -0,0 +1,232 @@
+'''
+Vectorised evaluation of FormatFilter expressions over blocks of records.
+
+FORMAT values referenced by the expressions of a FormatFilter are read for a
+block of records into NumPy arrays with dimensions of records x samples (x
+values for fields with more than one value) and each expression is evaluated
+for the whole block at once. Results are identical to those from
+FormatFilter.filter for each record. Requires NumPy.
+'''
+
+import numpy as np
+from .format_cache import FormatCache
+from .genotype_filter import _compile_expression, _warn_missing_values
+
+MAX_ALTS = 62
+''' Records with more ALT alleles than this are evaluated by FormatFilter. '''
+
+
+class BatchFormatFilter(object):
+    '''
+    Evaluate the expressions of a FormatFilter for blocks of records using
+    NumPy. Expressions on String or Character fields can not be vectorised
+    and are evaluated per sample using the same functions as FormatFilter.
+    '''
+
+    def __init__(self, format_filter):
+        '''
+        Args:
+            format_filter: FormatFilter object to evaluate.
+        '''
+        self.format_filter = format_filter
+        self.expressions = format_filter.expressions
+        self._scalar = dict()
+        for filter_exp in self.expressions:
+            for exp in filter_exp.expressions:
+                ftype = filter_exp.metadata[exp.field].type
+                if ftype not in ('Integer', 'Float'):
+                    self._scalar[exp] = _compile_expression(exp)
+
+    def filter(self, records, samples, caches=None):
+        '''
+        Return a list of bitwise flags, one per record, indicating whether
+        each ALT allele meets the parameters of the FormatFilter's
+        expressions. Each flag is the same as that returned by
+        FormatFilter.filter for the corresponding record.
+
+        Args:
+            records:    list of pysam.VariantRecords
+
+            samples:    list of samples to assess, given as names or
+                        SampleHandles.
+
+            caches:     Optional list of FormatCaches, one per record. FORMAT
+                        values are retrieved via these caches so that they
+                        can be shared with other filters.
+        '''
+        if not records:
+            return []
+        if caches is None:
+            caches = [FormatCache(x) for x in records]
+        n_alts = np.array([len(x.alts) for x in records], dtype=np.int64)
+        large = np.flatnonzero(n_alts > MAX_ALTS)
+        if len(large):
+            n_alts[large] = 1  # evaluated individually below
+        block = _Block(records, samples, caches, n_alts)
+        flags = block.all_bits.copy()
+        for filter_exp in self.expressions:
+            flags &= self._min_samples(filter_exp,
+                                       self._evaluate(filter_exp, block),
+                                       block)
+            if not flags.any():
+                break
+        flags = flags.tolist()
+        for i in large:
+            flags[i] = self.format_filter.filter(records[i], samples,
+                                                 caches[i])
+        return flags
+
+    def _evaluate(self, filter_exp, block):
+        ''' Return array of per-sample flags for a FilterExpression. '''
+        flags = self._evaluate_expression(filter_exp.expressions[0], block)
+        for op, exp in zip(filter_exp.logical_ops,
+                           filter_exp.expressions[1:]):
+            flags = op(flags, self._evaluate_expression(exp, block))
+        return flags
+
+    def _evaluate_expression(self, exp, block):
+        if exp in self._scalar:
+            return block.evaluate(self._scalar[exp])
+        if exp.number == 1:
+            vals = block.scalar_values(exp.field)
+            match = ~np.isnan(vals) & exp.operator(vals, exp.value)
+            return np.where(match, block.all_bits[:, None], 0)
+        vals, lengths = block.vector_values(exp.field)
+        if exp.iterfunc is None and exp.subscript is None:
+            return self._per_value(exp, vals, lengths, block)
+        valid = ~np.isnan(vals)
+        if exp.iterfunc is sum:
+            val = np.where(valid, vals, 0).sum(axis=2)
+            val_ok = block.present(exp.field)[:, None]
+        elif exp.iterfunc is min:
+            val = np.where(valid, vals, np.inf).min(axis=2)
+            val_ok = valid.any(axis=2)
+        elif exp.iterfunc is max:
+            val = np.where(valid, vals, -np.inf).max(axis=2)
+            val_ok = valid.any(axis=2)
+        else:
+            val = _column(vals, exp.subscript)
+            val_ok = (lengths > exp.subscript) & ~np.isnan(val)
+        match = val_ok & exp.operator(val, exp.value)
+        # as for FormatFilter, fall back to checking individual values
+        return np.where(match, block.all_bits[:, None],
+                        self._per_value(exp, vals, lengths, block, ~match))
+
+    def _per_value(self, exp, vals, lengths, block, check=None):
+        if exp.number not in ('A', 'R'):
+            match = (~np.isnan(vals) & exp.operator(vals, exp.value)).any(
+                axis=2)
+            return np.where(match, block.all_bits[:, None], 0)
+        first = 1 if exp.number == 'R' else 0
+        present = block.present(exp.field)[:, None]
+        flags = np.zeros(lengths.shape, dtype=np.int64)
+        for i in range(block.max_alts):
+            is_alt = block.n_alts[:, None] > i
+            in_range = lengths > i + first
+            missing = is_alt & ~in_range & present
+            if check is not None:
+                missing &= check
+            for r, s in zip(*np.nonzero(missing)):
+                _warn_missing_values(block.records[r], block.samples[s],
+                                     exp.field)
+            val = _column(vals, i + first)
+            match = is_alt & in_range & ~np.isnan(val) & exp.operator(
+                val, exp.value)
+            flags |= match.astype(np.int64) << i
+        return flags
+
+    def _min_samples(self, filter_exp, flags, block):
+        '''
+        Return per-record flags with bits set for ALT alleles matched in
+        the minimum number of samples required by filter_exp.
+        '''
+        if filter_exp.min_samples < 1:
+            min_smpls = len(block.samples)
+        else:
+            min_smpls = filter_exp.min_samples
+        if min_smpls <= 1:
+            return np.bitwise_or.reduce(flags, axis=1)
+        shifts = np.arange(block.max_alts, dtype=np.int64)
+        counts = ((flags[:, :, None] >> shifts) & 1).sum(axis=1)
+        return ((counts >= min_smpls).astype(np.int64) << shifts).sum(axis=1)
+
+
+def _column(vals, i):
+    ''' Return column i of a 3D array or NaNs if out of range. '''
+    if i < vals.shape[2]:
+        return vals[:, :, i]
+    return np.full(vals.shape[:2], np.nan)
+
+
+class _Block(object):
+    '''
+    Records being evaluated together, with FORMAT values retrieved once per
+    block and field and shared between expressions. Values are read using
+    FormatCache.sample_values, which avoids the overhead of storing every
+    value in the cache.
+    '''
+
+    def __init__(self, records, samples, caches, n_alts):
+        self.records = records
+        self.samples = samples
+        self.caches = caches
+        self.n_alts = n_alts
+        self.max_alts = int(n_alts.max())
+        self.all_bits = (np.int64(1) << n_alts) - 1
+        self._present = dict()
+        self._scalar = dict()
+        self._vector = dict()
+
+    def present(self, field):
+        ''' Boolean array indicating which records have field. '''
+        if field not in self._present:
+            self._present[field] = np.array([x.has_field(field) for x in
+                                             self.caches], dtype=bool)
+        return self._present[field]
+
+    def _values(self, field, missing):
+        values = []
+        samples = self.samples
+        for cache, present in zip(self.caches, self.present(field)):
+            if present:
+                values.extend(cache.sample_values(field, samples))
+            else:
+                values.extend([missing] * len(samples))
+        return values
+
+    def scalar_values(self, field):
+        ''' Array of values for a Number=1 field with NaN for missing. '''
+        if field not in self._scalar:
+            self._scalar[field] = np.array(
+                self._values(field, None), dtype=float).reshape(
+                    len(self.records), len(self.samples))
+        return self._scalar[field]
+
+    def vector_values(self, field):
+        '''
+        Return a tuple of an array of values for a field with more than one
+        value per sample padded with NaN and an array of the number of
+        values for each sample.
+        '''
+        if field not in self._vector:
+            values = [x or () for x in self._values(field, ())]
+            lengths = np.array([len(x) for x in values], dtype=np.int64)
+            width = max(int(lengths.max(initial=0)), 1)
+            vals = np.full((len(values), width), np.nan)
+            vals[np.arange(width) < lengths[:, None]] = np.array(
+                [y for x in values for y in x], dtype=float)
+            shape = (len(self.records), len(self.samples))
+            self._vector[field] = (vals.reshape(shape + (width,)),
+                                   lengths.reshape(shape))
+        return self._vector[field]
+
+    def evaluate(self, evaluate):
+        '''
+        Return array of flags from calling evaluate (as created by
+        genotype_filter._compile_expression) for each record and sample.
+        '''
+        return np.array([[evaluate(cache, x, n) for x in self.samples]
+                         for cache, n in zip(self.caches,
+                                             self.n_alts.tolist())],
+                        dtype=np.int64).reshape(len(self.records),
+                                                len(self.samples))
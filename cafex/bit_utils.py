@@ -33,6 +33,11 @@ def set_bits_in_range(x, y):
     return ((1 << x) - 1) ^ ((1 << y) - 1)
 
 
+def count_set_bits(x):
+    ''' Return the number of bits set in x '''
+    return bin(x).count('1')
+
+
 def flip_bits(x, n):
     '''Flip the first n bits of x'''
     return x ^ set_first_bits(n)
@@ -56,3 +61,21 @@ def flag_consensus(flags):
     for x in flags[1:]:
         f &= x
     return f
+
+
+def allele_bits(alleles):
+    '''
+    Return a bitwise flag with bits set for each ALT allele in alleles (e.g.
+    a GT tuple), where bit 0 represents the first ALT allele (allele 1).
+    REF (0) and missing (None) alleles are ignored.
+
+    e.g.
+        allele_bits((0, 1))  # returns 1 (0b1)
+        allele_bits((2, 3))  # returns 6 (0b110)
+        allele_bits((None, None))  # returns 0
+    '''
+    x = 0
+    for allele in alleles:
+        if allele:
+            x |= 1 << (allele - 1)
+    return x
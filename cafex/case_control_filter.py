@@ -1,12 +1,43 @@
 import logging
+import os
 import pysam
+import shutil
 import sys
+import tempfile
 import time
-from .bit_utils import set_first_bits
-from .vaf import get_vaf_method
+from collections import namedtuple
+from itertools import islice
+from .bit_utils import allele_bits, set_first_bits
+from .checkpoint import CHECKPOINT_INTERVAL, Checkpoint, read_checkpoint
+from .format_cache import get_backend, get_cache
+from .format_fields import remove_fields, remove_header_fields
+from .format_fields import required_fields, unused_fields
+from .parallel import process_chunks, append_output
+from .pipeline import ThreadedWriter, read_ahead
+from .progress import Progress, genome_spans
+from .regions import Interval, contig_intervals, exclude_contigs
+from .regions import fetch_intervals, filter_sites, merge_intervals
+from .regions import parse_region, parse_shard, partition_intervals
+from .regions import read_bed, read_sites, resume_intervals, shard_intervals
+from .regions import site_intervals, skip_contigs
+from .samples import get_sample_handles
+from .site_filter import SiteFilter
+from .sites_only import get_sites_header, sites_record
+from .stats import RunStats
+from .vcf_index import index_vcf, open_unindexed, read_index
+from .vaf import VafMemo, get_vaf_method
 from .genotype_filter import FormatFilter
+from .groups import info_tag_name, read_groups
+from .inputs import get_inputs, header_key
 
 PROG_NAME = "CAFEx"
+SHARD_META = PROG_NAME + "_shard"  # header key recording --shard of output
+CHUNKS_PER_THREAD = 4  # more chunks than processes helps balance workloads
+OUTPUT_SAMPLES = ('all', 'case,control', 'none')
+OUTPUT_MODES = {'v': 'wu',   # uncompressed VCF
+                'z': 'wz',   # bgzip compressed VCF
+                'b': 'wb',   # compressed BCF
+                'u': 'wb0'}  # uncompressed BCF (BGZF level 0) for piping
 logger = logging.getLogger(PROG_NAME)
 logger.setLevel(logging.INFO)
 formatter = logging.Formatter(
@@ -16,6 +47,24 @@ ch.setLevel(logging.INFO)
 ch.setFormatter(formatter)
 logger.addHandler(ch)
 
+GroupFilter = namedtuple("GroupFilter", "name case control case_filter " +
+                         "control_filter min_case_vaf max_control_vaf " +
+                         "vaf_ratio info_tag")
+
+
+def subset_samples(vcf, samples):
+    '''
+    Restrict pysam.VariantFile vcf to samples so that FORMAT values of other
+    samples are not decoded. This also removes other samples from the
+    header, and therefore from any output written using this header.
+    Returns the retained sample names in the order they appear in the
+    header.
+    '''
+    keep = set(samples)
+    subset = [x for x in vcf.header.samples if x in keep]
+    vcf.subset_samples(subset)
+    return subset
+
 
 def check_samples(vcf, samples):
     missing = [x for x in samples if x not in vcf.header.samples]
@@ -24,113 +73,1589 @@ def check_samples(vcf, samples):
                          "the VCF: " + ",".join(missing))
 
 
-def get_format_filter(vcf, expressions):
+def get_format_filter(vcf, expressions, adaptive=False):
     if not expressions:
         return None
-    return FormatFilter(vcf=vcf, expressions=expressions, logger=logger)
+    return FormatFilter(vcf=vcf, expressions=expressions, logger=logger,
+                        adaptive=adaptive)
+
+
+def get_site_filter(vcf, info_expressions=[], pass_only=False,
+                    min_qual=None):
+    if not info_expressions and not pass_only and min_qual is None:
+        return None
+    return SiteFilter(vcf, info_expressions=info_expressions,
+                      pass_only=pass_only, min_qual=min_qual, logger=logger)
 
 
-def get_max_vafs(record, samples, vaf_func):
-    vafs = []
-    for i in range(1, len(record.alleles)):
-        vafs.append(max(vaf_func(record, x, i) for x in samples))
+def get_max_vafs(record, samples, vaf_func, cache=None, mask=None):
+    '''
+    Return a list of the maximum VAF of each ALT allele of record in
+    samples, using vaf_func (as returned by get_vaf_method with
+    all_alleles=True). If mask is given only the VAFs of the ALT alleles
+    with bits set in mask are required and others may be 0.0.
+    '''
+    cache = get_cache(record, cache)
+    vafs = None
+    for x in samples:
+        sample_vafs = vaf_func(record, x, cache, mask)
+        if vafs is None:
+            vafs = sample_vafs
+        elif sample_vafs != vafs:  # one VAF per ALT allele for all samples
+            vafs = [max(vafs[i], sample_vafs[i]) for i in range(len(vafs))]
+    if vafs is None:
+        return [0.0] * (len(record.alleles) - 1)
     return vafs
 
 
 def add_info_tag(vcf, tag):
-    if tag in vcf.header.info:
-        if vcf.header.info[tag].number != 1:
+    header = getattr(vcf, 'header', vcf)
+    if tag in header.info:
+        if header.info[tag].number != 1:
             raise ValueError("INFO tag '{}' already exists ".format(tag) +
                              "but has Number '{}' - will not overwite."
-                             .format(vcf.header.info[tag].number))
+                             .format(header.info[tag].number))
         logger.warn("Overwriting pre-existing '{}' INFO field".format(tag))
-    vcf.header.info.add(tag, '1', 'Integer',
-                        'Bitwise flag indicating which values passed filter ' +
-                        'expressions from ' + PROG_NAME)
+    header.info.add(tag, '1', 'Integer',
+                    'Bitwise flag indicating which values passed filter ' +
+                    'expressions from ' + PROG_NAME)
+
+
+def get_filters(vcf, case_expressions=[], control_expressions=[],
+                min_case_vaf=None, max_control_vaf=None, vaf_ratio=None,
+                reorder_expressions=False):
+    '''
+    Return a tuple of case FormatFilter, control FormatFilter and VAF
+    calculation method for vcf. Any of these may be None if not required.
+    If reorder_expressions is True the FormatFilters reorder their
+    expressions adaptively (see FormatFilter).
+    '''
+    vaf_calculation = None
+    if min_case_vaf or max_control_vaf or vaf_ratio:
+        vaf_calculation = get_vaf_method(vcf, all_alleles=True)
+    case_filter = get_format_filter(vcf, case_expressions,
+                                    adaptive=reorder_expressions)
+    control_filter = get_format_filter(vcf, control_expressions,
+                                       adaptive=reorder_expressions)
+    return case_filter, control_filter, vaf_calculation
+
+
+def _indexed_contigs(variants):
+    ''' Return contigs in the index of variants in header order. '''
+    indexed = set(variants.index)
+    contigs = [c for c in variants.header.contigs if c in indexed]
+    contigs.extend(c for c in variants.index if c not in contigs)
+    return contigs
+
+
+def get_intervals(variants, regions=None, regions_file=None, sites=None,
+                  exclude=None):
+    '''
+    Return a tuple of a sorted list of merged Intervals to fetch from
+    variants and a dict of target sites. Either may be None if the whole
+    input is to be read or no target sites are given.
+    '''
+    if sites and (regions or regions_file):
+        raise ValueError("--sites can not be used in conjunction with " +
+                         "--regions or --regions_file options.")
+    if not (regions or regions_file or sites or exclude):
+        return None, None
+    if variants.index is None:
+        if regions or regions_file or sites:
+            raise ValueError("Input must be bgzip compressed and indexed " +
+                             "in order to use --regions, --regions_file " +
+                             "or --sites options.")
+        return None, None
+    indexed = set(variants.index)
+    contigs = _indexed_contigs(variants)
+    target_sites = None
+    if sites:
+        target_sites = read_sites(sites)
+        intervals = site_intervals(target_sites)
+    elif regions or regions_file:
+        intervals = [parse_region(x, indexed) for x in regions or []]
+        if regions_file:
+            intervals.extend(read_bed(regions_file))
+    else:
+        intervals = [Interval(c, 0, None) for c in contigs]
+    missing = set(x.contig for x in intervals if x.contig not in indexed)
+    if missing:
+        logger.warn("No variants in input for contig(s) " +
+                    ", ".join(sorted(missing)))
+    if exclude:
+        contigs = exclude_contigs(contigs, exclude)
+    return merge_intervals(intervals, contigs), target_sites
+
+
+def genotype_flag(cache, n_alts, case=[], control=[], flag=None):
+    '''
+    Return a bitwise flag with bits set for each ALT allele carried by at
+    least one case and none of the control samples. If flag is given, only
+    ALT alleles with bits set in flag are considered.
+    '''
+    if flag is None:
+        flag = set_first_bits(n_alts)  # bitwise flag per ALT
+    if case:
+        carried = 0
+        for x in case:
+            carried |= allele_bits(cache[x, 'GT'])
+            if carried & flag == flag:
+                break
+        flag &= carried
+    for x in control:
+        if not flag:
+            break
+        flag &= ~allele_bits(cache[x, 'GT'])
+    return flag
+
+
+def vaf_flag(record, cache, filter_flag, case=[], control=[],
+             vaf_calculation=None, min_case_vaf=None, max_control_vaf=None,
+             vaf_ratio=None, computed=None):
+    '''
+    Return filter_flag with bits unset for ALT alleles not meeting the VAF
+    thresholds. If computed is a dict, the maximum VAFs of control and case
+    samples are stored in it under 'control' and 'case' when calculated
+    (VAFs are exact for ALT alleles still set in the returned flag).
+    '''
+    n_alts = len(record.alts)
+    ca_vafs = None
+    co_vafs = None
+    if max_control_vaf or vaf_ratio:
+        co_vafs = get_max_vafs(record, control, vaf_calculation, cache,
+                               filter_flag)
+        if computed is not None:
+            computed['control'] = co_vafs
+        if max_control_vaf:
+            for i in range(n_alts):
+                filter_flag &= ~((co_vafs[i] > max_control_vaf) << i)
+            if not filter_flag:
+                return filter_flag
+    if min_case_vaf or vaf_ratio:
+        ca_vafs = get_max_vafs(record, case, vaf_calculation, cache,
+                               filter_flag)
+        if computed is not None:
+            computed['case'] = ca_vafs
+        if min_case_vaf:
+            for i in range(n_alts):
+                filter_flag &= ~((ca_vafs[i] < min_case_vaf) << i)
+            if not filter_flag:
+                return filter_flag
+    if vaf_ratio:
+        for i in range(n_alts):
+            if co_vafs[i] > 0.0:
+                filter_flag &= ~((ca_vafs[i]/co_vafs[i] < vaf_ratio) << i)
+            elif ca_vafs[i] == 0.0:
+                filter_flag &= ~(1 << i)  # unset if case VAF is zero
+    return filter_flag
+
+
+def record_flag(record, cache, case=[], control=[], ignore_genotypes=False,
+                case_filter=None, control_filter=None, vaf_calculation=None,
+                min_case_vaf=None, max_control_vaf=None, vaf_ratio=None,
+                site_flag=None, computed=None):
+    '''
+    Return a bitwise flag with bits set for each ALT allele of record
+    passing the genotype, FORMAT expression and VAF filters for the given
+    case and control samples. FORMAT values are read via cache, which is
+    shared by all stages. If site_flag (as returned by
+    cafex.site_filter.SiteFilter.filter) is given, only ALT alleles with
+    bits set in site_flag are considered. See vaf_flag for computed.
+    '''
+    n_alts = len(record.alts)
+    if ignore_genotypes:
+        filter_flag = set_first_bits(n_alts) if site_flag is None \
+            else site_flag
+    else:
+        filter_flag = genotype_flag(cache, n_alts, case, control, site_flag)
+    # are we done already?
+    if not filter_flag:
+        return filter_flag
+    if control_filter is not None:
+        filter_flag &= control_filter.filter(record, control, cache)
+        if not filter_flag:
+            return filter_flag
+    if case_filter is not None:
+        filter_flag &= case_filter.filter(record, case, cache)
+        if not filter_flag:
+            return filter_flag
+    if min_case_vaf or max_control_vaf or vaf_ratio:
+        filter_flag = vaf_flag(record, cache, filter_flag, case, control,
+                               vaf_calculation, min_case_vaf,
+                               max_control_vaf, vaf_ratio, computed)
+    return filter_flag
+
+
+def _record_flag_stats(record, new_cache, stats, case=[], control=[],
+                       ignore_genotypes=False, case_filter=None,
+                       control_filter=None, vaf_calculation=None,
+                       min_case_vaf=None, max_control_vaf=None,
+                       vaf_ratio=None, site_filter=None, computed=None):
+    '''
+    As for record_flag, but also records the time taken by each stage and
+    the number of ALT alleles it removes in ContigStats stats. A cache for
+    record is created using new_cache unless site_filter filters all ALT
+    alleles. If computed is a dict, the cache is stored in it under 'cache'
+    along with any VAFs calculated (see vaf_flag).
+    '''
+    n_alts = len(record.alts)
+    stats.records += 1
+    stats.alts += n_alts
+    filter_flag = set_first_bits(n_alts)
+    if site_filter is not None:
+        start = time.perf_counter()
+        before, filter_flag = filter_flag, site_filter.filter(record)
+        stats.add_stage('site', start, before, filter_flag)
+        if not filter_flag:
+            return filter_flag
+    cache = new_cache(record)
+    if computed is not None:
+        computed['cache'] = cache
+    if filter_flag and not ignore_genotypes:
+        start = time.perf_counter()
+        before, filter_flag = filter_flag, genotype_flag(cache, n_alts, case,
+                                                         control, filter_flag)
+        stats.add_stage('genotypes', start, before, filter_flag)
+    if filter_flag and control_filter is not None:
+        start = time.perf_counter()
+        before = filter_flag
+        filter_flag &= control_filter.filter_stats(
+            record, control, cache, stats.expressions['control_expressions'])
+        stats.add_stage('control_expressions', start, before, filter_flag)
+    if filter_flag and case_filter is not None:
+        start = time.perf_counter()
+        before = filter_flag
+        filter_flag &= case_filter.filter_stats(
+            record, case, cache, stats.expressions['case_expressions'])
+        stats.add_stage('case_expressions', start, before, filter_flag)
+    if filter_flag and (min_case_vaf or max_control_vaf or vaf_ratio):
+        start = time.perf_counter()
+        before = filter_flag
+        filter_flag = vaf_flag(record, cache, filter_flag, case, control,
+                               vaf_calculation, min_case_vaf,
+                               max_control_vaf, vaf_ratio, computed)
+        stats.add_stage('vaf', start, before, filter_flag)
+    if filter_flag:
+        stats.passed += 1
+    return filter_flag
+
+
+def flag_variants(records, case=[], control=[], ignore_genotypes=False,
+                  case_filter=None, control_filter=None, vaf_calculation=None,
+                  min_case_vaf=None, max_control_vaf=None, vaf_ratio=None,
+                  batch_size=None, backend='pysam', stats=None,
+                  site_filter=None, computed=None):
+    '''
+    Yield a tuple of each record in records and a bitwise flag with bits
+    set for each ALT allele passing all filters (see record_flag).
+
+    If computed is a dict, it is cleared before each record is yielded and
+    then holds the FormatCache of the record under 'cache' (unless
+    site_filter filtered all ALT alleles) and any maximum VAFs of case and
+    control samples calculated by the VAF filters under 'case' and
+    'control', so that these can be reused for passing records.
+
+    If site_filter (a cafex.site_filter.SiteFilter) is given it is applied
+    first and FORMAT values are not read for records it filters.
+
+    If batch_size is given, case_filter and control_filter expressions are
+    evaluated for blocks of up to batch_size records at a time using NumPy
+    (see cafex.batch_filter). Flags are identical to those when batch_size
+    is None.
+
+    backend is the name of the backend used to read FORMAT values from
+    records (see cafex.format_cache.get_backend).
+
+    If stats is a cafex.stats.RunStats object, timings and the numbers of
+    ALT alleles removed by each stage are added to it. Records are then
+    always evaluated individually, regardless of batch_size.
+    '''
+    if stats is not None:
+        new_cache = get_backend(backend)
+        for record in records:
+            if computed is not None:
+                computed.clear()
+            yield record, _record_flag_stats(
+                record, new_cache, stats.contig(record.chrom), case,
+                control, ignore_genotypes, case_filter, control_filter,
+                vaf_calculation, min_case_vaf, max_control_vaf, vaf_ratio,
+                site_filter, computed)
+        return
+    if batch_size:
+        yield from _flag_variant_blocks(
+            records, case=case, control=control,
+            ignore_genotypes=ignore_genotypes, case_filter=case_filter,
+            control_filter=control_filter, vaf_calculation=vaf_calculation,
+            min_case_vaf=min_case_vaf, max_control_vaf=max_control_vaf,
+            vaf_ratio=vaf_ratio, batch_size=batch_size, backend=backend,
+            site_filter=site_filter, computed=computed)
+        return
+    new_cache = get_backend(backend)
+    if computed is not None:
+        for record in records:
+            computed.clear()
+            site_flag = None
+            if site_filter is not None:
+                site_flag = site_filter.filter(record)
+                if not site_flag:
+                    yield record, site_flag
+                    continue
+            cache = computed['cache'] = new_cache(record)
+            yield record, record_flag(record, cache, case, control,
+                                      ignore_genotypes, case_filter,
+                                      control_filter, vaf_calculation,
+                                      min_case_vaf, max_control_vaf,
+                                      vaf_ratio, site_flag, computed)
+        return
+    if site_filter is not None:
+        for record in records:
+            site_flag = site_filter.filter(record)
+            if not site_flag:
+                yield record, site_flag
+                continue
+            yield record, record_flag(record, new_cache(record), case,
+                                      control, ignore_genotypes, case_filter,
+                                      control_filter, vaf_calculation,
+                                      min_case_vaf, max_control_vaf,
+                                      vaf_ratio, site_flag)
+        return
+    for record in records:
+        yield record, record_flag(record, new_cache(record), case, control,
+                                  ignore_genotypes, case_filter,
+                                  control_filter, vaf_calculation,
+                                  min_case_vaf, max_control_vaf, vaf_ratio)
+
+
+def _flag_variant_blocks(records, case=[], control=[], ignore_genotypes=False,
+                         case_filter=None, control_filter=None,
+                         vaf_calculation=None, min_case_vaf=None,
+                         max_control_vaf=None, vaf_ratio=None,
+                         batch_size=10_000, backend='pysam',
+                         site_filter=None, computed=None):
+    '''
+    As for flag_variants, but reads records in blocks of batch_size and
+    evaluates FORMAT filter expressions for all records of a block that
+    pass the site and genotype checks at once using NumPy.
+    '''
+    try:
+        from .batch_filter import BatchFormatFilter
+    except ImportError:
+        raise ValueError("NumPy must be installed in order to filter " +
+                         "records in batches.")
+    new_cache = get_backend(backend)
+    filters = []
+    if control_filter is not None:
+        filters.append((BatchFormatFilter(control_filter), control))
+    if case_filter is not None:
+        filters.append((BatchFormatFilter(case_filter), case))
+    check_vafs = min_case_vaf or max_control_vaf or vaf_ratio
+    records = iter(records)
+    while True:
+        block = list(islice(records, batch_size))
+        if not block:
+            break
+        if site_filter is not None:
+            site_flags = [site_filter.filter(x) for x in block]
+        else:
+            site_flags = [None] * len(block)
+        caches = [None if x == 0 else new_cache(y) for x, y in
+                  zip(site_flags, block)]
+        flags = []
+        for record, cache, site_flag in zip(block, caches, site_flags):
+            if site_flag == 0:
+                flags.append(0)
+            elif ignore_genotypes:
+                flags.append(set_first_bits(len(record.alts))
+                             if site_flag is None else site_flag)
+            else:
+                flags.append(genotype_flag(cache, len(record.alts), case,
+                                           control, site_flag))
+        for batch_filter, samples in filters:
+            # only evaluate records that have not already been filtered
+            indices = [i for i, f in enumerate(flags) if f]
+            if not indices:
+                break
+            results = batch_filter.filter([block[i] for i in indices],
+                                          samples,
+                                          [caches[i] for i in indices])
+            for i, f in zip(indices, results):
+                flags[i] &= f
+        for record, cache, filter_flag in zip(block, caches, flags):
+            if computed is not None:
+                computed.clear()
+                if cache is not None:
+                    computed['cache'] = cache
+            if filter_flag and check_vafs:
+                filter_flag = vaf_flag(record, cache, filter_flag, case,
+                                       control, vaf_calculation,
+                                       min_case_vaf, max_control_vaf,
+                                       vaf_ratio, computed)
+            yield record, filter_flag
+
+
+def filter_variants(records, out, case=[], control=[], ignore_genotypes=False,
+                    case_filter=None, control_filter=None,
+                    vaf_calculation=None, min_case_vaf=None,
+                    max_control_vaf=None, vaf_ratio=None, info_tag=None,
+                    progress_interval=100_000, batch_size=None,
+                    backend='pysam', stats=None, progress=None,
+                    checkpoint=None, site_filter=None, drop_formats=None,
+                    table=None, sites_header=None):
+    '''
+    Filter records, writing those with at least one ALT allele passing all
+    filters to out. Returns a tuple of the number of records read and
+    written. See flag_variants for batch_size, backend, stats and
+    site_filter arguments. Values of any FORMAT fields named in
+    drop_formats are removed from records before they are written. If
+    table (a cafex.table_output.TableWriter) is given, a row for each
+    passing ALT allele is also written to table, reusing the FORMAT values
+    and VAFs already calculated by the filters. If sites_header is given,
+    records are written without samples (see cafex.sites_only) and
+    sites_header should be the header of out.
+
+    Progress is reported using progress (a cafex.progress.Progress object)
+    if given, or otherwise logged every progress_interval records. If
+    checkpoint (a cafex.checkpoint.Checkpoint object) is given, out must be
+    a pysam.VariantFile, which is flushed at each checkpoint.
+    '''
+    if progress is None and progress_interval:
+        progress = Progress(logger, interval=progress_interval)
+    next_check = progress.next_check if progress else float('inf')
+    next_save = checkpoint.next_check if checkpoint else float('inf')
+    read, written = 0, 0
+    computed = None if table is None else dict()
+    for record, filter_flag in flag_variants(
+            records, case=case, control=control,
+            ignore_genotypes=ignore_genotypes, case_filter=case_filter,
+            control_filter=control_filter, vaf_calculation=vaf_calculation,
+            min_case_vaf=min_case_vaf, max_control_vaf=max_control_vaf,
+            vaf_ratio=vaf_ratio, batch_size=batch_size, backend=backend,
+            stats=stats, site_filter=site_filter, computed=computed):
+        if read >= next_check:
+            next_check = progress.check(read, written, record)
+        if read >= next_save:
+            next_save = checkpoint.check(out, record, read, written)
+        read += 1
+        if filter_flag:
+            if info_tag:
+                record.info[info_tag] = filter_flag
+            if table is not None:
+                table.write(record, filter_flag, computed.get('cache'),
+                            computed.get('case'), computed.get('control'))
+            if sites_header is not None:
+                record = sites_record(sites_header, record)
+            elif drop_formats:
+                remove_fields(record, drop_formats)
+            out.write(record)
+            written += 1
+    return read, written
+
+
+class CaseControlFilter(object):
+    '''
+    Filter pysam.VariantRecords for ALT alleles carried by case samples but
+    not control samples using the genotype, FORMAT expression and VAF
+    filters of the cafex program. A CaseControlFilter is created once for a
+    VCF header and can then filter records from any source with the same
+    header (e.g. an open pysam.VariantFile) without any file I/O.
+
+    Example:
+            vcf = pysam.VariantFile('input.bcf')
+            ccf = CaseControlFilter(vcf.header, case=['child'],
+                                    control=['mum', 'dad'],
+                                    min_case_vaf=0.25)
+            for record, flag in ccf.filter(vcf):
+                # do something with record - bits are set in flag for
+                # each ALT allele passing filters
+
+    '''
+
+    def __init__(self, header, case=[], control=[], ignore_genotypes=False,
+                 case_expressions=[], control_expressions=[],
+                 min_case_vaf=None, max_control_vaf=None, vaf_ratio=None,
+                 reorder_expressions=False, batch_size=None,
+                 backend='pysam', info_expressions=[], pass_only=False,
+                 min_qual=None):
+        '''
+        Args:
+            header: pysam.VariantHeader (or pysam.VariantFile) of the
+                    records to be filtered.
+
+        Other arguments are as for the equivalent options of the cafex
+        program (see cafex --help).
+        '''
+        if not case and not control:
+            raise ValueError("At least one case or control sample must be " +
+                             "given.")
+        self.new_cache = get_backend(backend)
+        self.case = get_sample_handles(header, case)
+        self.control = get_sample_handles(header, control)
+        self.ignore_genotypes = ignore_genotypes
+        self.case_filter, self.control_filter, self.vaf_calculation = \
+            get_filters(header,
+                        case_expressions=case_expressions,
+                        control_expressions=control_expressions,
+                        min_case_vaf=min_case_vaf,
+                        max_control_vaf=max_control_vaf,
+                        vaf_ratio=vaf_ratio,
+                        reorder_expressions=reorder_expressions)
+        self.site_filter = get_site_filter(header,
+                                           info_expressions=info_expressions,
+                                           pass_only=pass_only,
+                                           min_qual=min_qual)
+        self.min_case_vaf = min_case_vaf
+        self.max_control_vaf = max_control_vaf
+        self.vaf_ratio = vaf_ratio
+        self.batch_size = batch_size
+        self.backend = backend
+
+    def evaluate(self, record, cache=None):
+        '''
+        Return a bitwise flag with bits set for each ALT allele of record
+        passing all filters. A flag of 0 indicates that no ALT allele
+        passed.
+
+        Args:
+            record: pysam.VariantRecord
+
+            cache:  Optional FormatCache for record, which allows FORMAT
+                    values to be shared with other code.
+        '''
+        site_flag = None
+        if self.site_filter is not None:
+            site_flag = self.site_filter.filter(record)
+            if not site_flag:
+                return site_flag
+        if cache is None:
+            cache = self.new_cache(record)
+        return record_flag(record, cache, self.case, self.control,
+                           self.ignore_genotypes, self.case_filter,
+                           self.control_filter, self.vaf_calculation,
+                           self.min_case_vaf, self.max_control_vaf,
+                           self.vaf_ratio, site_flag)
+
+    def filter(self, records):
+        '''
+        For each record in iterable records with at least one ALT allele
+        passing all filters, yield a tuple of the record and its bitwise
+        flag (as returned by the evaluate method).
+        '''
+        for record, flag in flag_variants(
+                records, case=self.case, control=self.control,
+                ignore_genotypes=self.ignore_genotypes,
+                case_filter=self.case_filter,
+                control_filter=self.control_filter,
+                vaf_calculation=self.vaf_calculation,
+                min_case_vaf=self.min_case_vaf,
+                max_control_vaf=self.max_control_vaf,
+                vaf_ratio=self.vaf_ratio, batch_size=self.batch_size,
+                backend=self.backend, site_filter=self.site_filter):
+            if flag:
+                yield record, flag
+
+
+def get_group_filters(vcf, groups, info_prefix=None,
+                      reorder_expressions=False):
+    '''
+    Return a tuple of a list of GroupFilters, one for each
+    cafex.groups.Group in groups, and a VAF calculation method shared by
+    all groups (None if no group has VAF thresholds). The VAF method
+    memoizes VAFs per record so that the VAFs of samples in more than one
+    group are only calculated once. If info_prefix is given, each
+    GroupFilter is given an INFO tag made from info_prefix and its name.
+    '''
+    filters = []
+    vaf_calculation = None
+    tags = dict()
+    for group in groups:
+        case_filter, control_filter, group_vaf = get_filters(
+            vcf,
+            case_expressions=group.case_expressions,
+            control_expressions=group.control_expressions,
+            min_case_vaf=group.min_case_vaf,
+            max_control_vaf=group.max_control_vaf,
+            vaf_ratio=group.vaf_ratio,
+            reorder_expressions=reorder_expressions)
+        if group_vaf is not None and vaf_calculation is None:
+            vaf_calculation = VafMemo(group_vaf)
+        tag = None
+        if info_prefix:
+            tag = info_tag_name(info_prefix, group.name)
+            if tag in tags:
+                raise ValueError("Groups '{}' and '{}' ".format(tags[tag],
+                                                                group.name) +
+                                 "would both use INFO tag '{}'".format(tag))
+            tags[tag] = group.name
+        filters.append(GroupFilter(
+            name=group.name,
+            case=get_sample_handles(vcf, group.case),
+            control=get_sample_handles(vcf, group.control),
+            case_filter=case_filter,
+            control_filter=control_filter,
+            min_case_vaf=group.min_case_vaf,
+            max_control_vaf=group.max_control_vaf,
+            vaf_ratio=group.vaf_ratio,
+            info_tag=tag))
+    return filters, vaf_calculation
+
+
+def filter_groups(records, out, groups, ignore_genotypes=False,
+                  vaf_calculation=None, info_tag=None,
+                  progress_interval=100_000, backend='pysam', progress=None,
+                  site_filter=None, drop_formats=None, sites_header=None):
+    '''
+    Filter records for several case/control groups (GroupFilters as
+    returned by get_group_filters) in a single pass. FORMAT values are read
+    once per record and shared between groups, as are VAFs if
+    vaf_calculation is a VafMemo.
+
+    out may be a single output, to which records passing the filters of any
+    group are written with each passing group's flag added to the group's
+    INFO tag, or a list of outputs (one per group) to which records passing
+    each group's filters are written. In the latter case, if info_tag is
+    given the group's flag is added to this INFO tag of each record.
+
+    If site_filter (a cafex.site_filter.SiteFilter) is given it is applied
+    once per record before any group's filters. Values of any FORMAT fields
+    named in drop_formats are removed from records before they are written.
+    If sites_header is given, records are written without samples (see
+    cafex.sites_only).
+
+    Returns a tuple of the number of records read, the number passing for
+    at least one group and a list of the number passing for each group.
+    Progress is reported as for filter_variants.
+    '''
+    new_cache = get_backend(backend)
+    split = isinstance(out, list)
+    if progress is None and progress_interval:
+        progress = Progress(logger, interval=progress_interval)
+    next_check = progress.next_check if progress else float('inf')
+    read, written = 0, 0
+    passed = [0] * len(groups)
+    for record in records:
+        if read >= next_check:
+            next_check = progress.check(read, written, record)
+        read += 1
+        site_flag = None
+        if site_filter is not None:
+            site_flag = site_filter.filter(record)
+            if not site_flag:
+                continue
+        cache = new_cache(record)  # shared by all groups
+        flags = [record_flag(record, cache, x.case, x.control,
+                             ignore_genotypes, x.case_filter,
+                             x.control_filter, vaf_calculation,
+                             x.min_case_vaf, x.max_control_vaf, x.vaf_ratio,
+                             site_flag)
+                 for x in groups]
+        if not any(flags):
+            continue
+        written += 1
+        if drop_formats:
+            remove_fields(record, drop_formats)
+        for i, (group, filter_flag) in enumerate(zip(groups, flags)):
+            if group.info_tag:
+                if filter_flag:
+                    record.info[group.info_tag] = filter_flag
+                else:  # remove any pre-existing value
+                    record.info.pop(group.info_tag, None)
+            if not filter_flag:
+                continue
+            passed[i] += 1
+            if split:
+                group_record = record
+                if info_tag:
+                    # copy as records may be written by another thread
+                    group_record = record.copy()
+                    group_record.info[info_tag] = filter_flag
+                if sites_header is not None:
+                    group_record = sites_record(sites_header, group_record)
+                out[i].write(group_record)
+        if not split:
+            if sites_header is not None:
+                record = sites_record(sites_header, record)
+            out.write(record)
+    return read, written, passed
+
+
+def _filter_chunk(task):
+    '''
+    Worker function for parallel processing. Filters records from one chunk
+    of intervals and writes them to a temporary uncompressed BCF (and rows
+    for passing ALT alleles to a temporary Arrow IPC file if
+    kwargs['table_fields'] is given). Returns the temporary filename, the
+    numbers of records read and written and a RunStats object (None unless
+    kwargs['stats'] is True).
+    '''
+    vcf, intervals, previous, sites, tmp_out, kwargs = task
+    kwargs = kwargs.copy()
+    case_expressions = kwargs.pop('case_expressions')
+    control_expressions = kwargs.pop('control_expressions')
+    reorder_expressions = kwargs.pop('reorder_expressions')
+    info_expressions = kwargs.pop('info_expressions')
+    pass_only = kwargs.pop('pass_only')
+    min_qual = kwargs.pop('min_qual')
+    subset = kwargs.pop('subset')
+    table_fields = kwargs.pop('table_fields', None)
+    sites_only = kwargs.pop('sites_only', False)
+    stats = None
+    if kwargs.pop('stats'):
+        stats = RunStats(case_expressions, control_expressions)
+    with pysam.VariantFile(vcf) as variants:
+        if subset:
+            variants.subset_samples(subset)
+        case_filter, control_filter, vaf_calculation = get_filters(
+            variants,
+            case_expressions=case_expressions,
+            control_expressions=control_expressions,
+            min_case_vaf=kwargs['min_case_vaf'],
+            max_control_vaf=kwargs['max_control_vaf'],
+            vaf_ratio=kwargs['vaf_ratio'],
+            reorder_expressions=reorder_expressions)
+        site_filter = get_site_filter(variants,
+                                      info_expressions=info_expressions,
+                                      pass_only=pass_only,
+                                      min_qual=min_qual)
+        if kwargs['info_tag']:
+            add_info_tag(variants, kwargs['info_tag'])
+        records = fetch_intervals(variants, intervals, previous)
+        if sites is not None:
+            records = filter_sites(records, sites)
+        table = None
+        if table_fields is not None:
+            table = _open_table(_chunk_table(tmp_out), variants,
+                                kwargs['case'], kwargs['control'],
+                                table_fields, vaf_calculation,
+                                table_format='arrow')
+        header = variants.header
+        if sites_only:
+            header = get_sites_header(header)
+        with pysam.VariantFile(tmp_out, 'wb0', header=header) as out:
+            read, written = filter_variants(
+                records,
+                out,
+                case_filter=case_filter,
+                control_filter=control_filter,
+                vaf_calculation=vaf_calculation,
+                progress_interval=None,
+                stats=stats,
+                site_filter=site_filter,
+                table=table,
+                sites_header=out.header if sites_only else None,
+                **kwargs)
+        if table is not None:
+            table.close()
+    return tmp_out, read, written, stats
+
+
+def _chunk_table(tmp_out):
+    ''' Temporary table filename for a chunk written to tmp_out. '''
+    return os.path.splitext(tmp_out)[0] + '.arrow'
+
+
+def _open_table(path, vcf, case=[], control=[], fields=[],
+                vaf_calculation=None, **kwargs):
+    '''
+    Return a cafex.table_output.TableWriter, raising a ValueError if
+    pyarrow is not installed. VAFs are calculated using vaf_calculation
+    (that of the filters, so that VAFs calculated for filtering are reused)
+    or otherwise the VAF method for vcf if there is one.
+    '''
+    try:
+        from .table_output import TableWriter
+    except ImportError:
+        raise ValueError("pyarrow must be installed in order to use " +
+                         "--table_output.")
+    if vaf_calculation is None:
+        try:
+            vaf_calculation = get_vaf_method(vcf, all_alleles=True)
+        except ValueError:  # no VAF columns if VAFs can not be calculated
+            pass
+    return TableWriter(path, vcf, case=case, control=control, fields=fields,
+                       vaf_calculation=vaf_calculation, **kwargs)
+
+
+def _get_chunks(vcf, variants, threads, intervals=None):
+    index = read_index(vcf, variants.header.contigs)
+    if index is None:
+        logger.warn("No index found for input - can not process in " +
+                    "parallel. Running on a single process.")
+        return None
+    if intervals is None:
+        intervals = contig_intervals(index)
+    return partition_intervals(intervals, index, threads * CHUNKS_PER_THREAD)
+
+
+def filter_parallel(vcf, chunks, out, threads, sites=None, stats=None,
+                    progress=None, checkpoint=None, table=None,
+                    sites_only=False, **kwargs):
+    '''
+    Filter chunks of an indexed VCF using a pool of worker processes and
+    write passing records to out in the original order. Returns a tuple of
+    the number of records read and written. If stats is a RunStats object
+    the stats collected by each worker are merged into it. Progress is
+    reported after each chunk using progress (a cafex.progress.Progress
+    object) if given. If checkpoint (a cafex.checkpoint.Checkpoint object)
+    is given a checkpoint is saved after each chunk is written. If table (a
+    cafex.table_output.TableWriter) is given, workers also write rows for
+    passing ALT alleles, which are appended to table in the same order. If
+    sites_only is True, records are written without samples.
+    '''
+    if progress is None:
+        progress = Progress(logger, interval=None)
+    if table is not None:
+        kwargs['table_fields'] = table.fields
+    if sites_only:
+        kwargs['sites_only'] = True
+    tmp_dir = tempfile.mkdtemp(prefix=PROG_NAME + '_')
+    tasks = []
+    for i, (intervals, previous) in enumerate(chunks):
+        tmp_out = os.path.join(tmp_dir, 'chunk_{}.bcf'.format(i))
+        chunk_sites = None
+        if sites is not None:
+            chunk_sites = dict((x.contig, sites[x.contig]) for x in
+                               intervals)
+        tasks.append((vcf, intervals, previous, chunk_sites, tmp_out,
+                      dict(kwargs, stats=stats is not None)))
+    read, written = 0, 0
+    logger.info("Processing {:,} chunks using {} processes"
+                .format(len(tasks), threads))
+    try:
+        for i, (tmp_out, n_read, n_written, chunk_stats) in enumerate(
+                process_chunks(_filter_chunk, tasks, threads)):
+            append_output(tmp_out, out)
+            if table is not None:
+                table.append(_chunk_table(tmp_out))
+            if stats is not None:
+                stats.merge(chunk_stats)
+            read += n_read
+            written += n_written
+            progress.report(read, written, fraction=(i + 1) / len(tasks),
+                            prefix="Finished chunk {:,}/{:,}. ".format(
+                                i + 1, len(tasks)))
+            if checkpoint is not None and i + 1 < len(chunks):
+                # records in the next chunk start after previous interval
+                following = chunks[i + 1][0][0]
+                previous = chunks[i][0][-1]
+                if following.contig == previous.contig:
+                    checkpoint.save(out, previous.contig, previous.end + 1,
+                                    read, written)
+                else:
+                    checkpoint.save(out, following.contig, 1, read, written)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return read, written
+
+
+def _get_shard(vcf, variants, shard, n_shards, intervals=None):
+    '''
+    Return the intervals of shard number 'shard' of n_shards for variants
+    and the interval preceding them, as for shard_intervals.
+    '''
+    index = read_index(vcf, variants.header.contigs)
+    if index is None:
+        raise ValueError("Input must be bgzip compressed and indexed in " +
+                         "order to use --shard.")
+    if intervals is None:
+        intervals = contig_intervals(index)
+    intervals, previous = shard_intervals(intervals, index, shard, n_shards)
+    if intervals:
+        logger.info("Shard {}/{} spans {}:{} to {}:{}".format(
+            shard, n_shards, intervals[0].contig, intervals[0].start + 1,
+            intervals[-1].contig, intervals[-1].end or 'end'))
+    else:
+        logger.warn("Shard {}/{} is empty - too few ".format(
+            shard, n_shards) + "records in input to split into " +
+            "{} shards.".format(n_shards))
+    return intervals, previous
+
+
+def _get_records(variants, intervals=None, target_sites=None,
+                 exclude=None, pipeline=False, previous=None):
+    ''' Return an iterable of the records from variants to filter. '''
+    records = variants
+    if intervals is not None:
+        records = fetch_intervals(variants, intervals, previous)
+        if target_sites is not None:
+            records = filter_sites(records, target_sites)
+    elif exclude:
+        logger.warn("Input is not indexed - records on excluded " +
+                    "contigs will be read but not output.")
+        records = skip_contigs(variants, exclude)
+    if pipeline:
+        records = read_ahead(records)
+    return records
+
+
+def output_mode(output, output_type=None, compression_level=None):
+    '''
+    Return the pysam mode for writing output.
+
+    Args:
+        output:     output filename ('-' for STDOUT).
+
+        output_type:
+                    one of the keys of OUTPUT_MODES. If None, the type is
+                    inferred from the extension of output - BCF for '.bcf',
+                    bgzip compressed VCF for '.gz' or '.bgz' and
+                    uncompressed VCF otherwise.
+
+        compression_level:
+                    BGZF compression level (0-9) for compressed VCF or BCF
+                    output. Uses the htslib default if None.
+    '''
+    if output_type is None:
+        if output.endswith('.bcf'):
+            output_type = 'b'
+        elif output.endswith(('.gz', '.bgz')):
+            output_type = 'z'
+        else:
+            output_type = 'v'
+    if output_type not in OUTPUT_MODES:
+        raise ValueError("Unrecognised output type '{}' - ".format(
+            output_type) + "must be one of " + ", ".join(OUTPUT_MODES))
+    mode = OUTPUT_MODES[output_type]
+    if compression_level is not None:
+        if output_type not in ('z', 'b'):
+            raise ValueError("--compression_level can only be used with " +
+                             "compressed VCF or BCF output.")
+        if not 0 <= compression_level <= 9:
+            raise ValueError("--compression_level must be between 0 and 9.")
+        mode += str(compression_level)
+    return mode
+
+
+def _open_output(output, header, io_threads=1, drop_formats=None,
+                 mode='w', sites_only=False):
+    if sites_only:
+        header = get_sites_header(header)
+    elif drop_formats:
+        header = header.copy()
+        remove_header_fields(header, drop_formats)
+    out = pysam.VariantFile(output, mode, header=header, threads=io_threads)
+    out.header.add_meta(key=PROG_NAME,
+                        value=str.join(" ", sys.argv) + "; Date=" +
+                        time.strftime("%Y-%m-%d %H:%M"))
+    return out
+
+
+def _write_index(output):
+    logger.info("Indexing output " + output)
+    logger.info("Wrote index " + index_vcf(output))
+
+
+def _group_samples(groups):
+    ''' Return unique samples from all groups in order of appearance. '''
+    samples = []
+    seen = set()
+    for group in groups:
+        for sample in group.case + group.control:
+            if sample not in seen:
+                seen.add(sample)
+                samples.append(sample)
+    return samples
+
+
+def _drop_formats(variants, ignore_genotypes=False, format_filters=(),
+                  vaf_calculation=None):
+    '''
+    Return a tuple of the FORMAT fields in the header of variants not used
+    by the given filters, logging the fields to be dropped from output.
+    '''
+    drop = unused_fields(variants.header,
+                         required_fields(ignore_genotypes=ignore_genotypes,
+                                         format_filters=format_filters,
+                                         vaf_calculation=vaf_calculation))
+    if drop:
+        logger.info("Dropping unused FORMAT fields from output: " +
+                    ", ".join(drop))
+    return drop
+
+
+def _main_groups(variants, groups, records, output, group_outputs=None,
+                 ignore_genotypes=False, info_tag=None,
+                 reorder_expressions=False, progress=None,
+                 backend='pysam', io_threads=1, pipeline=False,
+                 site_filter=None, drop_unused_formats=False, mode='w',
+                 write_index=False, sites_only=False):
+    '''
+    Filter records for each group in groups and write to a single output
+    with per-group INFO tags, or to one output per group if group_outputs
+    is given. Returns a tuple of the numbers of records read and written.
+    '''
+    info_prefix = None
+    if not group_outputs:
+        info_prefix = info_tag or PROG_NAME
+    group_filters, vaf_calculation = get_group_filters(
+        variants, groups, info_prefix=info_prefix,
+        reorder_expressions=reorder_expressions)
+    drop_formats = None
+    if drop_unused_formats:
+        format_filters = [f for x in group_filters for f in
+                          (x.case_filter, x.control_filter)]
+        drop_formats = _drop_formats(variants, ignore_genotypes,
+                                     format_filters, vaf_calculation)
+    if group_outputs:
+        if info_tag:
+            add_info_tag(variants, info_tag)
+        paths = [group_outputs.format(group=x.name) for x in groups]
+    else:
+        for group in group_filters:
+            add_info_tag(variants, group.info_tag)
+        paths = [output]
+    outs = [_open_output(x, variants.header, io_threads, drop_formats, mode,
+                         sites_only) for x in paths]
+    writers = [ThreadedWriter(x) if pipeline else x for x in outs]
+    try:
+        read, written, passed = filter_groups(
+            records, writers if group_outputs else writers[0],
+            group_filters,
+            ignore_genotypes=ignore_genotypes,
+            vaf_calculation=vaf_calculation,
+            info_tag=info_tag,
+            progress=progress,
+            backend=backend,
+            site_filter=site_filter,
+            drop_formats=drop_formats,
+            sites_header=outs[0].header if sites_only else None)
+        if pipeline:
+            for writer in writers:
+                writer.close()
+    finally:
+        for out in outs:
+            out.close()
+    if write_index:
+        for path in paths:
+            _write_index(path)
+    for group, n in zip(group_filters, passed):
+        logger.info("Group {}: {:,} variants passed.".format(group.name, n))
+    return read, written
+
+
+# filters per header_key for the current _main_inputs run, populated before
+# forking so that workers inherit them (FormatFilters can not be pickled)
+_input_filters = dict()
+
+
+def _get_input_filters(variants, options):
+    '''
+    Return a dict of the sample handles, filters and FORMAT fields to drop
+    for variants, reusing those created for any previous input of the
+    current run with a compatible header (see cafex.inputs.header_key).
+    '''
+    key = header_key(variants.header)
+    filters = _input_filters.get(key)
+    if filters is not None:
+        return filters
+    case_filter, control_filter, vaf_calculation = get_filters(
+        variants,
+        case_expressions=options['case_expressions'],
+        control_expressions=options['control_expressions'],
+        min_case_vaf=options['min_case_vaf'],
+        max_control_vaf=options['max_control_vaf'],
+        vaf_ratio=options['vaf_ratio'],
+        reorder_expressions=options['reorder_expressions'])
+    drop_formats = None
+    if options['drop_unused_formats']:
+        drop_formats = _drop_formats(variants, options['ignore_genotypes'],
+                                     (case_filter, control_filter),
+                                     vaf_calculation)
+    filters = _input_filters[key] = dict(
+        case=get_sample_handles(variants, options['case']),
+        control=get_sample_handles(variants, options['control']),
+        case_filter=case_filter,
+        control_filter=control_filter,
+        vaf_calculation=vaf_calculation,
+        site_filter=get_site_filter(
+            variants,
+            info_expressions=options['info_expressions'],
+            pass_only=options['pass_only'],
+            min_qual=options['min_qual']),
+        drop_formats=drop_formats)
+    return filters
+
+
+def _open_input(vcf, options):
+    ''' Open vcf for reading, checking and subsetting samples. '''
+    # an index is only needed for regions (checked by get_intervals)
+    variants = open_unindexed(vcf, threads=options['io_threads'])
+    samples = options['case'] + options['control']
+    check_samples(variants, samples)
+    if options['subset']:
+        subset_samples(variants, samples)
+    return variants
+
+
+def _filter_input(task):
+    '''
+    Worker function for processing several inputs. Filters all records of
+    one input and writes them to output using pysam mode. Returns output
+    and the numbers of records read and written.
+    '''
+    vcf, output, mode, options = task
+    with _open_input(vcf, options) as variants:
+        filters = _get_input_filters(variants, options)
+        intervals, target_sites = get_intervals(
+            variants,
+            regions=options['regions'],
+            regions_file=options['regions_file'],
+            sites=options['sites'],
+            exclude=options['exclude_contigs'])
+        records = _get_records(variants, intervals, target_sites,
+                               options['exclude_contigs'])
+        if options['info_tag']:
+            add_info_tag(variants, options['info_tag'])
+        out = _open_output(output, variants.header,
+                           drop_formats=filters['drop_formats'], mode=mode,
+                           sites_only=options['sites_only'])
+        try:
+            read, written = filter_variants(
+                records, out,
+                case=filters['case'],
+                control=filters['control'],
+                ignore_genotypes=options['ignore_genotypes'],
+                case_filter=filters['case_filter'],
+                control_filter=filters['control_filter'],
+                vaf_calculation=filters['vaf_calculation'],
+                min_case_vaf=options['min_case_vaf'],
+                max_control_vaf=options['max_control_vaf'],
+                vaf_ratio=options['vaf_ratio'],
+                info_tag=options['info_tag'],
+                progress_interval=None,
+                batch_size=options['batch_size'],
+                backend=options['backend'],
+                site_filter=filters['site_filter'],
+                drop_formats=filters['drop_formats'],
+                sites_header=out.header if options['sites_only'] else None)
+        finally:
+            out.close()
+    return output, read, written
+
+
+def _combined_header(inputs, options):
+    '''
+    Return a header for writing records from all inputs to a single output
+    and a tuple of the FORMAT fields that can be removed from it. Raises a
+    ValueError if inputs do not all have the same samples.
+    '''
+    header = None
+    drop = None
+    for x in inputs:
+        with _open_input(x.vcf, options) as variants:
+            filters = _get_input_filters(variants, options)
+            fields = set(filters['drop_formats'] or ())
+            drop = fields if drop is None else drop & fields
+            if header is None:
+                header = variants.header.copy()
+            elif list(variants.header.samples) != list(header.samples):
+                raise ValueError("Samples in {} differ from ".format(x.vcf) +
+                                 "those in {} - ".format(inputs[0].vcf) +
+                                 "can not write inputs to a single output.")
+            else:
+                header.merge(variants.header)
+    if options['info_tag']:
+        add_info_tag(header, options['info_tag'])
+    return header, tuple(x for x in header.formats if x in drop)
+
+
+def _main_inputs(inputs, output, options, threads=1, modes=['w'],
+                 write_index=False):
+    '''
+    Filter several inputs (cafex.inputs.Input tuples), processing up to
+    threads inputs at once. Each input is written to its own output if
+    inputs have outputs or all are written to output in the order given.
+    modes gives the pysam mode for each input's output or a single mode for
+    output. Filters are created once per run for each distinct input
+    header. Returns a tuple of the numbers of records read and written.
+    '''
+    _input_filters.clear()  # never reuse filters from a previous run
+    try:
+        return _filter_inputs(inputs, output, options, threads, modes,
+                              write_index)
+    finally:
+        _input_filters.clear()
+
+
+def _filter_inputs(inputs, output, options, threads=1, modes=['w'],
+                   write_index=False):
+    split = inputs[0].output is not None
+    tmp_dir = None
+    out = None
+    if split:
+        for x in inputs:  # check inputs and create filters before forking
+            with _open_input(x.vcf, options) as variants:
+                _get_input_filters(variants, options)
+        tasks = [(x.vcf, x.output, y, options) for x, y in
+                 zip(inputs, modes)]
+    else:
+        header, drop_formats = _combined_header(inputs, options)
+        out = _open_output(output, header, options['io_threads'],
+                           drop_formats, modes[0], options['sites_only'])
+        tmp_dir = tempfile.mkdtemp(prefix=PROG_NAME + '_')
+        tasks = [(x.vcf, os.path.join(tmp_dir, 'input_{}.bcf'.format(i)),
+                  'wb0', options) for i, x in enumerate(inputs)]
+    logger.info("Processing {:,} inputs using {} process{}".format(
+        len(tasks), threads, 'es' if threads > 1 else ''))
+    if threads > 1:
+        results = process_chunks(_filter_input, tasks, threads)
+    else:
+        results = map(_filter_input, tasks)
+    read, written = 0, 0
+    try:
+        for x, (path, n_read, n_written) in zip(inputs, results):
+            if split:
+                if write_index:
+                    _write_index(path)
+            else:
+                append_output(path, out)
+            read += n_read
+            written += n_written
+            logger.info("Finished {}: {:,} variants read, {:,} written."
+                        .format(x.vcf, n_read, n_written))
+    finally:
+        if out is not None:
+            out.close()
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    if write_index and not split:
+        _write_index(output)
+    return read, written
 
 
 def main(vcf, case=[], control=[], output=None, ignore_genotypes=False,
          case_expressions=[], control_expressions=[], min_case_vaf=None,
-         max_control_vaf=None, vaf_ratio=None, info_tag=None,
-         progress_interval=100_000, quiet=False, debug=False):
+         max_control_vaf=None, vaf_ratio=None, info_expressions=[],
+         pass_only=False, min_qual=None, info_tag=None,
+         progress_interval=100_000, regions=None, regions_file=None,
+         sites=None, exclude_contigs=None, threads=1, batch_size=None,
+         backend='pysam', reorder_expressions=False, io_threads=1,
+         pipeline=False, subset=False, groups=None, group_outputs=None,
+         stats=None, progress_seconds=None, status_file=None,
+         checkpoint=None, checkpoint_interval=CHECKPOINT_INTERVAL,
+         resume=False, drop_unused_formats=False, output_type=None,
+         compression_level=None, write_index=False, table_output=None,
+         table_fields=[], sites_only=False, output_samples='all',
+         manifest=None, output_template=None, shard=None, quiet=False,
+         debug=False):
     if quiet:
         logger.setLevel(logging.WARN)
     elif debug:
         logger.setLevel(logging.DEBUG)
-    if not case and not control:
+    if groups:
+        if case or control:
+            raise ValueError("--case and --control options can not be " +
+                             "used in conjunction with --groups.")
+    elif not case and not control:
         raise ValueError("At least one sample must be supplied to either" +
                          "--case or --control options.")
+    if group_outputs:
+        if not groups:
+            raise ValueError("--group_outputs requires --groups.")
+        if '{group}' not in group_outputs:
+            raise ValueError("--group_outputs must contain '{group}'.")
+        if output is not None:
+            raise ValueError("--output can not be used in conjunction " +
+                             "with --group_outputs.")
+    get_backend(backend)  # raises ValueError if backend is not valid
+    group_defs = None
+    samples = case + control
+    if groups:
+        group_defs = read_groups(groups, defaults=dict(
+            case_expressions=case_expressions,
+            control_expressions=control_expressions,
+            min_case_vaf=min_case_vaf,
+            max_control_vaf=max_control_vaf,
+            vaf_ratio=vaf_ratio))
+        samples = _group_samples(group_defs)
+        if threads > 1:
+            logger.warn("--threads is not supported with --groups. " +
+                        "Running on a single process.")
+            threads = 1
+        if batch_size:
+            logger.warn("--batch_size is not supported with --groups " +
+                        "and will be ignored.")
+            batch_size = None
+        if stats:
+            logger.warn("--stats is not supported with --groups and " +
+                        "will be ignored.")
+            stats = None
+    if stats and batch_size:
+        logger.warn("--batch_size is ignored when collecting --stats.")
+        batch_size = None
+    run_stats = None
+    if stats:
+        run_stats = RunStats(case_expressions, control_expressions)
+    if output_samples not in OUTPUT_SAMPLES:
+        raise ValueError("--output_samples must be one of " +
+                         ", ".join(OUTPUT_SAMPLES))
+    if output_samples == 'none':
+        sites_only = True
+    elif output_samples == 'case,control':
+        subset = True
+    n_shards = None
+    if shard:
+        shard, n_shards = parse_shard(shard)
+    vcfs = [vcf] if isinstance(vcf, str) else list(vcf or [])
+    if manifest or output_template or len(vcfs) > 1:
+        unsupported = [x for x, y in (('--shard', n_shards),
+                                      ('--groups', groups),
+                                      ('--checkpoint', checkpoint),
+                                      ('--stats', stats),
+                                      ('--table_output', table_output),
+                                      ('--status_file', status_file),
+                                      ('--pipeline', pipeline)) if y]
+        if unsupported:
+            raise ValueError(", ".join(unsupported) + " can not be used " +
+                             "with more than one input.")
+        inputs = get_inputs(vcfs, manifest, output_template)
+        if inputs[0].output is not None:
+            if any(x.output is None for x in inputs):
+                raise ValueError("Outputs must be given for all or none " +
+                                 "of the inputs in your manifest.")
+            if output is not None:
+                raise ValueError("--output can not be used in conjunction " +
+                                 "with per-input outputs.")
+        output = '-' if output is None else output
+        if inputs[0].output is None:
+            modes = [output_mode(output, output_type, compression_level)]
+            if write_index and output == '-':
+                raise ValueError("--write_index requires --output.")
+        else:
+            modes = [output_mode(x.output, output_type, compression_level)
+                     for x in inputs]
+        if write_index and any(x.startswith('wu') for x in modes):
+            raise ValueError("--write_index requires bgzip compressed VCF " +
+                             "or BCF output.")
+        options = dict(case=case,
+                       control=control,
+                       ignore_genotypes=ignore_genotypes,
+                       case_expressions=case_expressions,
+                       control_expressions=control_expressions,
+                       min_case_vaf=min_case_vaf,
+                       max_control_vaf=max_control_vaf,
+                       vaf_ratio=vaf_ratio,
+                       reorder_expressions=reorder_expressions,
+                       info_expressions=info_expressions,
+                       pass_only=pass_only,
+                       min_qual=min_qual,
+                       info_tag=info_tag,
+                       regions=regions,
+                       regions_file=regions_file,
+                       sites=sites,
+                       exclude_contigs=exclude_contigs,
+                       batch_size=batch_size,
+                       backend=backend,
+                       io_threads=io_threads,
+                       subset=subset,
+                       drop_unused_formats=drop_unused_formats,
+                       sites_only=sites_only)
+        read, written = _main_inputs(inputs, output, options,
+                                     threads=threads, modes=modes,
+                                     write_index=write_index)
+        logger.info("Finished processing {:,} variants. ".format(read) +
+                    "{:,} written, {:,} filtered.".format(
+                        written, read - written))
+        return
+    if not vcfs:
+        raise ValueError("No input VCF given.")
+    vcf = vcfs[0]
+    if table_fields and not table_output:
+        raise ValueError("--table_fields requires --table_output.")
+    if table_output:
+        if groups:
+            raise ValueError("--table_output can not be used in " +
+                             "conjunction with --groups.")
+        if checkpoint:
+            raise ValueError("--table_output can not be used in " +
+                             "conjunction with --checkpoint.")
+    ckpt = None
+    if resume and not checkpoint:
+        raise ValueError("--resume requires --checkpoint.")
+    if checkpoint:
+        if groups:
+            raise ValueError("--checkpoint can not be used in conjunction " +
+                             "with --groups.")
+        if pipeline:
+            raise ValueError("--checkpoint can not be used in conjunction " +
+                             "with --pipeline.")
+        if output is None or output == '-':
+            raise ValueError("--checkpoint requires --output.")
+        state = None
+        if resume:
+            state = read_checkpoint(checkpoint)
+            if state is None:
+                logger.warn("No checkpoint found at {} - ".format(checkpoint)
+                            + "starting from the beginning.")
+            elif state['finished']:
+                logger.info("Checkpoint {} shows run already finished."
+                            .format(checkpoint))
+                return
+        ckpt = Checkpoint(checkpoint, output, interval=checkpoint_interval,
+                          state=state)
     output = '-' if output is None else output
-    with pysam.VariantFile(vcf) as variants:
-        check_samples(variants, case + control)
-        vaf_calculation = None
-        if min_case_vaf or max_control_vaf or vaf_ratio:
-            vaf_calculation = get_vaf_method(variants)
-        case_filter = get_format_filter(variants, case_expressions)
-        control_filter = get_format_filter(variants, control_expressions)
+    mode = output_mode(group_outputs or output, output_type,
+                       compression_level)
+    if write_index:
+        if output == '-' and not group_outputs:
+            raise ValueError("--write_index requires --output.")
+        if mode.startswith('wu'):
+            raise ValueError("--write_index requires bgzip compressed VCF " +
+                             "or BCF output.")
+    with pysam.VariantFile(vcf, threads=io_threads) as variants:
+        check_samples(variants, samples)
+        subset_names = None
+        if subset:
+            subset_names = subset_samples(variants, samples)
+        intervals, target_sites = get_intervals(variants,
+                                                regions=regions,
+                                                regions_file=regions_file,
+                                                sites=sites,
+                                                exclude=exclude_contigs)
+        site_filter = get_site_filter(variants,
+                                      info_expressions=info_expressions,
+                                      pass_only=pass_only,
+                                      min_qual=min_qual)
+        previous = None
+        if n_shards:
+            intervals, previous = _get_shard(vcf, variants, shard, n_shards,
+                                             intervals)
+            variants.header.add_meta(SHARD_META,
+                                     "{}/{}".format(shard, n_shards))
+        if ckpt is not None and ckpt.resumed:
+            if variants.index is None:
+                raise ValueError("Input must be bgzip compressed and " +
+                                 "indexed in order to use --resume.")
+            if intervals is None:
+                intervals = [Interval(c, 0, None) for c in
+                             _indexed_contigs(variants)]
+            intervals, previous = resume_intervals(intervals, ckpt.contig,
+                                                   ckpt.pos - 1)
+            logger.info("Resuming from {}:{} after {:,} variants ".format(
+                ckpt.contig, ckpt.pos, ckpt.read) +
+                "processed, {:,} written.".format(ckpt.written))
+        elif ckpt is not None and variants.index is None:
+            logger.warn("Input is not indexed - it will not be possible " +
+                        "to resume from checkpoints.")
+        progress = Progress(
+            logger,
+            interval=progress_interval,
+            seconds=progress_seconds,
+            status_file=status_file,
+            spans=genome_spans(variants.header, intervals),
+            vcf=variants if intervals is None and not pipeline else None)
+        if group_defs is not None:
+            records = _get_records(variants, intervals, target_sites,
+                                   exclude_contigs, pipeline, previous)
+            read, written = _main_groups(
+                variants, group_defs, records, output,
+                group_outputs=group_outputs,
+                ignore_genotypes=ignore_genotypes,
+                info_tag=info_tag,
+                reorder_expressions=reorder_expressions,
+                progress=progress,
+                backend=backend,
+                io_threads=io_threads,
+                pipeline=pipeline,
+                site_filter=site_filter,
+                drop_unused_formats=drop_unused_formats,
+                mode=mode,
+                write_index=write_index,
+                sites_only=sites_only)
+            progress.finish(read, written)
+            logger.info("Finished processing {:,} variants. ".format(read) +
+                        "{:,} written, {:,} filtered.".format(
+                            written, read - written))
+            return
+        # resolve sample names to column indices once up front
+        case = get_sample_handles(variants, case)
+        control = get_sample_handles(variants, control)
+        case_filter, control_filter, vaf_calculation = get_filters(
+            variants,
+            case_expressions=case_expressions,
+            control_expressions=control_expressions,
+            min_case_vaf=min_case_vaf,
+            max_control_vaf=max_control_vaf,
+            vaf_ratio=vaf_ratio,
+            reorder_expressions=reorder_expressions)
+        drop_formats = None
+        if drop_unused_formats:
+            drop_formats = _drop_formats(variants, ignore_genotypes,
+                                         (case_filter, control_filter),
+                                         vaf_calculation)
+        chunks = None
+        if threads > 1:
+            chunks = _get_chunks(vcf, variants, threads, intervals)
+            if chunks and previous is not None:
+                chunks[0] = (chunks[0][0], previous)
         if info_tag:
             add_info_tag(variants, info_tag)
-        out = pysam.VariantFile(output, 'w', header=variants.header)
-        out.header.add_meta(key=PROG_NAME,
-                            value=str.join(" ", sys.argv) + "; Date=" +
-                            time.strftime("%Y-%m-%d %H:%M"))
-        read, written = 0, 0
-        for record in variants:
-            if progress_interval and read:
-                if read % progress_interval == 0:
-                    logger.info(
-                        "{:,} variants processed, {:,} written. At {}:{}"
-                        .format(read, written, record.chrom, record.pos))
-            read += 1
-            n_alts = len(record.alts)
-            filter_flag = set_first_bits(n_alts)  # bitwise flag per ALT
-            for alt in range(n_alts):
-                allele = alt + 1
-                if not ignore_genotypes:
-                    if case and all(allele not in record.samples[x]['GT'] for x
-                                    in case):
-                        filter_flag &= ~(1 << alt)  # unset bit for ALT allele
-                    if any(allele in record.samples[x]['GT'] for x in control):
-                        filter_flag &= ~(1 << alt)
-            # are we done already?
-            if not filter_flag:
-                continue
-            if control_filter is not None:
-                filter_flag &= control_filter.filter(record, control)
-            if not filter_flag:
-                continue
-            if case_filter is not None:
-                filter_flag &= case_filter.filter(record, case)
-            if not filter_flag:
-                continue
-            ca_vafs = None
-            co_vafs = None
-            if max_control_vaf or vaf_ratio:
-                co_vafs = get_max_vafs(record, control, vaf_calculation)
-                if max_control_vaf:
-                    for i in range(n_alts):
-                        filter_flag &= ~((co_vafs[i] > max_control_vaf) << i)
-                    if not filter_flag:
-                        continue
-            if min_case_vaf or vaf_ratio:
-                ca_vafs = get_max_vafs(record, case, vaf_calculation)
-                if min_case_vaf:
-                    for i in range(n_alts):
-                        filter_flag &= ~((ca_vafs[i] < min_case_vaf) << i)
-                    if not filter_flag:
-                        continue
-            if vaf_ratio:
-                for i in range(n_alts):
-                    if co_vafs[i] > 0.0:
-                        filter_flag &= ~((ca_vafs[i]/co_vafs[i] < vaf_ratio)
-                                         << i)
-                    elif ca_vafs[i] == 0.0:
-                        filter_flag &= ~(1 << i)  # unset if case VAF is zero
-            if filter_flag:
-                if info_tag:
-                    record.info[info_tag] = filter_flag
-                out.write(record)
-                written += 1
+        table = None
+        if table_output:
+            table = _open_table(table_output, variants, case, control,
+                                table_fields or [], vaf_calculation)
+        if ckpt is not None and ckpt.resumed:
+            out = ckpt.reopen_output(io_threads, mode)
+        else:
+            out = _open_output(output, variants.header, io_threads,
+                               drop_formats, mode, sites_only)
+        writer = ThreadedWriter(out) if pipeline else out
+        filter_args = dict(case=case,
+                           control=control,
+                           ignore_genotypes=ignore_genotypes,
+                           min_case_vaf=min_case_vaf,
+                           max_control_vaf=max_control_vaf,
+                           vaf_ratio=vaf_ratio,
+                           info_tag=info_tag,
+                           batch_size=batch_size,
+                           backend=backend,
+                           drop_formats=drop_formats)
+        if chunks:
+            read, written = filter_parallel(
+                vcf, chunks, writer, threads,
+                sites=target_sites,
+                case_expressions=case_expressions,
+                control_expressions=control_expressions,
+                reorder_expressions=reorder_expressions,
+                info_expressions=info_expressions,
+                pass_only=pass_only,
+                min_qual=min_qual,
+                subset=subset_names,
+                stats=run_stats,
+                progress=progress,
+                checkpoint=ckpt,
+                table=table,
+                sites_only=sites_only,
+                **filter_args)
+        else:
+            records = _get_records(variants, intervals, target_sites,
+                                   exclude_contigs, pipeline, previous)
+            read, written = filter_variants(
+                records, writer,
+                case_filter=case_filter,
+                control_filter=control_filter,
+                vaf_calculation=vaf_calculation,
+                progress=progress,
+                stats=run_stats,
+                checkpoint=ckpt,
+                site_filter=site_filter,
+                table=table,
+                sites_header=out.header if sites_only else None,
+                **filter_args)
+        if pipeline:
+            writer.close()
+        progress.finish(read, written)
+    out.close()
+    if table is not None:
+        table.close()
+        logger.info("Wrote table of passing ALT alleles to " + table_output)
+    if ckpt is not None:
+        ckpt.finish(read, written)
+        read += ckpt.read
+        written += ckpt.written
+    if write_index:
+        _write_index(output)
     logger.info("Finished processing {:,} variants. ".format(read) +
                 "{:,} written, {:,} filtered.".format(written, read - written))
-    out.close()
+    if run_stats is not None:
+        run_stats.write(stats)
+        logger.info("Wrote run statistics to " + stats)
@@ -0,0 +1,229 @@
+'''
+Periodically record how far through its input a run has got so that an
+interrupted run can be resumed, appending to its existing output.
+
+At each checkpoint the output is flushed (ending the current BGZF block for
+compressed output) and the position of the first record not yet processed
+is recorded along with the numbers of records read and written and the size
+of the output at that point. As htslib buffers output, a checkpoint is only
+written once the output on disk has reached that size. Resuming truncates
+the output to the recorded size and appends records from the recorded
+position onwards.
+'''
+
+import json
+import os
+import pysam
+import warnings
+from collections import OrderedDict
+from .vcf_index import open_unindexed
+
+CHECKPOINT_INTERVAL = 100_000
+''' Default number of records between checkpoints. '''
+BGZF_EOF_SIZE = 28
+''' Size in bytes of the empty BGZF block marking the end of a file. '''
+
+
+def read_checkpoint(path):
+    ''' Return checkpoint values in path as a dict or None if no file. '''
+    try:
+        with open(path, 'rt') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def output_offset(out):
+    '''
+    Return the position in the file of the open pysam.VariantFile out. For
+    BGZF compressed files this is the offset of the current block, so out
+    should be flushed first.
+    '''
+    offset = out.tell()
+    if out.compression == 'BGZF':
+        offset >>= 16
+    return offset
+
+
+def _append_bytes(src, dest, start, end=None):
+    ''' Append bytes from start to end of file src to file dest. '''
+    with open(src, 'rb') as fh, open(dest, 'ab') as out:
+        fh.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            size = 1 << 20
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+            data = fh.read(size)
+            if not data:
+                break
+            out.write(data)
+
+
+class Checkpoint(object):
+    '''
+    Write checkpoints to a JSON file every 'interval' records while writing
+    to output and reopen output when resuming from a checkpoint.
+
+    Records must be processed in coordinate order and the check method
+    called with each record once the number of records read reaches the
+    value of next_check, before the record is written, e.g.:
+
+        next_check = checkpoint.next_check
+        for record in records:
+            if read >= next_check:
+                next_check = checkpoint.check(out, record, read, written)
+            ...
+
+    Counts of records read and written passed to the check and save methods
+    are those since the run was started or resumed.
+    '''
+
+    def __init__(self, path, output, interval=CHECKPOINT_INTERVAL,
+                 state=None):
+        '''
+        Args:
+            path:       path of JSON checkpoint file.
+
+            output:     path of the VCF/BCF being written.
+
+            interval:   write a checkpoint every this many records.
+
+            state:      dict of values from an existing checkpoint (see
+                        read_checkpoint) to resume from.
+        '''
+        if interval < 1:
+            raise ValueError("Checkpoint interval must be greater than 0.")
+        self.path = path
+        self.output = os.path.abspath(output)
+        self.interval = interval
+        self.state = state
+        self.read, self.written = 0, 0
+        self.contig, self.pos = None, None
+        if state is not None:
+            if state['output'] != self.output:
+                raise ValueError("Checkpoint {} is for output {}, not {}."
+                                 .format(path, state['output'], self.output))
+            self.read, self.written = state['read'], state['written']
+            self.contig, self.pos = state['contig'], state['pos']
+        elif os.path.exists(path):
+            os.remove(path)
+        self._writing = self.output
+        self._base = 0  # size of output at checkpoint resumed from
+        self._header_size = 0  # size of header in self._writing
+        self._copied = 0  # bytes of self._writing copied to output
+        self._pending = []
+        self._last = None
+        self.next_check = self._get_next_check()
+
+    @property
+    def resumed(self):
+        ''' True if resuming from an existing checkpoint. '''
+        return self.state is not None
+
+    def _get_next_check(self, read=0):
+        total = self.read + read
+        return (total // self.interval + 1) * self.interval - self.read
+
+    def reopen_output(self, io_threads=1, mode='w'):
+        '''
+        Truncate output to its size at the checkpoint being resumed from and
+        return a pysam.VariantFile for writing the remaining records.
+
+        As pysam can not append to an existing file without writing a new
+        header, records are written to a temporary file in the same
+        directory as output and copied (minus the header) to the end of
+        output at each checkpoint and by the finish method. mode should be
+        the pysam mode output was originally opened with.
+        '''
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # no EOF marker if interrupted
+            with open_unindexed(self.output,
+                                ignore_truncation=True) as existing:
+                header = existing.header.copy()
+        size = os.path.getsize(self.output)
+        if size < self.state['offset']:
+            raise ValueError("Output {} is smaller than at checkpoint {} - "
+                             .format(self.output, self.path) +
+                             "can not resume.")
+        os.truncate(self.output, self.state['offset'])
+        self._base = self.state['offset']
+        self._writing = os.path.join(
+            os.path.dirname(self.output),
+            '.resume_' + os.path.basename(self.output))
+        with pysam.VariantFile(self._writing, mode, header=header) as tmp:
+            compressed = tmp.compression == 'BGZF'
+        self._header_size = os.path.getsize(self._writing)
+        if compressed:
+            self._header_size -= BGZF_EOF_SIZE
+        self._copied = self._header_size
+        return pysam.VariantFile(self._writing, mode, header=header,
+                                 threads=io_threads)
+
+    def check(self, out, record, read, written):
+        '''
+        Save a checkpoint before record unless it starts at the same
+        position as the previous record, in which case check again at the
+        next record. Returns the number of records read at which check
+        should next be called.
+        '''
+        position = (record.chrom, record.start)
+        if self._last is None or self._last == position:
+            self._last = position
+            return read + 1
+        self._last = None
+        self.save(out, record.chrom, record.pos, read, written)
+        self.next_check = self._get_next_check(read)
+        return self.next_check
+
+    def save(self, out, contig, pos, read, written):
+        '''
+        Flush out and save a checkpoint for resuming at 1-based position
+        pos of contig once the flushed output reaches the disk.
+        '''
+        out.flush()
+        self._pending.append((output_offset(out), OrderedDict([
+            ('output', self.output),
+            ('contig', contig),
+            ('pos', pos),
+            ('read', self.read + read),
+            ('written', self.written + written),
+            ('finished', False)])))
+        self._commit()
+
+    def _commit(self):
+        size = os.path.getsize(self._writing)
+        committed = None
+        while self._pending and self._pending[0][0] <= size:
+            committed = self._pending.pop(0)
+        if committed is None:
+            return
+        offset, state = committed
+        if self._writing != self.output:
+            _append_bytes(self._writing, self.output, self._copied, offset)
+            self._copied = offset
+        state['offset'] = self._base + offset - self._header_size
+        self._write(state)
+
+    def finish(self, read, written):
+        '''
+        Record that the run has finished, once the output has been closed.
+        '''
+        if self._writing != self.output:
+            _append_bytes(self._writing, self.output, self._copied)
+            os.remove(self._writing)
+        self._write(OrderedDict([
+            ('output', self.output),
+            ('contig', None),
+            ('pos', None),
+            ('read', self.read + read),
+            ('written', self.written + written),
+            ('finished', True),
+            ('offset', os.path.getsize(self.output))]))
+
+    def _write(self, state):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wt') as fh:
+            json.dump(state, fh, indent=2)
+        os.replace(tmp, self.path)
@@ -0,0 +1,153 @@
+'''
+Record-scoped cache of per-sample FORMAT values.
+
+Retrieving a FORMAT value from a pysam VariantRecord decodes it from the
+underlying htslib record each time. The same values (e.g. GT or AD) are often
+needed by the genotype checks, several filter expressions and the VAF
+calculations for a single record, so a FormatCache is created for each record
+and shared between these stages so that each (sample, field) pair is decoded
+at most once.
+
+The class used to read FORMAT values is the 'backend' selected with the
+--backend option. FormatCache decodes values one sample at a time, while
+ColumnarFormatCache decodes a whole FORMAT field for every sample of a record
+at once and can return it as a NumPy array in the manner of cyvcf2's
+Variant.format method.
+'''
+
+
+class FormatCache(dict):
+    '''
+    Cache of decoded FORMAT values for a single VariantRecord. Values are
+    retrieved by indexing with a (sample, field) tuple, where sample may be a
+    name or SampleHandle, and are decoded from the record on first access.
+    Indexing raises a KeyError if field is not present in the record.
+
+    e.g.
+        cache = FormatCache(record)
+        gt = cache['Sample1', 'GT']
+    '''
+
+    __slots__ = ('record', '_calls')
+
+    def __init__(self, record):
+        '''
+        Args:
+            record: pysam.VariantRecord
+        '''
+        self.record = record
+        self._calls = record.samples
+
+    def __missing__(self, key):
+        val = self[key] = self._calls[key[0]][key[1]]
+        return val
+
+    def has_field(self, field):
+        ''' Return True if FORMAT field is present in the record. '''
+        present = self.get(field)
+        if present is None:
+            present = self[field] = field in self.record.format
+        return present
+
+    def sample_values(self, field, samples):
+        '''
+        Return a list of the values of field for each of samples. Values
+        are decoded directly from the record without being stored, which is
+        faster when each value is only needed once (e.g. when reading a
+        field for a block of records).
+        '''
+        calls = self._calls
+        return [calls[x][field] for x in samples]
+
+
+class ColumnarFormatCache(FormatCache):
+    '''
+    FormatCache which decodes each FORMAT field for every sample in the
+    record on first access. This is faster than decoding values one sample
+    at a time when values are required for most of the samples in a VCF,
+    but slower when only a few of many samples are of interest.
+
+    Samples given as SampleHandles or indices are looked up in the decoded
+    columns. Samples given as names are decoded individually.
+    '''
+
+    __slots__ = ('_columns', '_sample_calls')
+
+    def __init__(self, record):
+        '''
+        Args:
+            record: pysam.VariantRecord
+        '''
+        super().__init__(record)
+        self._columns = dict()
+        self._sample_calls = None
+
+    def __missing__(self, key):
+        try:
+            val = self[key] = self.column(key[1])[key[0]]
+        except TypeError:  # sample given by name
+            val = self[key] = self._calls[key[0]][key[1]]
+        return val
+
+    def column(self, field):
+        '''
+        Return a list of values of field for every sample in the record.
+        Raises a KeyError if field is not present in the record.
+        '''
+        col = self._columns.get(field)
+        if col is None:
+            if not self.has_field(field):
+                raise KeyError(field)
+            if self._sample_calls is None:
+                self._sample_calls = list(self._calls.values())
+            col = self._columns[field] = [x[field] for x in
+                                          self._sample_calls]
+        return col
+
+    def sample_values(self, field, samples):
+        col = self.column(field)
+        try:
+            return [col[x] for x in samples]
+        except TypeError:  # samples given by name
+            return [self[x, field] for x in samples]
+
+    def format(self, field):
+        '''
+        Return values of a numeric FORMAT field as a NumPy array of floats
+        with one row per sample and one column per value. Missing values
+        are NaN. Requires NumPy.
+        '''
+        import numpy as np
+        ftype = self.record.header.formats[field].type
+        if ftype not in ('Integer', 'Float'):
+            raise ValueError("Can not create array for FORMAT field " +
+                             "'{}' of type {}".format(field, ftype))
+        col = [(x,) if x is None or not isinstance(x, tuple) else x for x in
+               self.column(field)]
+        width = max(len(x) for x in col) if col else 1
+        arr = np.full((len(col), width), np.nan)
+        for i, vals in enumerate(col):
+            arr[i, :len(vals)] = np.array(vals, dtype=float)
+        return arr
+
+
+BACKENDS = {'pysam': FormatCache, 'columnar': ColumnarFormatCache}
+
+
+def get_backend(name):
+    '''
+    Return the FormatCache class used to read FORMAT values for the named
+    backend ('pysam' or 'columnar').
+    '''
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unrecognised backend '{}' - ".format(name) +
+                         "valid backends are " + ", ".join(BACKENDS))
+
+
+def get_cache(record, cache=None):
+    ''' Return cache if not None, otherwise a new FormatCache for record. '''
+    if cache is None:
+        return FormatCache(record)
+    return cache
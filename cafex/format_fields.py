@@ -0,0 +1,69 @@
+'''
+Work out which FORMAT fields are read when filtering so that the others can
+be removed from output.
+
+Genotype checks read GT, FormatFilters the fields named in their expressions
+and VAF calculations the fields used by the method chosen for the input (see
+cafex.vaf.get_vaf_method). Fields such as PL are often the bulk of a record
+but are never read, so dropping them makes output smaller and quicker to
+write.
+'''
+
+from .vaf import get_vaf_fields
+
+KEEP_FIELDS = ('GT',)
+''' FORMAT fields never removed from output, even if unused. '''
+
+
+def required_fields(ignore_genotypes=False, format_filters=(),
+                    vaf_calculation=None):
+    '''
+    Return a set of the FORMAT fields read when filtering.
+
+    Args:
+        ignore_genotypes:   True if GT calls are not used for filtering.
+
+        format_filters:     iterable of FormatFilters in use (None values
+                            are ignored).
+
+        vaf_calculation:    VAF calculation function (as returned by
+                            get_vaf_method) or None if VAFs are not used.
+    '''
+    fields = set()
+    if not ignore_genotypes:
+        fields.add('GT')
+    for format_filter in format_filters:
+        if format_filter is not None:
+            fields.update(format_filter.fields)
+    if vaf_calculation is not None:
+        fields.update(get_vaf_fields(vaf_calculation))
+    return fields
+
+
+def unused_fields(header, required, keep=KEEP_FIELDS):
+    '''
+    Return a tuple of the FORMAT fields defined in header that are not in
+    required or keep, in header order.
+    '''
+    return tuple(x for x in header.formats if x not in required and
+                 x not in keep)
+
+
+def remove_header_fields(header, fields):
+    '''
+    Remove the definitions of FORMAT fields from a pysam.VariantHeader.
+    header should be a copy used for output, as records read with a header
+    lacking definitions of their FORMAT fields are not parsed correctly.
+    '''
+    for field in fields:
+        header.formats.remove_header(field)
+
+
+def remove_fields(record, fields):
+    ''' Remove values of FORMAT fields from a pysam.VariantRecord. '''
+    fmt = record.format
+    for field in fields:
+        try:
+            del fmt[field]
+        except KeyError:  # not present in this record
+            pass
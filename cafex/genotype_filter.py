@@ -1,7 +1,10 @@
 import operator
 import re
+import time
 from collections import namedtuple
-from .bit_utils import first_n_bits_set, set_first_bits, flag_consensus
+from .bit_utils import count_set_bits, first_n_bits_set, set_first_bits
+from .format_cache import get_cache
+from .samples import sample_name
 
 Expression = namedtuple("Expression",
                         "field operator value number iterfunc subscript")
@@ -33,13 +36,143 @@ logical = {  # we use bitwise operators because we will be comparing flags
     "||": operator.ior,
 }
 
+ADAPTIVE_WINDOW = 1000  # records between reordering in adaptive mode
+
 _ext_logger = None
 
 
+def _warn_missing_values(record, smpl, field):
+    if _ext_logger:
+        if smpl is None:  # INFO field
+            _ext_logger.warning("Not enough values for INFO field '{}' "
+                                .format(field) + "at {}:{}".format(
+                                    record.chrom, record.pos))
+            return
+        _ext_logger.warning(("Not enough values for sample '{}' field " +
+                             "'{}' at {}:{}").format(sample_name(smpl),
+                                                     field,
+                                                     record.chrom,
+                                                     record.pos))
+
+
+def _compile_expression(exp):
+    '''
+    Return a function specialised for the Number, function and subscript of
+    Expression exp. The returned function takes a FormatCache, sample and
+    number of ALT alleles and returns a bitwise flag with bits set for each
+    ALT allele matching the expression.
+    '''
+    field, op, value, number = exp.field, exp.operator, exp.value, exp.number
+    if number == 1:
+        def evaluate(cache, smpl, n_alts):
+            try:
+                val = cache[smpl, field]
+            except KeyError:  # field not present in record
+                return 0
+            if val is not None and op(val, value):
+                return set_first_bits(n_alts)
+            return 0
+        return evaluate
+    if number == 'A' or number == 'R':
+        first = 1 if number == 'R' else 0
+
+        def per_value(cache, smpl, n_alts, annot):
+            flg = 0
+            for i in range(n_alts):
+                try:
+                    x = annot[i + first]
+                except IndexError:
+                    _warn_missing_values(cache.record, smpl, field)
+                    continue
+                if x is not None and op(x, value):
+                    flg |= 1 << i  # set bit for ALT allele
+            return flg
+    else:
+        def per_value(cache, smpl, n_alts, annot):
+            for x in annot:
+                if x is not None and op(x, value):
+                    # set all bits if ANY value matches
+                    return set_first_bits(n_alts)
+            return 0
+    if exp.iterfunc is not None:
+        iterfunc = exp.iterfunc
+
+        def get_value(cache, smpl, annot):
+            return iterfunc(x for x in annot if x is not None)
+    elif exp.subscript is not None:
+        subscript = exp.subscript
+
+        def get_value(cache, smpl, annot):
+            return annot[subscript]
+    else:
+        get_value = None
+
+    if get_value is None:
+        def evaluate(cache, smpl, n_alts):
+            try:
+                annot = cache[smpl, field]
+            except KeyError:
+                return 0
+            return per_value(cache, smpl, n_alts, annot)
+    else:
+        def evaluate(cache, smpl, n_alts):
+            try:
+                annot = cache[smpl, field]
+            except KeyError:
+                return 0
+            val = get_value(cache, smpl, annot)
+            if val is not None and op(val, value):
+                return set_first_bits(n_alts)
+            # fall back to checking individual values
+            return per_value(cache, smpl, n_alts, annot)
+    return evaluate
+
+
+def _fuse_logic(evaluators, logical_ops):
+    '''
+    Combine evaluators created by _compile_expression into a single function
+    applying logical_ops from left to right. Evaluation short-circuits, so
+    that an evaluator following 'and' is skipped if no bits are set and one
+    following 'or' is skipped if all bits are already set.
+    '''
+    if len(evaluators) == 1:
+        return evaluators[0]
+    if len(evaluators) == 2:
+        first, second = evaluators
+        if logical_ops[0] is operator.iand:
+            def evaluate(cache, smpl, n_alts):
+                flag = first(cache, smpl, n_alts)
+                if flag:
+                    flag &= second(cache, smpl, n_alts)
+                return flag
+        else:
+            def evaluate(cache, smpl, n_alts):
+                flag = first(cache, smpl, n_alts)
+                if flag != (1 << n_alts) - 1:
+                    flag |= second(cache, smpl, n_alts)
+                return flag
+        return evaluate
+    first = evaluators[0]
+    rest = [(op is operator.iand, func) for op, func in
+            zip(logical_ops, evaluators[1:])]
+
+    def evaluate(cache, smpl, n_alts):
+        flag = first(cache, smpl, n_alts)
+        all_bits = (1 << n_alts) - 1
+        for is_and, func in rest:
+            if is_and:
+                if flag:
+                    flag &= func(cache, smpl, n_alts)
+            elif flag != all_bits:
+                flag |= func(cache, smpl, n_alts)
+        return flag
+    return evaluate
+
+
 class FilterExpression(object):
     ''' A class for holding expression logic for testing genotype values'''
 
-    def __init__(self, expression, vcf):
+    def __init__(self, expression, vcf, field_type='FORMAT'):
         '''
         Args:
             expression:
@@ -49,67 +182,42 @@ class FilterExpression(object):
                 than one evaluation is to be performed. Optional final
                 parameter indicates how many samples must match the expression
                 (either an integer or 'all' are acceptable, defaults to 1).
+
+            vcf:
+                VariantFile or VariantHeader object from pysam.
+
+            field_type:
+                'FORMAT' or 'INFO'. If 'INFO', field names are checked
+                against the INFO fields of the header and the expression is
+                evaluated with the sample given as None using an object
+                returning INFO values (see cafex.site_filter). A minimum
+                number of matching samples can not be given for INFO
+                expressions.
         '''
+        if field_type not in ('FORMAT', 'INFO'):
+            raise ValueError("Invalid field type '{}' ".format(field_type) +
+                             "- must be 'FORMAT' or 'INFO'.")
         self.expressions = []
         self.logical_ops = []
         self.min_samples = 1
-        self.metadata = vcf.header.formats
+        self.expression = expression
+        self.field_type = field_type
+        header = getattr(vcf, 'header', vcf)
+        if field_type == 'INFO':
+            self.metadata = header.info
+        else:
+            self.metadata = header.formats
         self._parse_expressions(expression)
+        self.evaluate = _fuse_logic([_compile_expression(x) for x in
+                                     self.expressions], self.logical_ops)
 
-    def check_sample(self, record, smpl, n_alts):
+    def check_sample(self, record, smpl, n_alts, cache=None):
         '''
             Return bitwise flag indicating for each alt allele whether sample
-            call meets expression criteria.
+            call meets expression criteria. Optionally provide a FormatCache
+            for record to avoid decoding FORMAT values more than once.
         '''
-        flags = []
-        for exp in self.expressions:
-            if exp.field not in record.samples[smpl]:
-                flags.append(0)
-                continue
-            flg = 0  # set nth bit to 1 if nth ALT matches expression
-            annot = record.samples[smpl][exp.field]
-            val = None
-            if exp.number == 1:
-                val = annot
-            elif exp.iterfunc is not None:
-                val = exp.iterfunc(x for x in annot if x is not None)
-            elif exp.subscript is not None:
-                val = annot[exp.subscript]
-            if val is not None and exp.operator(val, exp.value):
-                flg = set_first_bits(n_alts)
-            elif exp.number == 1:  # number is one and value is None
-                pass
-            elif exp.number == 'A' or exp.number == 'R':
-                if exp.number == 'R':
-                    alt_vals = annot[1:]
-                else:
-                    alt_vals = annot
-                for i in range(n_alts):
-                    try:
-                        if alt_vals[i] is not None and exp.operator(
-                                alt_vals[i], exp.value):
-                            flg |= 1 << i  # set bit for ALT allele
-                    except IndexError:
-                        if _ext_logger:
-                            _ext_logger.warning(
-                                ("Not enough values for sample '{}' field " +
-                                 "'{}' at {}:{}").format(smpl,
-                                                         exp.field,
-                                                         record.chrom,
-                                                         record.pos))
-            else:
-                for x in annot:
-                    if x is not None and exp.operator(x, exp.value):
-                        # set all bits if ANY value matches
-                        flg = set_first_bits(n_alts)
-                        break
-            flags.append(flg)
-        if len(flags) == 1:
-            return flags[0]
-        fcmp = self.logical_ops[0](flags[0], flags[1])
-        for i in range(1, len(self.logical_ops)):
-            fcmp = self.logical_ops[i](fcmp, flags[i + 1])
-        return fcmp
+        return self.evaluate(get_cache(record, cache), smpl, n_alts)
 
     def _parse_expressions(self, expression):
         split = expression.split()
@@ -137,10 +245,14 @@ class FilterExpression(object):
                 iter_func = iter_funcs[iter_name]
                 field = iter_match.group(2)
             if field not in self.metadata:
-                raise ValueError("FORMAT field '{}' not in VCF ".format(field) +
-                                 "header - can not be used for FORMAT field " +
-                                 "filtering.")
+                raise ValueError("{} field '{}' not in VCF ".format(
+                    self.field_type, field) + "header - can not be used " +
+                    "for {} field filtering.".format(self.field_type))
             ftype = self.metadata[field].type
+            if ftype == 'Flag':
+                raise ValueError("{} field '{}' is a Flag - ".format(
+                    self.field_type, field) + "can not be used in " +
+                    "filter expressions.")
             coerc = None
             if ftype == 'Integer':
                 coerc = int
@@ -150,7 +262,8 @@ class FilterExpression(object):
                 try:
                     value = coerc(value)
                 except ValueError:
-                    raise ValueError("Filter value for FORMAT field " +
+                    raise ValueError("Filter value for {} field "
+                                     .format(self.field_type) +
                                      "'{}' could not be ".format(field) +
                                      "converted to {}, but".format(ftype) +
                                      "but field Type is {}".format(ftype) +
@@ -193,7 +306,7 @@ class FilterExpression(object):
                 raise ValueError("Hanging values at end of expression '{}'."
                                  .format(expression))
         if i < len(split):
-            if i != len(split) - 1:
+            if i != len(split) - 1 or self.field_type == 'INFO':
                 raise ValueError("Hanging values at end of expression '{}'."
                                  .format(expression))
             if split[i].lower() == 'all':
@@ -219,10 +332,11 @@ class FormatFilter(object):
     A class for filtering on given FORMAT fields in a VCF
     '''
 
-    def __init__(self, vcf, expressions, logger=None):
+    def __init__(self, vcf, expressions, logger=None, adaptive=False,
+                 window=ADAPTIVE_WINDOW):
         '''
         Args:
-            vcf: VariantFile object from pysam.
+            vcf: VariantFile or VariantHeader object from pysam.
 
             expressions:
                  iterable of tuples of field names, operators and values for
@@ -231,6 +345,19 @@ class FormatFilter(object):
                  acceptable). By default only one sample passed to the 'filter'
                  method needs match an expression.
 
+            adaptive:
+                 If True, record how often each expression filters a variant
+                 and how long it takes to evaluate, and every 'window'
+                 variants reorder expressions so that those with the lowest
+                 cost per filtered variant are evaluated first. As
+                 evaluation stops at the first expression that filters all
+                 ALT alleles this does not change results.
+
+            window:
+                 Number of variants between reordering expressions when
+                 adaptive is True. Counts and timings are halved after each
+                 reordering so that recent variants carry the most weight.
+
         '''
         self.vcf = vcf
         self.fields = set()
@@ -239,44 +366,121 @@ class FormatFilter(object):
         _ext_logger = logger
         for expression in expressions:
             self.expressions.append(FilterExpression(expression, self.vcf))
+            self.fields.update(x.field for x in
+                               self.expressions[-1].expressions)
+        self.adaptive = adaptive
+        self.window = window
+        self.order = list(range(len(self.expressions)))
+        self._n_filtered = 0
+        self._rejected = [0] * len(self.expressions)
+        self._time = [0.0] * len(self.expressions)
 
-    def filter(self, record, samples):
+    def filter(self, record, samples, cache=None):
         '''
             Read VcfRecord and returns a bitwise flag indicating
             whether each ALT allele meets parameters from self.expressions.
+            Expressions are evaluated in turn until all ALT alleles have
+            been filtered.
 
             record:    VcfRecord to assess according to self.expressions.
 
-            samples:   Iterable of samples to assess.
+            samples:   Iterable of samples to assess. Samples may be given
+                       as names or as SampleHandles (as returned by
+                       cafex.samples.get_sample_handles) for faster,
+                       index-based access.
+
+            cache:     Optional FormatCache for record. Providing a cache
+                       shared with other filters avoids decoding the same
+                       FORMAT values more than once.
 
         '''
         n_alts = len(record.alts)
-        # array of bitwise flags, one flag per filter, bits set if allele meets
-        # filter criteria
-        flags = []
+        cache = get_cache(record, cache)
+        if self.adaptive:
+            return self._filter_adaptive(cache, samples, n_alts)
+        # bits set if allele meets ALL filter expressions
+        flag = set_first_bits(n_alts)
         for exp in self.expressions:
-            alt_f = 0  # per-alt flag for this filter expression
-            alt_counts = None
-            min_smpls = 1
-            if exp.min_samples < 1:
-                min_smpls = len(samples)
+            flag &= self._check_expression(exp, cache, samples, n_alts)
+            if not flag:
+                break
+        return flag
+
+    def filter_stats(self, record, samples, cache=None, cleared=None):
+        '''
+        As for filter, but adds the number of ALT alleles removed by each
+        expression to the corresponding element of list cleared. An ALT
+        allele is counted against the first expression it fails. Expressions
+        are evaluated in their current order but are never reordered.
+        '''
+        n_alts = len(record.alts)
+        cache = get_cache(record, cache)
+        flag = set_first_bits(n_alts)
+        for i in self.order:
+            new_flag = flag & self._check_expression(self.expressions[i],
+                                                     cache, samples, n_alts)
+            cleared[i] += count_set_bits(flag ^ new_flag)
+            flag = new_flag
+            if not flag:
+                break
+        return flag
+
+    def _filter_adaptive(self, cache, samples, n_alts):
+        flag = set_first_bits(n_alts)
+        for i in self.order:
+            start = time.perf_counter()
+            flag &= self._check_expression(self.expressions[i], cache,
+                                           samples, n_alts)
+            self._time[i] += time.perf_counter() - start
+            if not flag:
+                self._rejected[i] += 1
+                break
+        self._n_filtered += 1
+        if self._n_filtered >= self.window:
+            self._reorder()
+        return flag
+
+    def _reorder(self):
+        '''
+        Sort expressions by mean evaluation time per variant filtered.
+        Expressions that have not filtered any variants are placed last.
+        '''
+        def cost(i):
+            if not self._rejected[i]:
+                return float('inf')
+            return self._time[i] / self._rejected[i]
+        self.order.sort(key=cost)
+        for i in range(len(self.expressions)):
+            self._rejected[i] /= 2
+            self._time[i] /= 2
+        self._n_filtered = 0
+
+    def _check_expression(self, exp, cache, samples, n_alts):
+        '''
+        Return a bitwise flag with bits set for each ALT allele meeting
+        FilterExpression exp in the required number of samples.
+        '''
+        alt_f = 0  # per-alt flag for this filter expression
+        alt_counts = None
+        min_smpls = 1
+        if exp.min_samples < 1:
+            min_smpls = len(samples)
+        else:
+            min_smpls = exp.min_samples
+        if min_smpls > 1:
+            alt_counts = [0] * n_alts
+        evaluate = exp.evaluate
+        for smp in samples:
+            flt = evaluate(cache, smp, n_alts)
+            if min_smpls == 1:
+                if first_n_bits_set(flt, n_alts):
+                    alt_f = flt  # bail out early if all alleles pass
+                    break
+                alt_f |= flt
             else:
-                min_smpls = exp.min_samples
-            if min_smpls > 1:
-                alt_counts = [0] * n_alts
-            for smp in samples:
-                flt = exp.check_sample(record, smp, n_alts)
-                if min_smpls == 1:
-                    if first_n_bits_set(flt, n_alts):
-                        alt_f = flt  # bail out early if all alleles pass
-                        break
-                    alt_f |= flt
-                else:
-                    for i in range(n_alts):
-                        alt_counts[i] += flt >> i & 1
-            if alt_counts is not None:
                 for i in range(n_alts):
-                    alt_f |= (alt_counts[i] >= min_smpls) << i
-            flags.append(alt_f)
-        # report whether ALL filter expressions were matched
-        return flag_consensus(flags)
+                    alt_counts[i] += flt >> i & 1
+        if alt_counts is not None:
+            for i in range(n_alts):
+                alt_f |= (alt_counts[i] >= min_smpls) << i
+        return alt_f
@@ -0,0 +1,153 @@
+'''
+Read definitions of multiple case/control groups (e.g. one per family) so
+that they can all be filtered in a single pass through a VCF.
+
+Groups may be read from a PED file (one group per family, affected samples
+are cases and unaffected samples are controls), a JSON file or a
+tab-separated manifest. JSON files must contain a list of objects (or an
+object of group names to objects) and manifests must have a header line. The
+keys/columns recognised are:
+
+    name                group name (required)
+    case                case samples (comma separated in manifests)
+    control             control samples (comma separated in manifests)
+    case_expressions    expressions for cases (';' separated in manifests)
+    control_expressions expressions for controls (';' separated in manifests)
+    min_case_vaf        minimum case VAF
+    max_control_vaf     maximum control VAF
+    vaf_ratio           minimum case/control VAF ratio
+
+Any values not given for a group are taken from the defaults passed to
+read_groups (i.e. the command line options).
+'''
+
+import json
+import re
+from collections import OrderedDict, namedtuple
+
+Group = namedtuple("Group", "name case control case_expressions " +
+                   "control_expressions min_case_vaf max_control_vaf " +
+                   "vaf_ratio")
+
+_list_fields = {'case': ',', 'control': ',', 'case_expressions': ';',
+                'control_expressions': ';'}
+_float_fields = ('min_case_vaf', 'max_control_vaf', 'vaf_ratio')
+
+
+def read_groups(path, defaults=None):
+    '''
+    Return a list of Groups from a PED file (.ped or .fam extension), JSON
+    file (.json extension) or tab-separated manifest (any other extension).
+
+    Args:
+        path:       path to PED, JSON or manifest file.
+
+        defaults:   dict of default values for Group fields not given in
+                    the file.
+    '''
+    if path.endswith(('.ped', '.fam')):
+        groups = _read_ped(path)
+    elif path.endswith('.json'):
+        groups = _read_json(path)
+    else:
+        groups = _read_manifest(path)
+    if not groups:
+        raise ValueError("No case/control groups found in " + path)
+    groups = [_make_group(x, defaults or dict(), path) for x in groups]
+    names = set()
+    for group in groups:
+        if group.name in names:
+            raise ValueError("Duplicate group name '{}' in {}".format(
+                group.name, path))
+        names.add(group.name)
+    return groups
+
+
+def info_tag_name(prefix, group):
+    '''
+    Return a valid INFO field ID for group made from prefix and the group
+    name, replacing characters not permitted in INFO IDs with underscores.
+    '''
+    return prefix + '_' + re.sub(r'[^0-9A-Za-z_.]', '_', group)
+
+
+def _make_group(values, defaults, path):
+    unknown = [x for x in values if x not in Group._fields]
+    if unknown:
+        raise ValueError("Unrecognised field(s) in {}: {}".format(
+            path, ", ".join(unknown)))
+    if not values.get('name'):
+        raise ValueError("Group without a name in " + path)
+    group = dict((x, defaults.get(x)) for x in Group._fields)
+    for k, v in values.items():
+        if v is None or v == '' or v == []:
+            continue
+        if k in _list_fields and isinstance(v, str):
+            v = [x.strip() for x in v.split(_list_fields[k]) if x.strip()]
+        elif k in _float_fields:
+            try:
+                v = float(v)
+            except ValueError:
+                raise ValueError("Invalid value '{}' for {} ".format(v, k) +
+                                 "of group '{}' in {}".format(values['name'],
+                                                              path))
+        group[k] = v
+    group['name'] = str(group['name'])
+    for k in _list_fields:
+        group[k] = list(group[k] or [])
+    if not group['case'] and not group['control']:
+        raise ValueError("No case or control samples for group " +
+                         "'{}' in {}".format(group['name'], path))
+    return Group(**group)
+
+
+def _read_ped(path):
+    families = OrderedDict()
+    with open(path, 'rt') as fh:
+        for line in fh:
+            if line.startswith('#') or not line.strip():
+                continue
+            split = line.split()
+            if len(split) < 6:
+                raise ValueError("Invalid PED line in {}: '{}'".format(
+                    path, line.rstrip()))
+            fam = families.setdefault(split[0], dict(name=split[0], case=[],
+                                                     control=[]))
+            if split[5] == '2':
+                fam['case'].append(split[1])
+            elif split[5] == '1':
+                fam['control'].append(split[1])
+    return [x for x in families.values() if x['case'] or x['control']]
+
+
+def _read_json(path):
+    with open(path, 'rt') as fh:
+        data = json.load(fh)
+    if isinstance(data, dict):
+        groups = []
+        for name, values in data.items():
+            values = dict(values)
+            values.setdefault('name', name)
+            groups.append(values)
+        return groups
+    return [dict(x) for x in data]
+
+
+def _read_manifest(path):
+    groups = []
+    columns = None
+    with open(path, 'rt') as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            split = line.rstrip('\n').split('\t')
+            if columns is None:
+                columns = [x.lstrip('#').strip() for x in split]
+                continue
+            if line.startswith('#'):
+                continue
+            if len(split) > len(columns):
+                raise ValueError("Too many columns in {}: '{}'".format(
+                    path, line.rstrip()))
+            groups.append(dict(zip(columns, split)))
+    return groups
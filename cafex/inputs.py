@@ -0,0 +1,88 @@
+'''
+Read lists of input VCFs to be filtered in one run.
+
+A manifest lists one input VCF/BCF per line, optionally followed by a tab and
+the output path for that input. Blank lines and lines starting with '#' are
+ignored and relative paths are relative to the directory of the manifest.
+Inputs without an output in the manifest are written to the output template
+(e.g. "filtered/{name}.vcf.gz") if one is given, where {name} is the input
+filename without directory or VCF/BCF extensions.
+'''
+
+import os
+from collections import namedtuple
+
+Input = namedtuple("Input", "vcf output")
+
+VCF_EXTENSIONS = ('.vcf.gz', '.vcf.bgz', '.vcf', '.bcf')
+
+
+def read_manifest(path):
+    ''' Return a list of Inputs from the manifest at path. '''
+    inputs = []
+    base = os.path.dirname(path)
+    with open(path, 'rt') as fh:
+        for line in fh:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            split = line.split('\t')
+            if len(split) > 2:
+                raise ValueError("Too many columns in manifest {}: {}"
+                                 .format(path, line))
+            paths = [os.path.join(base, x.strip()) for x in split if
+                     x.strip()]
+            inputs.append(Input(paths[0], paths[1] if len(paths) > 1 else
+                                None))
+    if not inputs:
+        raise ValueError("No inputs found in manifest " + path)
+    return inputs
+
+
+def input_name(vcf):
+    ''' Return the filename of vcf without directory or VCF extension. '''
+    name = os.path.basename(vcf)
+    for ext in VCF_EXTENSIONS:
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+
+def get_inputs(vcfs=[], manifest=None, output_template=None):
+    '''
+    Return a list of Inputs for the VCFs given and those in manifest, with
+    outputs named using output_template for any not specified in manifest.
+    Raises a ValueError if an input is given more than once or if outputs
+    are not unique.
+    '''
+    inputs = [Input(x, None) for x in vcfs]
+    if manifest:
+        inputs.extend(read_manifest(manifest))
+    if output_template:
+        if '{name}' not in output_template:
+            raise ValueError("--output_template must contain '{name}'.")
+        inputs = [Input(x.vcf, x.output or output_template.format(
+            name=input_name(x.vcf))) for x in inputs]
+    for field in Input._fields:
+        seen = set()
+        for x in inputs:
+            value = getattr(x, field)
+            if value is None:
+                continue
+            if value in seen:
+                raise ValueError("Duplicate {} '{}' - ".format(
+                    'input' if field == 'vcf' else field, value) +
+                    "inputs and outputs must be unique.")
+            seen.add(value)
+    return inputs
+
+
+def header_key(header):
+    '''
+    Return a hashable key made from the samples and FORMAT and INFO field
+    definitions of a pysam.VariantHeader. Filters created for one header
+    can be used for records from any other header with the same key.
+    '''
+    return (tuple(header.samples),
+            tuple((x, y.number, y.type) for x, y in header.formats.items()),
+            tuple((x, y.number, y.type) for x, y in header.info.items()))
@@ -0,0 +1,166 @@
+'''
+Merge the outputs of runs using --shard into a single output.
+
+Each shard output records its shard number in its header, so shards are
+written in shard order regardless of the order in which they are given, and
+an error is raised if any shard is missing or given more than once. Header
+lines from all shards (e.g. INFO definitions added by --info_tag) are
+combined in the merged header. JSON reports written with --stats for each
+shard may also be combined into a single report.
+'''
+
+import logging
+import pysam
+import sys
+import time
+from .case_control_filter import PROG_NAME, SHARD_META, output_mode
+from .parallel import append_output
+from .regions import parse_shard
+from .stats import RunStats, read_stats
+from .vcf_index import index_vcf, open_unindexed
+
+logger = logging.getLogger(PROG_NAME)
+
+
+def get_shard(header):
+    '''
+    Return a tuple of the shard number and number of shards recorded in a
+    pysam.VariantHeader or None if the header is not from a shard output.
+    '''
+    for rec in header.records:
+        if rec.key == SHARD_META:
+            return parse_shard(rec.value)
+    return None
+
+
+def order_shards(vcfs):
+    '''
+    Return vcfs sorted by the shard numbers recorded in their headers.
+    Raises a ValueError if shards are missing, duplicated or from runs with
+    different numbers of shards. If no input is from a shard output, vcfs
+    are returned in the order given.
+    '''
+    shards = []
+    for vcf in vcfs:
+        with open_unindexed(vcf) as variants:
+            shards.append(get_shard(variants.header))
+    if all(x is None for x in shards):
+        logger.warn("No shard information found in input headers - " +
+                    "merging inputs in the order given.")
+        return list(vcfs)
+    for vcf, shard in zip(vcfs, shards):
+        if shard is None:
+            raise ValueError("No shard information found in header of " +
+                             vcf)
+    n_shards = set(n for _, n in shards)
+    if len(n_shards) > 1:
+        raise ValueError("Inputs are from runs with different numbers of " +
+                         "shards ({}).".format(", ".join(
+                             str(x) for x in sorted(n_shards))))
+    n_shards = n_shards.pop()
+    seen = dict()
+    for vcf, (i, _) in zip(vcfs, shards):
+        if i in seen:
+            raise ValueError("Shard {}/{} given more than once".format(
+                i, n_shards) + " ({} and {}).".format(seen[i], vcf))
+        seen[i] = vcf
+    missing = [str(i) for i in range(1, n_shards + 1) if i not in seen]
+    if missing:
+        raise ValueError("Missing shard(s) {} of {}.".format(
+            ", ".join(missing), n_shards))
+    return [seen[i] for i in range(1, n_shards + 1)]
+
+
+def merge_header(vcfs):
+    '''
+    Return a header combining the header lines of all vcfs, without shard
+    information. Raises a ValueError if inputs have different samples.
+    '''
+    header = None
+    for vcf in vcfs:
+        with open_unindexed(vcf) as variants:
+            if header is None:
+                header = variants.header.copy()
+            elif list(variants.header.samples) != list(header.samples):
+                raise ValueError("Samples in {} differ from ".format(vcf) +
+                                 "those in {}.".format(vcfs[0]))
+            else:
+                header.merge(variants.header)
+    for rec in list(header.records):
+        if rec.key == SHARD_META:
+            rec.remove()
+    return header
+
+
+def merge_stats(paths):
+    '''
+    Return a RunStats object combining the JSON reports at paths. The
+    wall_seconds of the result is the total of all reports.
+    '''
+    merged = None
+    for path in paths:
+        stats = read_stats(path)
+        if merged is None:
+            merged = RunStats(stats.case_expressions,
+                              stats.control_expressions)
+            merged.wall_seconds = 0.0
+        elif (stats.case_expressions != merged.case_expressions or
+              stats.control_expressions != merged.control_expressions):
+            raise ValueError("Expressions in stats report {} differ ".format(
+                path) + "from those in {}.".format(paths[0]))
+        merged.merge(stats)
+        merged.wall_seconds += stats.wall_seconds
+    return merged
+
+
+def merge_shards(vcfs, output='-', mode='w', io_threads=1):
+    '''
+    Write records from all vcfs to output in shard order using a merged
+    header. Returns the number of records written.
+    '''
+    vcfs = order_shards(vcfs)
+    header = merge_header(vcfs)
+    header.add_meta(key=PROG_NAME,
+                    value=str.join(" ", sys.argv) + "; Date=" +
+                    time.strftime("%Y-%m-%d %H:%M"))
+    written = 0
+    with pysam.VariantFile(output, mode, header=header,
+                           threads=io_threads) as out:
+        for vcf in vcfs:
+            n = append_output(vcf, out, remove=False)
+            logger.info("Wrote {:,} records from {}".format(n, vcf))
+            written += n
+    return written
+
+
+def main(vcfs, output=None, output_type=None, compression_level=None,
+         write_index=False, stats=None, input_stats=[], io_threads=1,
+         quiet=False):
+    if quiet:
+        logger.setLevel(logging.WARN)
+    if not vcfs:
+        raise ValueError("No input VCF given.")
+    if input_stats and not stats:
+        raise ValueError("--input_stats requires --stats.")
+    if stats and not input_stats:
+        raise ValueError("--stats requires --input_stats.")
+    output = '-' if output is None else output
+    mode = output_mode(output, output_type, compression_level)
+    if write_index:
+        if output == '-':
+            raise ValueError("--write_index requires --output.")
+        if mode.startswith('wu'):
+            raise ValueError("--write_index requires bgzip compressed VCF " +
+                             "or BCF output.")
+    run_stats = None
+    if stats:  # check reports before writing output
+        run_stats = merge_stats(input_stats)
+    written = merge_shards(vcfs, output, mode, io_threads)
+    if write_index:
+        logger.info("Indexing output " + output)
+        logger.info("Wrote index " + index_vcf(output))
+    logger.info("Finished merging {:,} inputs. {:,} records written."
+                .format(len(vcfs), written))
+    if run_stats is not None:
+        run_stats.write(stats)
+        logger.info("Wrote merged run statistics to " + stats)
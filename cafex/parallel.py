@@ -0,0 +1,34 @@
+'''
+Helpers for processing chunks of a VCF in a pool of worker processes and
+combining their outputs in order.
+'''
+
+import multiprocessing
+import os
+from .vcf_index import open_unindexed
+
+
+def process_chunks(worker, tasks, processes):
+    '''
+    Run worker on each of tasks using a pool of processes. Yields results in
+    the same order as tasks, as soon as each becomes available.
+    '''
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap(worker, tasks):
+            yield result
+
+
+def append_output(path, out, remove=True):
+    '''
+    Write all records from VCF/BCF at path to the open pysam.VariantFile
+    'out' and optionally delete path afterwards. Returns the number of
+    records written.
+    '''
+    n = 0
+    with open_unindexed(path) as chunk:
+        for record in chunk:
+            out.write(record)
+            n += 1
+    if remove:
+        os.remove(path)
+    return n
@@ -0,0 +1,129 @@
+'''
+Helpers for overlapping the reading, filtering and writing of records by
+moving reading and writing to background threads. Records are passed between
+threads in chunks via bounded queues so that neither side can run too far
+ahead of the other.
+'''
+
+import queue
+import threading
+
+CHUNK_SIZE = 1000
+QUEUE_SIZE = 8  # maximum number of chunks waiting in each queue
+
+_DONE = object()
+
+
+def _put(q, item, stop):
+    ''' Put item in q unless stop is set. Returns False if stopped. '''
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def read_ahead(records, chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE):
+    '''
+    Yield records from iterable records, which is iterated in a background
+    thread. Up to queue_size chunks of chunk_size records are read ahead of
+    the consumer. Exceptions raised while reading are re-raised in the
+    consuming thread.
+    '''
+    q = queue.Queue(queue_size)
+    stop = threading.Event()
+
+    def read():
+        try:
+            chunk = []
+            for record in records:
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    if not _put(q, chunk, stop):
+                        return
+                    chunk = []
+            if chunk and not _put(q, chunk, stop):
+                return
+            _put(q, _DONE, stop)
+        except Exception as e:
+            _put(q, e, stop)
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = q.get()
+            if chunk is _DONE:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield from chunk
+    finally:
+        stop.set()
+        thread.join()
+
+
+class ThreadedWriter(object):
+    '''
+    Write records to a pysam.VariantFile from a background thread. Records
+    passed to the write method are collected into chunks of chunk_size
+    records and passed to the writing thread via a queue holding at most
+    queue_size chunks. Any error raised by the writing thread is re-raised
+    by the next call to write or close.
+    '''
+
+    def __init__(self, out, chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE):
+        '''
+        Args:
+            out:        pysam.VariantFile opened for writing.
+
+            chunk_size: Number of records to pass to the writing thread at
+                        a time.
+
+            queue_size: Maximum number of chunks waiting to be written.
+        '''
+        self.out = out
+        self.chunk_size = chunk_size
+        self._chunk = []
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def _write(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            if self._error is not None:
+                continue  # keep consuming so that write does not block
+            try:
+                for record in chunk:
+                    self.out.write(record)
+            except Exception as e:
+                self._error = e
+
+    def write(self, record):
+        ''' Queue record for writing. '''
+        self._chunk.append(record)
+        if len(self._chunk) >= self.chunk_size:
+            if self._error is not None:
+                raise self._error
+            self._queue.put(self._chunk)
+            self._chunk = []
+
+    def close(self):
+        '''
+        Wait for all queued records to be written. Does not close the
+        underlying VariantFile.
+        '''
+        if self._thread.is_alive():
+            if self._chunk:
+                self._queue.put(self._chunk)
+                self._chunk = []
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,232 @@
+'''
+Report progress while filtering: the number of records read and written per
+second, the current position, the estimated fraction of the input processed
+and the estimated time remaining. Reports are logged and/or written to a JSON
+status file, which is rewritten after each report so that other programs can
+monitor a run.
+'''
+
+import json
+import os
+import time
+from collections import OrderedDict
+
+CHECK_INTERVAL = 1000
+''' Number of records between checks of elapsed time. '''
+STATUS_SECONDS = 30
+''' Default maximum number of seconds between status file updates. '''
+
+
+def genome_spans(header, intervals=None):
+    '''
+    Return a list of (contig, start, end) tuples for the regions that will
+    be read from a VCF with pysam.VariantHeader header, in order. These are
+    the given regions.Intervals or, if intervals is None, every contig in
+    the header. Returns None if the length of any contig required is not
+    given in the header.
+    '''
+    if intervals is None:
+        intervals = [(x, 0, None) for x in header.contigs]
+    spans = []
+    for contig, start, end in intervals:
+        if end is None:
+            if contig not in header.contigs:
+                return None
+            end = header.contigs[contig].length
+            if end is None:
+                return None
+        spans.append((contig, start, end))
+    return spans or None
+
+
+def format_seconds(seconds):
+    ''' Format seconds as H:MM:SS. '''
+    seconds = int(round(seconds))
+    return "{:d}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60,
+                                       seconds % 60)
+
+
+class Progress(object):
+    '''
+    Track the number of records read and written and report progress every
+    'interval' records and/or every 'seconds' seconds.
+
+    To keep overhead low callers should only call the check method once the
+    number of records read reaches the value of next_check, e.g.:
+
+        next_check = progress.next_check
+        for record in records:
+            if read >= next_check:
+                next_check = progress.check(read, written, record)
+            ...
+
+    '''
+
+    def __init__(self, logger=None, interval=100_000, seconds=None,
+                 status_file=None, spans=None, vcf=None):
+        '''
+        Args:
+            logger:     logging.Logger for progress messages. If None,
+                        progress is only written to status_file.
+
+            interval:   Report progress every this many records.
+
+            seconds:    Report progress when at least this many seconds
+                        have passed since the last report. Defaults to
+                        STATUS_SECONDS if status_file is given.
+
+            status_file:
+                        Path of a JSON file to write the latest progress to.
+                        The file is written on creation, at each report and
+                        by the finish method.
+
+            spans:      List of (contig, start, end) tuples for the regions
+                        being read in order (see genome_spans), used to
+                        estimate the fraction of the input processed.
+
+            vcf:        pysam.VariantFile being read. If spans is None the
+                        fraction processed is estimated from the position
+                        of the file pointer instead. Should only be given
+                        if the whole file is being read in the same thread
+                        as calls to the check method.
+        '''
+        if status_file is not None and not seconds:
+            seconds = STATUS_SECONDS
+        self.logger = logger
+        self.interval = interval
+        self.seconds = seconds
+        self.status_file = status_file
+        self.start = time.time()
+        self._last = self.start
+        self._next_report = interval
+        self._fraction = None
+        self._spans = None
+        self._vcf = None
+        if spans:
+            self._spans = dict()
+            self._total = 0
+            for contig, start, end in spans:
+                self._spans.setdefault(contig, []).append(
+                    (start, end, self._total))
+                self._total += end - start
+            if not self._total:
+                self._spans = None
+        elif vcf is not None:
+            try:
+                self._size = os.path.getsize(vcf.filename)
+                self._bgzf = vcf.compression == 'BGZF'
+                if self._size:
+                    self._vcf = vcf
+            except (OSError, TypeError, ValueError):
+                pass  # e.g. reading from STDIN
+        self.next_check = self._get_next_check(0)
+        self.write_status(self.status(0, 0))
+
+    def _get_next_check(self, read):
+        checks = []
+        if self.interval:
+            checks.append(self._next_report)
+        if self.seconds:
+            checks.append(read + CHECK_INTERVAL)
+        return min(checks) if checks else float('inf')
+
+    def check(self, read, written, record):
+        '''
+        Report progress if due, given the number of records read and
+        written and the current pysam.VariantRecord. Returns the number of
+        records read at which check should next be called.
+        '''
+        now = time.time()
+        due = False
+        if self.interval and read >= self._next_report:
+            due = True
+            self._next_report = (read // self.interval + 1) * self.interval
+        if self.seconds and now - self._last >= self.seconds:
+            due = True
+        if due:
+            self.report(read, written, record.chrom, record.pos, now=now)
+        self.next_check = self._get_next_check(read)
+        return self.next_check
+
+    def fraction(self, contig=None, pos=None):
+        '''
+        Return estimated fraction of input processed, given the current
+        contig and position, or None if it can not be estimated.
+        '''
+        if self._spans is not None:
+            if contig in self._spans:
+                for start, end, before in self._spans[contig]:
+                    if pos <= end:
+                        self._fraction = (before + max(pos - start, 0)) / \
+                            self._total
+                        break
+                else:
+                    self._fraction = (before + end - start) / self._total
+            return self._fraction
+        if self._vcf is not None:
+            offset = self._vcf.tell()
+            if self._bgzf:
+                offset >>= 16  # compressed offset of BGZF virtual offset
+            return min(offset / self._size, 1.0)
+        return None
+
+    def status(self, read, written, contig=None, pos=None, fraction=None,
+               now=None, finished=False):
+        ''' Return an OrderedDict of progress values. '''
+        now = time.time() if now is None else now
+        elapsed = now - self.start
+        if fraction is None and not finished:
+            fraction = self.fraction(contig, pos)
+        if finished:
+            fraction = 1.0
+        eta = None
+        if fraction:
+            eta = elapsed * (1 - fraction) / fraction
+        return OrderedDict([
+            ('records', read),
+            ('written', written),
+            ('elapsed_seconds', elapsed),
+            ('records_per_sec', read / elapsed if elapsed else None),
+            ('written_per_sec', written / elapsed if elapsed else None),
+            ('contig', contig),
+            ('pos', pos),
+            ('fraction', fraction),
+            ('eta_seconds', eta),
+            ('finished', finished),
+            ('updated', time.strftime("%Y-%m-%d %H:%M:%S"))])
+
+    def report(self, read, written, contig=None, pos=None, fraction=None,
+               now=None, prefix=''):
+        '''
+        Log progress and/or write it to the status file. If fraction is not
+        given it is estimated from contig and pos.
+        '''
+        status = self.status(read, written, contig, pos, fraction, now)
+        self._last = time.time() if now is None else now
+        if self.logger is not None:
+            msg = prefix + "{:,} variants processed, {:,} written.".format(
+                read, written)
+            if contig is not None:
+                msg += " At {}:{}".format(contig, pos)
+            if status['records_per_sec'] is not None:
+                msg += " ({:,.0f} variants/s, {:,.0f} written/s".format(
+                    status['records_per_sec'], status['written_per_sec'])
+                if status['eta_seconds'] is not None:
+                    msg += ", {:.1%} complete, ETA {}".format(
+                        status['fraction'],
+                        format_seconds(status['eta_seconds']))
+                msg += ")"
+            self.logger.info(msg)
+        self.write_status(status)
+
+    def finish(self, read, written):
+        ''' Write final status to the status file. '''
+        self.write_status(self.status(read, written, finished=True))
+
+    def write_status(self, status):
+        if self.status_file is None:
+            return
+        tmp = self.status_file + '.tmp'
+        with open(tmp, 'wt') as fh:
+            json.dump(status, fh, indent=2)
+        os.replace(tmp, self.status_file)
@@ -0,0 +1,278 @@
+'''
+Genomic intervals used for fetching records from indexed VCF/BCF files and for
+splitting work into chunks that can be processed independently.
+'''
+
+import re
+from collections import defaultdict, namedtuple
+
+Interval = namedtuple("Interval", "contig start end")
+''' 0-based, half-open interval. An end of None means end of contig. '''
+
+_region_re = re.compile(r'^(.+):([\d,]+)(-([\d,]+))?$')
+_shard_re = re.compile(r'^(\d+)/(\d+)$')
+
+
+def parse_region(region, contigs=()):
+    '''
+    Parse a region string of the form 'chr', 'chr:start' or 'chr:start-end'
+    using 1-based, inclusive coordinates and return an Interval. As with
+    samtools/tabix a region without an end position extends to the end of the
+    contig. If region matches one of the names in contigs it is treated as
+    a whole contig even if it contains a colon.
+    '''
+    if region in contigs:
+        return Interval(region, 0, None)
+    match = _region_re.match(region)
+    if match is None:
+        return Interval(region, 0, None)
+    start = int(match.group(2).replace(',', ''))
+    end = None
+    if match.group(4) is not None:
+        end = int(match.group(4).replace(',', ''))
+        if end < start:
+            raise ValueError("Invalid region '{}' - ".format(region) +
+                             "end is before start.")
+    if start < 1:
+        raise ValueError("Invalid region '{}' - ".format(region) +
+                         "start must be greater than 0.")
+    return Interval(match.group(1), start - 1, end)
+
+
+def _data_lines(path):
+    with open(path, 'rt') as fh:
+        for line in fh:
+            if line.startswith(('#', 'track', 'browser')) or not line.strip():
+                continue
+            yield line.split()
+
+
+def read_bed(path):
+    ''' Return a list of Intervals from a BED file. '''
+    intervals = []
+    for split in _data_lines(path):
+        try:
+            intervals.append(Interval(split[0], int(split[1]),
+                                      int(split[2])))
+        except (IndexError, ValueError):
+            raise ValueError("Invalid BED line in {}: '{}'".format(
+                path, '\t'.join(split)))
+    return intervals
+
+
+def read_sites(path):
+    '''
+    Read a file of whitespace separated contig and 1-based position pairs
+    (one per line) and return a dict of contigs to sets of positions.
+    '''
+    sites = defaultdict(set)
+    for split in _data_lines(path):
+        try:
+            sites[split[0]].add(int(split[1]))
+        except (IndexError, ValueError):
+            raise ValueError("Invalid site line in {}: '{}'".format(
+                path, '\t'.join(split)))
+    return sites
+
+
+def site_intervals(sites):
+    ''' Return a 1bp Interval for each position in a dict of sites. '''
+    return [Interval(c, p - 1, p) for c in sites for p in sites[c]]
+
+
+def merge_intervals(intervals, contigs):
+    '''
+    Sort intervals by the contig order given in contigs and start position
+    and merge any overlapping or adjacent intervals. Intervals on contigs not
+    in contigs are dropped.
+    '''
+    order = dict((c, i) for i, c in enumerate(contigs))
+    intervals = sorted((x for x in intervals if x.contig in order),
+                       key=lambda x: (order[x.contig], x.start))
+    merged = []
+    for interval in intervals:
+        if merged and merged[-1].contig == interval.contig:
+            prev = merged[-1]
+            if prev.end is None:
+                continue
+            if interval.start <= prev.end:
+                end = None if interval.end is None else max(prev.end,
+                                                            interval.end)
+                merged[-1] = Interval(prev.contig, prev.start, end)
+                continue
+        merged.append(interval)
+    return merged
+
+
+def exclude_contigs(contigs, patterns):
+    '''
+    Return contigs that do not match any of the given regular expressions.
+    '''
+    regexes = [re.compile(x) for x in patterns]
+    return [c for c in contigs if not any(r.search(c) for r in regexes)]
+
+
+def skip_contigs(records, patterns):
+    '''
+    Yield records from contigs not matching any of the given regular
+    expressions. Used when there is no index to restrict fetching to the
+    contigs of interest.
+    '''
+    regexes = [re.compile(x) for x in patterns]
+    skip = dict()
+    for record in records:
+        if record.chrom not in skip:
+            skip[record.chrom] = any(r.search(record.chrom) for r in regexes)
+        if not skip[record.chrom]:
+            yield record
+
+
+def filter_sites(records, sites):
+    ''' Yield only records starting at a position in dict of sites. '''
+    for record in records:
+        if record.pos in sites.get(record.chrom, ()):
+            yield record
+
+
+def _overlaps(record, interval):
+    if interval.end is not None and record.start >= interval.end:
+        return False
+    return record.stop > interval.start
+
+
+def fetch_intervals(vcf, intervals, previous=None):
+    '''
+    Fetch records overlapping a sorted list of non-overlapping intervals from
+    an indexed pysam.VariantFile, yielding each record only once.
+
+    A record overlapping more than one interval is yielded for the first
+    interval it overlaps. Records overlapping the 'previous' interval are
+    assumed to have already been yielded elsewhere (e.g. by another process
+    handling the preceding chunk) and are skipped.
+
+    Args:
+        vcf:        pysam.VariantFile with an index
+
+        intervals:  iterable of Interval tuples
+
+        previous:   Interval preceding the first of 'intervals'
+    '''
+    for interval in intervals:
+        check_prev = previous is not None and \
+            previous.contig == interval.contig
+        for record in vcf.fetch(interval.contig, interval.start,
+                                interval.end):
+            if check_prev:
+                if _overlaps(record, previous):
+                    continue
+                check_prev = False  # records are sorted, no more overlaps
+            yield record
+        previous = interval
+
+
+def resume_intervals(intervals, contig, start):
+    '''
+    Return a tuple of the intervals remaining and a 'previous' interval
+    (suitable for passing to fetch_intervals) for resuming processing of a
+    sorted list of non-overlapping intervals at the first record starting
+    at 0-based position 'start' on contig, assuming all records preceding
+    it have already been processed.
+    '''
+    for i, interval in enumerate(intervals):
+        if interval.contig != contig:
+            continue
+        if interval.end is None or interval.end > start:
+            first = Interval(contig, max(interval.start, start),
+                             interval.end)
+            return [first] + intervals[i + 1:], Interval(contig, 0, start)
+    return [], None
+
+
+def contig_intervals(index):
+    ''' Return an Interval spanning each contig with records in index. '''
+    return [Interval(c, 0, None) for c in index.contigs if index.n_mapped[c]]
+
+
+def partition_intervals(intervals, index, n_parts):
+    '''
+    Split intervals into up to n_parts lists of contiguous intervals, each
+    containing a similar number of records as estimated from the index.
+    Intervals may be split at index bin boundaries to balance chunks.
+
+    Returns a list of (intervals, previous) tuples, where previous is the
+    interval preceding the first interval of each chunk (or None), suitable
+    for passing to fetch_intervals.
+    '''
+    pieces = []  # (Interval, estimated records)
+    for interval in intervals:
+        start = interval.start
+        weight = 0
+        for pos, w in index.density(interval.contig):
+            if pos < interval.start or (interval.end is not None and
+                                        pos >= interval.end):
+                continue
+            if pos > start and weight:
+                pieces.append((Interval(interval.contig, start, pos),
+                               weight))
+                start = pos
+                weight = 0
+            weight += w
+        pieces.append((Interval(interval.contig, start, interval.end),
+                       weight))
+    target = sum(w for _, w in pieces) / max(n_parts, 1)
+    parts = []
+    current = []
+    acc = 0
+    for interval, weight in pieces:
+        if current and acc >= target and len(parts) < n_parts - 1:
+            parts.append(current)
+            current = []
+            acc = 0
+        if current and current[-1].contig == interval.contig and \
+                current[-1].end == interval.start:
+            current[-1] = Interval(interval.contig, current[-1].start,
+                                   interval.end)  # rejoin split interval
+        else:
+            current.append(interval)
+        acc += weight
+    if current:
+        parts.append(current)
+    chunks = []
+    previous = None
+    for part in parts:
+        chunks.append((part, previous))
+        previous = part[-1]
+    return chunks
+
+
+def parse_shard(shard):
+    '''
+    Parse a shard string of the form 'i/N' (e.g. '3/10') and return a tuple
+    of i and N. Shards are numbered from 1 to N.
+    '''
+    match = _shard_re.match(shard.strip())
+    if match is None:
+        raise ValueError("Invalid shard '{}' - must be of ".format(shard) +
+                         "the form i/N (e.g. 1/10).")
+    i, n = int(match.group(1)), int(match.group(2))
+    if not 1 <= i <= n:
+        raise ValueError("Invalid shard '{}' - i must be ".format(shard) +
+                         "between 1 and N.")
+    return i, n
+
+
+def shard_intervals(intervals, index, shard, n_shards):
+    '''
+    Return the intervals for shard number 'shard' (from 1 to n_shards) of
+    intervals split using partition_intervals and the interval preceding
+    them (or None), suitable for passing to fetch_intervals. The split
+    depends only on intervals and index, so each of n_shards processes can
+    determine its own shard independently. As records are assigned to the
+    shard containing their start position, no record is in more than one
+    shard. If the records are too few to give n_shards shards, the highest
+    numbered shards are empty.
+    '''
+    parts = partition_intervals(intervals, index, n_shards)
+    if shard > len(parts):
+        return [], None
+    return parts[shard - 1]
@@ -0,0 +1,44 @@
+'''
+Resolve sample names to column indices so that per-sample FORMAT values can be
+retrieved from pysam VariantRecords by index rather than by name.
+'''
+
+
+class SampleHandle(int):
+    '''
+    0-based column index of a sample in a VCF which also retains the sample
+    name. As a SampleHandle is an int it can be used anywhere a sample name
+    or index is accepted by pysam (e.g. record.samples[handle]) but avoids
+    the cost of looking up the sample name for every record.
+    '''
+
+    def __new__(cls, index, name):
+        handle = int.__new__(cls, index)
+        handle.name = name
+        return handle
+
+    def __repr__(self):
+        return "SampleHandle({}, '{}')".format(int(self), self.name)
+
+    def __reduce__(self):
+        return (SampleHandle, (int(self), self.name))
+
+
+def get_sample_handles(vcf, samples):
+    '''
+    Return a list of SampleHandles for the given sample names in the header
+    of vcf, which may be a pysam.VariantFile or pysam.VariantHeader. Raises
+    a ValueError if any sample is not present.
+    '''
+    header = getattr(vcf, 'header', vcf)
+    indices = dict((s, i) for i, s in enumerate(header.samples))
+    missing = [x for x in samples if x not in indices]
+    if missing:
+        raise ValueError("The following specified samples were not found in " +
+                         "the VCF: " + ",".join(missing))
+    return [SampleHandle(indices[x], x) for x in samples]
+
+
+def sample_name(sample):
+    ''' Return name of sample, which may be a SampleHandle or a string. '''
+    return getattr(sample, 'name', sample)
@@ -0,0 +1,86 @@
+'''
+Site-level filters using only the FILTER, QUAL and INFO values of a record.
+
+These are evaluated before any FORMAT values are read so that records failing
+them never have their per-sample values decoded.
+'''
+
+from . import genotype_filter
+from .bit_utils import set_first_bits
+from .genotype_filter import FilterExpression
+
+
+class InfoValues(object):
+    '''
+    Provides INFO values of a record to the evaluate function of an INFO
+    FilterExpression. Values are retrieved by indexing with a (sample, field)
+    tuple as for a FormatCache, but sample is ignored. Indexing raises a
+    KeyError if field is not present in the record.
+    '''
+
+    __slots__ = ('record', '_info')
+
+    def __init__(self, record):
+        self.record = record
+        self._info = record.info
+
+    def __getitem__(self, key):
+        return self._info[key[1]]
+
+
+class SiteFilter(object):
+    '''
+    Filter records on their FILTER, QUAL and INFO values.
+    '''
+
+    def __init__(self, vcf, info_expressions=[], pass_only=False,
+                 min_qual=None, logger=None):
+        '''
+        Args:
+            vcf:    VariantFile or VariantHeader object from pysam.
+
+            info_expressions:
+                    iterable of expressions using INFO fields. These use
+                    the same syntax as FORMAT field expressions (see
+                    cafex.genotype_filter.FilterExpression) except that a
+                    minimum number of matching samples can not be given.
+                    ALT alleles must match all expressions to pass.
+
+            pass_only:
+                    if True, filter records unless their only FILTER value
+                    is PASS.
+
+            min_qual:
+                    filter records with a QUAL lower than this value or
+                    with no QUAL value.
+
+            logger: logger used to warn of INFO fields with fewer values
+                    than expected.
+        '''
+        if logger is not None:
+            genotype_filter._ext_logger = logger
+        self.expressions = [FilterExpression(x, vcf, field_type='INFO') for
+                            x in info_expressions or []]
+        self.pass_only = pass_only
+        self.min_qual = min_qual
+
+    def filter(self, record):
+        '''
+        Return a bitwise flag with bits set for each ALT allele of record
+        passing all site-level filters.
+        '''
+        if self.pass_only and record.filter.keys() != ['PASS']:
+            return 0
+        if self.min_qual is not None:
+            qual = record.qual
+            if qual is None or qual < self.min_qual:
+                return 0
+        n_alts = len(record.alts)
+        flag = set_first_bits(n_alts)
+        if self.expressions:
+            info = InfoValues(record)
+            for exp in self.expressions:
+                flag &= exp.evaluate(info, None, n_alts)
+                if not flag:
+                    break
+        return flag
@@ -0,0 +1,46 @@
+'''
+Write records without their sample columns.
+
+pysam can not write a record to a file whose header has a different number of
+samples, and has no way of removing samples from a record or header other
+than subsetting samples when reading. Sites-only records are therefore
+created from the CHROM to INFO columns of each record on a header without
+samples, which is much quicker than encoding the FORMAT values of every
+sample when an input has many samples.
+'''
+
+import os
+import pysam
+import tempfile
+
+
+def get_sites_header(header):
+    '''
+    Return a copy of a pysam.VariantHeader with no samples. All header
+    lines (including FORMAT definitions) are kept.
+    '''
+    lines = str(header).split('\n')
+    lines[-2] = '\t'.join(lines[-2].split('\t')[:8])  # #CHROM line
+    fd, path = tempfile.mkstemp(suffix='.vcf')
+    try:
+        with os.fdopen(fd, 'wt') as fh:
+            fh.write('\n'.join(lines))
+        with pysam.VariantFile(path) as vcf:
+            return vcf.header.copy()
+    finally:
+        os.remove(path)
+
+
+def sites_record(header, record):
+    '''
+    Return a new record for header (as returned by get_sites_header) with the
+    same CHROM, POS, ID, REF, ALT, QUAL, FILTER and INFO values as record.
+    '''
+    return header.new_record(contig=record.chrom,
+                             start=record.start,
+                             stop=record.stop,
+                             alleles=record.alleles,
+                             id=record.id,
+                             qual=record.qual,
+                             filter=record.filter.keys(),
+                             info=dict(record.info))
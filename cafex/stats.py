@@ -0,0 +1,162 @@
+'''
+Collect timings, call counts and the numbers of ALT alleles removed by each
+filtering stage and expression, per contig, and write them as a JSON report.
+'''
+
+import json
+import time
+from collections import OrderedDict
+from .bit_utils import count_set_bits
+
+STAGES = ('site', 'genotypes', 'control_expressions', 'case_expressions',
+          'vaf')
+
+
+class ContigStats(object):
+    ''' Counts and timings for the records from a single contig. '''
+
+    def __init__(self, n_case_expressions=0, n_control_expressions=0):
+        self.records = 0
+        self.alts = 0
+        self.passed = 0
+        self.calls = dict((x, 0) for x in STAGES)
+        self.seconds = dict((x, 0.0) for x in STAGES)
+        self.cleared = dict((x, 0) for x in STAGES)
+        self.expressions = {
+            'case_expressions': [0] * n_case_expressions,
+            'control_expressions': [0] * n_control_expressions}
+
+    def add_stage(self, stage, start, before, after):
+        '''
+        Record a call of stage that started at start (from
+        time.perf_counter) and changed the flag of ALT alleles from before
+        to after.
+        '''
+        self.seconds[stage] += time.perf_counter() - start
+        self.calls[stage] += 1
+        self.cleared[stage] += count_set_bits(before & ~after)
+
+    def merge(self, other):
+        ''' Add the counts and timings of another ContigStats. '''
+        self.records += other.records
+        self.alts += other.alts
+        self.passed += other.passed
+        for stage in STAGES:
+            self.calls[stage] += other.calls[stage]
+            self.seconds[stage] += other.seconds[stage]
+            self.cleared[stage] += other.cleared[stage]
+        for k, v in other.expressions.items():
+            self.expressions[k] = [x + y for x, y in
+                                   zip(self.expressions[k], v)]
+
+
+class RunStats(object):
+    '''
+    Per-contig timings and counts of records and ALT alleles removed by
+    each filtering stage and expression during a run.
+    '''
+
+    def __init__(self, case_expressions=[], control_expressions=[]):
+        '''
+        Args:
+            case_expressions:    expressions used for case samples.
+
+            control_expressions: expressions used for control samples.
+        '''
+        self.case_expressions = list(case_expressions or [])
+        self.control_expressions = list(control_expressions or [])
+        self.contigs = OrderedDict()
+        self.wall_seconds = None  # if None, time since creation is reported
+        self._start = time.time()
+
+    @classmethod
+    def from_dict(cls, data):
+        '''
+        Return a RunStats object from a dict as returned by to_dict (e.g.
+        read from a JSON report written by a previous run).
+        '''
+        expressions = data['expressions']
+        stats = cls([x['expression'] for x in
+                     expressions['case_expressions']],
+                    [x['expression'] for x in
+                     expressions['control_expressions']])
+        stats.wall_seconds = data['wall_seconds']
+        for name, values in data['contigs'].items():
+            contig = stats.contig(name)
+            contig.records = values['records']
+            contig.alts = values['alts']
+            contig.passed = values['passed']
+            for stage in STAGES:
+                contig.calls[stage] = values['stages'][stage]['calls']
+                contig.seconds[stage] = values['stages'][stage]['seconds']
+                contig.cleared[stage] = values['stages'][stage][
+                    'alts_cleared']
+            for k, v in values['expressions'].items():
+                contig.expressions[k] = [x['alts_cleared'] for x in v]
+        return stats
+
+    def contig(self, name):
+        ''' Return ContigStats for contig, creating it if necessary. '''
+        try:
+            return self.contigs[name]
+        except KeyError:
+            stats = ContigStats(len(self.case_expressions),
+                                len(self.control_expressions))
+            self.contigs[name] = stats
+            return stats
+
+    def merge(self, other):
+        ''' Add the counts and timings of another RunStats. '''
+        for name, stats in other.contigs.items():
+            self.contig(name).merge(stats)
+
+    def total(self):
+        ''' Return a ContigStats summed over all contigs. '''
+        total = ContigStats(len(self.case_expressions),
+                            len(self.control_expressions))
+        for stats in self.contigs.values():
+            total.merge(stats)
+        return total
+
+    def _stats_dict(self, stats):
+        expressions = OrderedDict()
+        for k in ('control_expressions', 'case_expressions'):
+            expressions[k] = [OrderedDict([('expression', x),
+                                           ('alts_cleared', y)]) for x, y in
+                              zip(getattr(self, k), stats.expressions[k])]
+        stages = OrderedDict()
+        for stage in STAGES:
+            stages[stage] = OrderedDict([
+                ('calls', stats.calls[stage]),
+                ('seconds', stats.seconds[stage]),
+                ('alts_cleared', stats.cleared[stage])])
+        return OrderedDict([('records', stats.records),
+                            ('alts', stats.alts),
+                            ('passed', stats.passed),
+                            ('stages', stages),
+                            ('expressions', expressions)])
+
+    def to_dict(self):
+        '''
+        Return a dict of stats summed over all contigs, plus the same stats
+        per contig under the key 'contigs'.
+        '''
+        wall_seconds = self.wall_seconds
+        if wall_seconds is None:
+            wall_seconds = time.time() - self._start
+        result = OrderedDict([('wall_seconds', wall_seconds)])
+        result.update(self._stats_dict(self.total()))
+        result['contigs'] = OrderedDict((k, self._stats_dict(v)) for k, v in
+                                        self.contigs.items())
+        return result
+
+    def write(self, path):
+        ''' Write stats to path in JSON format. '''
+        with open(path, 'wt') as fh:
+            json.dump(self.to_dict(), fh, indent=2)
+
+
+def read_stats(path):
+    ''' Return a RunStats object from a JSON report written to path. '''
+    with open(path, 'rt') as fh:
+        return RunStats.from_dict(json.load(fh))
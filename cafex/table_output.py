@@ -0,0 +1,268 @@
+'''
+Write passing ALT alleles to a typed Arrow IPC or Parquet table.
+
+Each row is one ALT allele passing all filters, giving its site, the bitwise
+filter flag of its record, the maximum VAFs of case and control samples and
+the values of chosen FORMAT fields for each case and control sample. Rows are
+buffered and written as a record batch (a row group for Parquet) every
+row_group_size rows so that memory use is bounded regardless of the number of
+variants. Requires pyarrow.
+'''
+
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .case_control_filter import get_max_vafs
+from .format_cache import FormatCache
+from .samples import sample_name
+
+ROW_GROUP_SIZE = 65_536
+TABLE_FORMATS = {'.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow',
+                 '.parquet': 'parquet', '.pq': 'parquet'}
+FIELD_TYPES = {'Integer': pa.int32(), 'Float': pa.float32(),
+               'String': pa.string(), 'Character': pa.string()}
+SITE_COLUMNS = (('chrom', pa.string()), ('pos', pa.int64()),
+                ('id', pa.string()), ('ref', pa.string()),
+                ('alt', pa.string()), ('allele', pa.int32()),
+                ('filter_flag', pa.int64()))
+
+
+def get_table_format(path):
+    '''
+    Return 'arrow' or 'parquet' according to the extension of path. Raises
+    a ValueError for unrecognised extensions.
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in TABLE_FORMATS:
+        raise ValueError("Can not determine table format of {} - ".format(
+            path) + "extension must be one of " + ", ".join(TABLE_FORMATS))
+    return TABLE_FORMATS[ext]
+
+
+def _scalar(value, allele):
+    return value
+
+
+def _alt_value(value, allele):
+    if value is None or allele > len(value):  # no-calls may have 1 value
+        return None
+    return value[allele - 1]
+
+
+def _ref_alt_values(value, allele):
+    if value is None or allele >= len(value):
+        return None
+    return [value[0], value[allele]]
+
+
+def _genotype(gt, phased):
+    ''' Format a GT tuple as in VCF text (e.g. "0/1" or "1|0"). '''
+    return ('|' if phased else '/').join('.' if x is None else str(x) for
+                                         x in gt)
+
+
+def _all_values(value, allele):
+    if value is None:
+        return None
+    return list(value) if isinstance(value, tuple) else [value]
+
+
+class TableWriter(object):
+    '''
+    Write passing ALT alleles of records to an Arrow IPC or Parquet file.
+
+    Columns are chrom, pos, id, ref, alt, allele (the index of the ALT
+    allele in record.alleles), filter_flag, case_max_vaf and
+    control_max_vaf (if a VAF calculation method is given and case or
+    control samples are given) and one column per sample and FORMAT field
+    named "<sample>:<field>". FORMAT fields with Number=A give the value for
+    the ALT allele, Number=1 fields a single value, Number=R fields a list
+    of the REF and ALT allele values and other fields a list of all values.
+    GT values are given as strings as they appear in VCF text.
+    '''
+
+    def __init__(self, path, vcf, case=[], control=[], fields=[],
+                 vaf_calculation=None, table_format=None,
+                 row_group_size=ROW_GROUP_SIZE):
+        '''
+        Args:
+            path:   output filename.
+
+            vcf:    VariantFile or VariantHeader object from pysam.
+
+            case:   case samples (names or SampleHandles).
+
+            control:
+                    control samples (names or SampleHandles).
+
+            fields: FORMAT fields to output for each case and control
+                    sample.
+
+            vaf_calculation:
+                    VAF calculation method for vcf as returned by
+                    cafex.vaf.get_vaf_method with all_alleles=True. VAF
+                    columns are only written if given.
+
+            table_format:
+                    'arrow' for Arrow IPC or 'parquet'. Inferred from the
+                    extension of path if not given.
+
+            row_group_size:
+                    number of rows to buffer before writing a record batch.
+        '''
+        header = getattr(vcf, 'header', vcf)
+        self.path = path
+        self.table_format = table_format or get_table_format(path)
+        if self.table_format not in ('arrow', 'parquet'):
+            raise ValueError("Unrecognised table format '{}'".format(
+                self.table_format))
+        self.case = list(case)
+        self.control = list(control)
+        self.fields = list(fields)
+        self.row_group_size = row_group_size
+        self.vaf_calculation = vaf_calculation
+        columns = list(SITE_COLUMNS)
+        vaf_columns = []  # (is_control, samples, column index)
+        if self.vaf_calculation is not None:
+            for is_control, (name, samples) in enumerate(
+                    (('case', self.case), ('control', self.control))):
+                if samples:
+                    vaf_columns.append((is_control, samples, len(columns)))
+                    columns.append((name + '_max_vaf', pa.float64()))
+        samples = []
+        for x in self.case + self.control:
+            if x not in samples:
+                samples.append(x)
+        field_columns = []
+        for field in self.fields:
+            if field not in header.formats:
+                raise ValueError("FORMAT field '{}' ".format(field) +
+                                 "for table output not found in VCF header.")
+            meta = header.formats[field]
+            if meta.type not in FIELD_TYPES:
+                raise ValueError("Unsupported type '{}' for FORMAT ".format(
+                    meta.type) + "field '{}'".format(field))
+            col_type = FIELD_TYPES[meta.type]
+            if meta.number == 1:
+                get_value = _scalar
+            elif meta.number == 'A':
+                get_value = _alt_value
+            else:
+                get_value = (_ref_alt_values if meta.number == 'R' else
+                             _all_values)
+                col_type = pa.list_(col_type)
+            field_columns.append((field, get_value, len(columns)))
+            columns.extend(("{}:{}".format(sample_name(x), field), col_type)
+                           for x in samples)
+        self.schema = pa.schema(columns)
+        self._columns = [[] for _ in columns]
+        self._site_columns = self._columns[:len(SITE_COLUMNS)]
+        self._vaf_columns = [(x, y, self._columns[i]) for x, y, i in
+                             vaf_columns]
+        self._samples = samples
+        self._field_columns = [
+            (field, get_value, self._columns[i:i + len(samples)]) for
+            field, get_value, i in field_columns]
+        self._n_rows = 0
+        if self.table_format == 'parquet':
+            self._writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema)
+
+    def write(self, record, filter_flag, cache=None, case_vafs=None,
+              control_vafs=None):
+        '''
+        Add a row for each ALT allele of record with a bit set in
+        filter_flag. FORMAT values are read via cache if given. case_vafs
+        and control_vafs are the maximum VAFs of each ALT allele for case
+        and control samples (as calculated when filtering, see
+        cafex.case_control_filter.vaf_flag) and are calculated if None.
+        '''
+        if not filter_flag:
+            return
+        if cache is None:
+            cache = FormatCache(record)
+        alts = record.alts
+        if filter_flag == 1:  # most often the only ALT
+            alleles = (1,)
+        else:
+            alleles = [i for i in range(1, len(alts) + 1) if
+                       filter_flag >> (i - 1) & 1]
+        n = len(alleles)
+        site_values = (record.chrom, record.pos, record.id, record.ref)
+        if n == 1:
+            for col, value in zip(self._site_columns, site_values +
+                                  (alts[alleles[0] - 1], alleles[0],
+                                   filter_flag)):
+                col.append(value)
+        else:
+            for col, value in zip(self._site_columns, site_values):
+                col.extend([value] * n)
+            cols = self._site_columns
+            cols[4].extend(alts[i - 1] for i in alleles)
+            cols[5].extend(alleles)
+            cols[6].extend([filter_flag] * n)
+        for is_control, samples, col in self._vaf_columns:
+            vafs = control_vafs if is_control else case_vafs
+            if vafs is None:
+                vafs = get_max_vafs(record, samples, self.vaf_calculation,
+                                    cache, filter_flag)
+            if n == 1:
+                col.append(vafs[alleles[0] - 1])
+            else:
+                col.extend(vafs[i - 1] for i in alleles)
+        for field, get_value, cols in self._field_columns:
+            try:
+                if field == 'GT':
+                    calls = record.samples
+                    values = [_genotype(calls[x]['GT'], calls[x].phased) for
+                              x in self._samples]
+                else:
+                    values = [cache[x, field] for x in self._samples]
+            except KeyError:  # field not present in this record
+                values = [None] * len(cols)
+            if n == 1:
+                allele = alleles[0]
+                for col, value in zip(cols, values):
+                    col.append(get_value(value, allele))
+            else:
+                for col, value in zip(cols, values):
+                    col.extend(get_value(value, i) for i in alleles)
+        self._n_rows += n
+        if self._n_rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        ''' Write any buffered rows as a record batch. '''
+        if not self._n_rows:
+            return
+        arrays = [pa.array(x, type=y.type) for x, y in
+                  zip(self._columns, self.schema)]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        self._writer.write_batch(batch)
+        for col in self._columns:
+            col.clear()
+        self._n_rows = 0
+
+    def append(self, path, remove=True):
+        '''
+        Write all rows from an Arrow IPC file written by another TableWriter
+        with the same schema and optionally delete path afterwards.
+        '''
+        self.flush()
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                self._writer.write_batch(reader.get_batch(i))
+        if remove:
+            os.remove(path)
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -8,6 +8,8 @@ the VAF from a pysam VariantRecord or a ValueError if no appropriate header
 fields can be identified.
 '''
 
+from .format_cache import FormatCache
+
 
 def _vaf_ad_dp(ad, dp):
     if dp > 0.0 and ad is not None:
@@ -15,72 +17,241 @@ def _vaf_ad_dp(ad, dp):
     return 0.0
 
 
-def _get_ad_vaf(record, sample, allele):
+def _get_ad_vaf(record, sample, allele, cache=None):
+    if cache is None:
+        cache = FormatCache(record)
     try:
-        ad = record.samples[sample]['AD']
+        ad = cache[sample, 'AD']
         dp = sum(filter(None, ad))
         return _vaf_ad_dp(ad[allele], dp)
     except IndexError:  # no-calls may only have one value even if >1 ALTs
         return 0.0
 
 
-def _get_svaba_vaf(record, sample, allele):
+def _get_svaba_vaf(record, sample, allele, cache=None):
     # only ever 1 value for AD in SvABA
-    ad = record.samples[sample]['AD']
-    dp = record.samples[sample]['DP']
-    return _vaf_ad_dp(ad, dp)
+    if cache is None:
+        cache = FormatCache(record)
+    return _vaf_ad_dp(cache[sample, 'AD'], cache[sample, 'DP'])
 
 
-def _get_strelka_snv_vaf(record, sample, allele):
+def _get_strelka_snv_vaf(record, sample, allele, cache=None):
+    if cache is None:
+        cache = FormatCache(record)
     ref_k = record.ref + 'U'
     alt_k = record.alleles[allele] + 'U'
-    ad = record.samples[sample][alt_k][0]
-    dp = record.samples[sample][ref_k][0] + ad
+    ad = cache[sample, alt_k][0]
+    dp = cache[sample, ref_k][0] + ad
     return _vaf_ad_dp(ad, dp)
 
 
-def _get_strelka_indel_vaf(record, sample, allele):
-    ad = record.samples[sample]['TIR'][0]
-    dp = record.samples[sample]['TAR'][0] + ad
+def _get_strelka_indel_vaf(record, sample, allele, cache=None):
+    if cache is None:
+        cache = FormatCache(record)
+    ad = cache[sample, 'TIR'][0]
+    dp = cache[sample, 'TAR'][0] + ad
     return _vaf_ad_dp(ad, dp)
 
 
-def _get_strelka_vaf(record, sample, allele):
-    if 'AU' in record.format:
-        return _get_strelka_snv_vaf(record, sample, allele)
-    return _get_strelka_indel_vaf(record, sample, allele)
+def _get_strelka_vaf(record, sample, allele, cache=None):
+    if cache is None:
+        cache = FormatCache(record)
+    if cache.has_field('AU'):
+        return _get_strelka_snv_vaf(record, sample, allele, cache)
+    return _get_strelka_indel_vaf(record, sample, allele, cache)
 
 
-def _get_platypus_vaf(record, sample, allele):
+def _get_platypus_vaf(record, sample, allele, cache=None):
+    if cache is None:
+        cache = FormatCache(record)
     try:
-        ad = record.samples[sample]['NV'][allele - 1]
-        dp = record.samples[sample]['NR'][allele - 1]
+        ad = cache[sample, 'NV'][allele - 1]
+        dp = cache[sample, 'NR'][allele - 1]
     except IndexError:  # no-calls will only have one value even if >1 ALTs
         return 0.0
     return _vaf_ad_dp(ad, dp)
 
 
-def _get_freebayes_vaf(record, sample, allele):
+def _get_freebayes_vaf(record, sample, allele, cache=None):
+    if cache is None:
+        cache = FormatCache(record)
     try:
-        ad = record.samples[sample]['AO'][allele - 1]
-        dp = record.samples[sample]['RO'] + ad
+        ad = cache[sample, 'AO'][allele - 1]
+        dp = cache[sample, 'RO'] + ad
     except IndexError:  # no-calls may only have one value even if >1 ALTs
         return 0.0
     return _vaf_ad_dp(ad, dp)
 
 
-def get_vaf_method(vcf):
+def _pad_vafs(vafs, record):
+    '''
+    Return vafs with exactly one value per ALT allele of record, adding VAFs
+    of 0.0 for any ALT alleles missing from vafs (e.g. for no-calls or
+    records with fewer AD values than alleles).
+    '''
+    n_alts = len(record.alleles) - 1
+    if len(vafs) == n_alts:
+        return vafs
+    return (vafs + [0.0] * n_alts)[:n_alts]
+
+
+def _get_ad_vafs(record, sample, cache=None, mask=None):
+    if cache is None:
+        cache = FormatCache(record)
+    ad = cache[sample, 'AD']
+    if None in ad:  # no-calls may only have one value even if >1 ALTs
+        dp = sum(filter(None, ad))
+        return _pad_vafs([_vaf_ad_dp(x, dp) for x in ad[1:]], record)
+    dp = sum(ad)
+    if dp > 0:
+        return _pad_vafs([x / dp for x in ad[1:]], record)
+    return _pad_vafs([], record)
+
+
+def _get_svaba_vafs(record, sample, cache=None, mask=None):
+    # only ever 1 value for AD in SvABA
+    return [_get_svaba_vaf(record, sample, 1, cache)] * \
+        (len(record.alleles) - 1)
+
+
+def _get_strelka_snv_vafs(record, sample, cache=None, mask=None):
+    if cache is None:
+        cache = FormatCache(record)
+    alleles = record.alleles
+    ref = cache[sample, alleles[0] + 'U'][0]
+    vafs = []
+    for i, alt in enumerate(alleles[1:]):
+        if mask is None or mask >> i & 1:
+            ad = cache[sample, alt + 'U'][0]
+            vafs.append(_vaf_ad_dp(ad, ref + ad))
+        else:
+            vafs.append(0.0)
+    return vafs
+
+
+def _get_strelka_indel_vafs(record, sample, cache=None, mask=None):
+    return [_get_strelka_indel_vaf(record, sample, 1, cache)] * \
+        (len(record.alleles) - 1)
+
+
+def _get_strelka_vafs(record, sample, cache=None, mask=None):
+    if cache is None:
+        cache = FormatCache(record)
+    if cache.has_field('AU'):  # checked once per record per cache
+        return _get_strelka_snv_vafs(record, sample, cache, mask)
+    return _get_strelka_indel_vafs(record, sample, cache, mask)
+
+
+def _get_platypus_vafs(record, sample, cache=None, mask=None):
+    if cache is None:
+        cache = FormatCache(record)
+    nv = cache[sample, 'NV']
+    nr = cache[sample, 'NR']
+    if None in nv or None in nr:  # no-calls will only have one value
+        return _pad_vafs([_vaf_ad_dp(x, y) if y is not None else 0.0 for
+                          x, y in zip(nv, nr)], record)
+    return _pad_vafs([_vaf_ad_dp(x, y) for x, y in zip(nv, nr)], record)
+
+
+def _get_freebayes_vafs(record, sample, cache=None, mask=None):
+    if cache is None:
+        cache = FormatCache(record)
+    ao = cache[sample, 'AO']
+    ro = cache[sample, 'RO']
+    if None in ao or ro is None:  # no-calls may only have one value
+        return _pad_vafs([_vaf_ad_dp(x, (ro or 0) + x) if x is not None else
+                          0.0 for x in ao], record)
+    return _pad_vafs([_vaf_ad_dp(x, ro + x) for x in ao], record)
+
+
+ALL_ALLELE_METHODS = {
+    _get_ad_vaf: _get_ad_vafs,
+    _get_svaba_vaf: _get_svaba_vafs,
+    _get_strelka_snv_vaf: _get_strelka_snv_vafs,
+    _get_strelka_indel_vaf: _get_strelka_indel_vafs,
+    _get_strelka_vaf: _get_strelka_vafs,
+    _get_platypus_vaf: _get_platypus_vafs,
+    _get_freebayes_vaf: _get_freebayes_vafs,
+}
+
+
+VAF_FIELDS = {
+    _get_ad_vaf: ('AD',),
+    _get_svaba_vaf: ('AD', 'DP'),
+    _get_strelka_snv_vaf: ('AU', 'CU', 'GU', 'TU'),
+    _get_strelka_indel_vaf: ('TAR', 'TIR'),
+    _get_strelka_vaf: ('AU', 'CU', 'GU', 'TU', 'TAR', 'TIR'),
+    _get_platypus_vaf: ('NR', 'NV'),
+    _get_freebayes_vaf: ('AO', 'RO'),
+}
+
+
+def get_vaf_fields(vaf_func):
+    '''
+    Return a tuple of the FORMAT fields read by a VAF calculation function
+    as returned by get_vaf_method (or a VafMemo wrapping one).
+    '''
+    vaf_func = getattr(vaf_func, 'vaf_func', vaf_func)
+    for func, fields in VAF_FIELDS.items():
+        if vaf_func is func or vaf_func is ALL_ALLELE_METHODS[func]:
+            return fields
+    raise ValueError("Unrecognised VAF calculation function.")
+
+
+class VafMemo(object):
+    '''
+    Wrap an all-allele VAF calculation function (as returned by
+    get_vaf_method with all_alleles=True) so that the VAFs for each sample
+    are only calculated once per record. Values are discarded when called
+    with a different record, so filters for several groups of samples
+    applied to the same record can share VAF calculations for samples in
+    more than one group.
+    '''
+
+    def __init__(self, vaf_func):
+        self.vaf_func = vaf_func
+        self._record = None
+        self._vafs = dict()
+
+    def __call__(self, record, sample, cache=None, mask=None):
+        if record is not self._record:
+            self._record = record
+            self._vafs = dict()
+        calculated, vafs = self._vafs.get(sample, (0, None))
+        if calculated is None:
+            return vafs
+        if mask is not None:
+            if vafs is not None and not mask & ~calculated:
+                return vafs
+            mask |= calculated  # keep VAFs already required
+        vafs = self.vaf_func(record, sample, cache, mask)
+        self._vafs[sample] = (mask, vafs)
+        return vafs
+
+
+def get_vaf_method(vcf, all_alleles=False):
     '''
     Scan VCF header to determine which method to use to calculate VAF. Returns
     a function to calculate VAF for given pysam.VariantRecord, sample and
-    allele index.
+    allele index. Samples may be given as names or as SampleHandles (see
+    cafex.samples.get_sample_handles) for faster, index-based access. The
+    returned function also accepts an optional FormatCache for the record as
+    a fourth argument so that FORMAT values already decoded for other
+    filters are reused.
+
+    If all_alleles is True, the returned function instead calculates the
+    VAFs of every ALT allele for a sample in one call, returning a list
+    with one value per ALT. Its arguments are the record, sample, an
+    optional FormatCache and an optional bitwise mask of the ALT alleles
+    whose VAFs are required (bit 0 for the first ALT). VAFs of alleles not
+    in the mask may be returned as 0.0 where this avoids decoding values.
 
     Will use AD field if found but non-standard fields from Strelka, Platypus
     and Freebayes are also supported. Returns a ValueError if no valid function
     can be found.
 
     Args:
-        vcf: pysam.VariantFile object
+        vcf: pysam.VariantFile or pysam.VariantHeader object
 
     Example:
             vcf = pysam.VariantFile('input.bcf')
@@ -90,27 +261,32 @@ def get_vaf_method(vcf):
                     alt_vaf = vaf_calc(record, 'Sample1', i)
                     # do something with alt allele VAF...
 
+            vafs_calc = get_vaf_method(vcf, all_alleles=True)
+            for record in vcf:
+                alt_vafs = vafs_calc(record, 'Sample1')
+
     '''
+    formats = getattr(vcf, 'header', vcf).formats
     func = None
-    if 'AD' in vcf.header.formats:
-        if vcf.header.formats['AD'].number == 1:  # SvABA
+    if 'AD' in formats:
+        if formats['AD'].number == 1:  # SvABA
             func = _get_svaba_vaf
         else:
             func = _get_ad_vaf
-    elif 'AU' in vcf.header.formats or 'TAR' in vcf.header.formats:  # Strelka
+    elif 'AU' in formats or 'TAR' in formats:  # Strelka
         # usually Strelka SNVs and Indels will be in separate VCFs
-        if 'AU' in vcf.header.formats and 'TAR' in vcf.header.formats:
+        if 'AU' in formats and 'TAR' in formats:
             # presumably combined VCF
             func = _get_strelka_vaf
-        elif 'AU' in vcf.header.formats:
+        elif 'AU' in formats:
             func = _get_strelka_snv_vaf
         else:
             func = _get_strelka_indel_vaf
-    elif 'NV' in vcf.header.formats and 'NR' in vcf.header.formats:
+    elif 'NV' in formats and 'NR' in formats:
         func = _get_platypus_vaf
-    elif 'AO' in vcf.header.formats and 'RO' in vcf.header.formats:
+    elif 'AO' in formats and 'RO' in formats:
         func = _get_freebayes_vaf
     if func is not None:
-        return func
+        return ALL_ALLELE_METHODS[func] if all_alleles else func
     raise ValueError("Could not identify any supported allele depth fields " +
                      "in input VCF header.")
@@ -0,0 +1,217 @@
+'''
+Read tabix (.tbi) and CSI (.csi) indexes of bgzip compressed VCF/BCF files
+and index newly written output.
+
+pysam uses these indexes for random access but does not expose the binning
+information they contain. The VcfIndex class parses an index directly so that
+the number of records per contig and an estimate of how densely variants are
+packed along each contig can be used to split work into balanced chunks.
+'''
+
+import gzip
+import os
+import pysam
+import struct
+
+TBI_MIN_SHIFT = 14
+TBI_DEPTH = 5
+
+
+def _pseudo_bin(depth):
+    ''' Bin number used by htslib for storing per-contig metadata. '''
+    return ((1 << (3 * depth + 3)) - 1) // 7 + 1
+
+
+def bin_start(bin_number, min_shift, depth):
+    ''' Return the 0-based start coordinate of a bin. '''
+    level = 0
+    offset = 0
+    while level < depth:
+        next_offset = offset + (1 << (3 * level))
+        if bin_number < next_offset:
+            break
+        offset = next_offset
+        level += 1
+    return (bin_number - offset) << (min_shift + 3 * (depth - level))
+
+
+def approx_file_offset(voffset):
+    '''
+    Convert a BGZF virtual offset to an approximate position in the
+    compressed file. Offsets within a block are scaled assuming roughly 4x
+    compression so that chunks starting in the same block still differ.
+    '''
+    return (voffset >> 16) + ((voffset & 0xFFFF) >> 2)
+
+
+def open_unindexed(path, **kwargs):
+    '''
+    Open the VCF/BCF at path for reading without htslib reporting an error
+    if it has no index, as expected for temporary or newly written files
+    that are read sequentially. kwargs are passed to pysam.VariantFile.
+    '''
+    verbosity = pysam.set_verbosity(0)
+    try:
+        return pysam.VariantFile(path, **kwargs)
+    finally:
+        pysam.set_verbosity(verbosity)
+
+
+def needs_csi(header, bcf=False):
+    '''
+    Return True if a file with header must be indexed with CSI rather than
+    tabix, either because it is BCF or because it has contigs too long for
+    tabix.
+    '''
+    if bcf:
+        return True
+    max_len = 1 << (TBI_MIN_SHIFT + 3 * TBI_DEPTH)
+    return any((x.length or 0) > max_len for x in header.contigs.values())
+
+
+def index_vcf(path):
+    '''
+    Index a bgzip compressed VCF/BCF using htslib, writing a CSI index for
+    BCF (or VCF with contigs too long for tabix) and a tabix index
+    otherwise. Returns the path of the index.
+    '''
+    with open_unindexed(path) as vcf:
+        if vcf.compression != 'BGZF':
+            raise ValueError("Can not index {} - ".format(path) +
+                             "file is not bgzip compressed.")
+        csi = needs_csi(vcf.header, vcf.format == 'BCF')
+    pysam.tabix_index(path, preset='vcf', csi=csi, force=True,
+                      keep_original=True)
+    return path + ('.csi' if csi else '.tbi')
+
+
+def find_index(vcf_path):
+    ''' Return path to .csi or .tbi index for vcf_path or None. '''
+    for ext in ('.csi', '.tbi'):
+        if os.path.exists(vcf_path + ext):
+            return vcf_path + ext
+    return None
+
+
+class _Reader(object):
+    ''' Minimal helper for unpacking little-endian binary index data. '''
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def unpack(self, fmt):
+        vals = struct.unpack_from('<' + fmt, self.data, self.pos)
+        self.pos += struct.calcsize('<' + fmt)
+        return vals
+
+    def read(self, n):
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+
+class VcfIndex(object):
+    ''' Binning information read from a tabix or CSI index. '''
+
+    def __init__(self, path, contigs=None):
+        '''
+        Args:
+            path:   path to a .tbi or .csi index.
+
+            contigs:
+                    contig names in header order. Required for CSI indexes
+                    of BCF files, which do not store contig names.
+        '''
+        self.path = path
+        self.contigs = []
+        self.n_mapped = dict()
+        self.min_shift = TBI_MIN_SHIFT
+        self.depth = TBI_DEPTH
+        self._bins = dict()
+        with gzip.open(path, 'rb') as fh:
+            self._parse(_Reader(fh.read()), contigs)
+
+    def _parse(self, reader, contigs):
+        magic = reader.read(4)
+        names = None
+        if magic == b'TBI\x01':
+            n_ref = reader.unpack('i')[0]
+            reader.unpack('6i')  # format, col_seq, col_beg, col_end etc.
+            l_nm = reader.unpack('i')[0]
+            names = reader.read(l_nm).decode().split('\0')[:n_ref]
+            is_csi = False
+        elif magic == b'CSI\x01':
+            self.min_shift, self.depth, l_aux = reader.unpack('3i')
+            aux = reader.read(l_aux)
+            if l_aux >= 28:
+                l_nm = struct.unpack_from('<i', aux, 24)[0]
+                names = aux[28:28 + l_nm].decode().split('\0')
+            n_ref = reader.unpack('i')[0]
+            is_csi = True
+        else:
+            raise ValueError("Unrecognised index format for '{}'"
+                             .format(self.path))
+        if names is None:
+            if contigs is None:
+                raise ValueError("Contig names are required for reading " +
+                                 "index '{}'".format(self.path))
+            names = list(contigs)
+        pseudo = _pseudo_bin(self.depth)
+        for i in range(n_ref):
+            contig = names[i]
+            bins = []
+            n_bin = reader.unpack('i')[0]
+            for _ in range(n_bin):
+                if is_csi:
+                    bin_number, _loff, n_chunk = reader.unpack('IQi')
+                else:
+                    bin_number, n_chunk = reader.unpack('Ii')
+                chunks = reader.unpack('{}Q'.format(2 * n_chunk))
+                if bin_number == pseudo:
+                    self.n_mapped[contig] = chunks[2]
+                    continue
+                weight = 0
+                for j in range(0, len(chunks), 2):
+                    weight += max(approx_file_offset(chunks[j + 1]) -
+                                  approx_file_offset(chunks[j]), 1)
+                bins.append((bin_start(bin_number, self.min_shift,
+                                       self.depth), weight))
+            if not is_csi:
+                n_intv = reader.unpack('i')[0]
+                reader.pos += 8 * n_intv
+            if bins:
+                bins.sort()
+                self.contigs.append(contig)
+                self._bins[contig] = bins
+                self.n_mapped.setdefault(contig, 0)
+
+    def density(self, contig):
+        '''
+        Return list of (position, estimated_records) tuples for contig, sorted
+        by position. Estimates are derived from the compressed size of the
+        data in each index bin, scaled so that they sum to the number of
+        records on the contig.
+        '''
+        bins = self._bins.get(contig)
+        if not bins:
+            return []
+        total = sum(w for _, w in bins)
+        n = self.n_mapped.get(contig) or total
+        return [(pos, w * n / total) for pos, w in bins]
+
+    @property
+    def window_size(self):
+        ''' Size of the smallest bins in this index. '''
+        return 1 << self.min_shift
+
+
+def read_index(vcf_path, contigs=None):
+    '''
+    Return a VcfIndex for the tabix/CSI index of vcf_path or None if no index
+    file can be found.
+    '''
+    idx = find_index(vcf_path)
+    if idx is None:
+        return None
+    return VcfIndex(idx, contigs)
@@ -23,6 +23,7 @@ setup(
     download_url='https://github.com/david-a-parry/cafex/archive/{}.tar.gz'.format(verstr),
     license='MIT',
     install_requires=['pysam>=0.14'],
+    extras_require={'batch': ['numpy'], 'table': ['pyarrow']},
     scripts=["bin/cafex"],
     include_package_data=True,
     classifiers=[
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+'''
+Benchmark CAFEx on synthetic VCFs of varying numbers of records, samples and
+ALT alleles per record and with expressions of varying complexity.
+
+Synthetic AD style VCFs are generated and converted to Freebayes, Platypus,
+Strelka and SvABA style VCFs using the functions in convert_ad_vcf.py. The
+speed (records/second) and peak RSS of case_control_filter.main and
+FormatFilter.filter are measured for the AD style VCFs and of the VAF
+function returned by get_vaf_method for each style of VCF. Each benchmark
+runs in a separate process so that peak RSS is not affected by other
+benchmarks.
+
+Results are printed and optionally written to a JSON file, which can be
+given to the --compare option of a later run (e.g. for a different version
+of CAFEx) to show the change in speed for each benchmark.
+
+This file is not collected by the test suite. Run with the version of CAFEx
+to benchmark installed or on your PYTHONPATH, for example:
+
+    PYTHONPATH=. python3 test/benchmark.py -s 6 100 -a 1 3 -o results.json
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import pysam
+from convert_ad_vcf import conversions
+from cafex import __version__
+from cafex.case_control_filter import main
+from cafex.genotype_filter import FormatFilter
+from cafex.vaf import get_vaf_method
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+CONTIG_LENGTH = 250_000_000
+FORMATS = ['ad'] + sorted(conversions)
+# FORMAT fields required by conversions, as in convert_ad_vcf.get_outputs
+conversion_fields = {'nv': ('NR', 'NV'),
+                     'fb': ('RO', 'AO'),
+                     'strelka': ('AU', 'CU', 'GU', 'TU', 'TAR', 'TIR'),
+                     'svaba': ()}
+case_expressions = {
+    'simple': ["GQ > 20"],
+    'medium': ["DP >= 10 and GQ >= 30 and AD > 3"],
+    'complex': ["DP >= 10 and GQ >= 30 and AD > 3",
+                "sum(AD) >= 15 or max(AD) > 10 2",
+                "AD[0] < 60 all",
+                "GT != 0/0"]}
+control_expressions = {
+    'simple': ["GQ > 10"],
+    'medium': ["DP >= 10 and GQ >= 20 all"],
+    'complex': ["DP >= 10 and GQ >= 20 all",
+                "AD < 2 all",
+                "AD[0] >= 8 or sum(AD) > 30 all"]}
+
+
+def header_lines(fmt):
+    '''
+    Return header lines from the test data header for fmt, excluding contig
+    and #CHROM lines.
+    '''
+    if fmt == 'ad':
+        path = os.path.join(dir_path, 'test_data', 'ad_test.header.vcf')
+    else:
+        path = conversions[fmt]['vcf'].replace('.vcf', '.header.vcf')
+    with open(path, 'rt') as fh:
+        return [x for x in fh if not x.startswith(('##contig', '#CHROM'))]
+
+
+def write_header(fh, lines, samples):
+    fh.write(lines[0])
+    fh.write('##contig=<ID=1,length={}>\n'.format(CONTIG_LENGTH))
+    fh.write(''.join(lines[1:]))
+    fh.write('\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL',
+                        'FILTER', 'INFO', 'FORMAT'] + samples) + '\n')
+
+
+def random_alleles(n_alts, rng):
+    ref = rng.choice('ACGT')
+    if n_alts <= 3 and rng.random() < 0.8:
+        return [ref] + rng.sample([x for x in 'ACGT' if x != ref], n_alts)
+    alts = set()
+    while len(alts) < n_alts:
+        alts.add(ref + ''.join(rng.choice('ACGT') for _ in
+                               range(rng.randint(1, 10))))
+    return [ref] + sorted(alts)
+
+
+def random_call(n_alleles, allele_freq, rng):
+    gt = [0, 0]
+    for i in range(2):
+        if rng.random() < allele_freq:
+            gt[i] = rng.randint(1, n_alleles - 1)
+    gt.sort()
+    depth = rng.randint(5, 60)
+    ad = [0] * n_alleles
+    for allele in gt:
+        ad[allele] += depth // 2
+    for _ in range(rng.randint(0, 3)):  # sequencing errors
+        ad[rng.randint(0, n_alleles - 1)] += 1
+    return '{}/{}:{}:{}:{}'.format(gt[0], gt[1], ','.join(map(str, ad)),
+                                   sum(ad), rng.randint(0, 99))
+
+
+def make_ad_vcf(path, n_records, samples, n_alts, seed=1):
+    '''
+    Write an AD style VCF of n_records records with n_alts ALT alleles
+    each and random genotypes for samples. Most variants are rare so that
+    a realistic proportion pass genotype filters.
+    '''
+    rng = random.Random(seed)
+    lines = header_lines('ad')
+    for fmt, fields in conversion_fields.items():
+        header = header_lines(fmt)
+        lines.extend(x for x in header if any('ID={},'.format(f) in x for f
+                                              in fields))
+    with open(path, 'wt') as fh:
+        write_header(fh, lines, samples)
+        for i in range(n_records):
+            alleles = random_alleles(n_alts, rng)
+            allele_freq = rng.random() ** 3 * 0.5
+            calls = [random_call(len(alleles), allele_freq, rng) for _ in
+                     samples]
+            fh.write('\t'.join(['1', str((i + 1) * 10), '.', alleles[0],
+                                ','.join(alleles[1:]), '.', 'PASS', '.',
+                                'GT:AD:DP:GQ'] + calls) + '\n')
+
+
+def convert_vcf(ad_vcf, fmt, path):
+    ''' Convert AD style VCF to fmt style using convert_ad_vcf methods. '''
+    with pysam.VariantFile(ad_vcf) as variants, open(path, 'wt') as out:
+        write_header(out, header_lines(fmt), list(variants.header.samples))
+        for record in variants:
+            converted = conversions[fmt]['method'](record)
+            if not isinstance(converted, list):
+                converted = [converted]
+            for conv in converted:
+                out.write(str(conv))
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # bytes rather than KB
+        return rss / 1024 ** 2
+    return rss / 1024
+
+
+def get_samples(vcf, n_filter=None):
+    ''' Return case and control samples to use for vcf. '''
+    with pysam.VariantFile(vcf) as variants:
+        samples = list(variants.header.samples)
+    if n_filter:
+        samples = samples[:n_filter]
+    n_case = max(1, len(samples) // 2)
+    return samples[:n_case], samples[n_case:]
+
+
+def bench_main(vcf, complexity, case, control, repeats, tmp_dir):
+    out = os.path.join(tmp_dir, 'main_{}.vcf'.format(os.getpid()))
+    best = None
+    for _ in range(repeats):
+        t = time.perf_counter()
+        main(vcf, case=case, control=control, output=out,
+             case_expressions=case_expressions[complexity],
+             control_expressions=control_expressions[complexity],
+             min_case_vaf=0.1, max_control_vaf=0.05, quiet=True)
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    os.remove(out)
+    return best
+
+
+def bench_format_filter(vcf, complexity, case, control, repeats, tmp_dir):
+    best = None
+    with pysam.VariantFile(vcf) as variants:
+        format_filter = FormatFilter(variants, case_expressions[complexity])
+    samples = case + control
+    for _ in range(repeats):
+        with pysam.VariantFile(vcf) as variants:
+            records = list(variants)
+        t = time.perf_counter()
+        for record in records:
+            format_filter.filter(record, samples)
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_vaf(vcf, complexity, case, control, repeats, tmp_dir):
+    best = None
+    samples = case + control
+    with pysam.VariantFile(vcf) as variants:
+        vaf_func = get_vaf_method(variants)
+    for _ in range(repeats):
+        with pysam.VariantFile(vcf) as variants:
+            records = list(variants)
+        t = time.perf_counter()
+        for record in records:
+            for i in range(1, len(record.alleles)):
+                for sample in samples:
+                    vaf_func(record, sample, i)
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best, vaf_func.__name__
+
+
+benchmarks = {'main': bench_main,
+              'FormatFilter.filter': bench_format_filter,
+              'vaf': bench_vaf}
+
+
+def _run(args):
+    ''' Run a benchmark in a worker process. '''
+    name, vcf, complexity, case, control, repeats, tmp_dir = args
+    with pysam.VariantFile(vcf) as variants:
+        # SvABA style VCFs have one record per ALT allele
+        n_records = sum(1 for _ in variants)
+    result = benchmarks[name](vcf, complexity, case, control, repeats,
+                              tmp_dir)
+    function = name
+    if isinstance(result, tuple):
+        result, function = result
+    return dict(function=function,
+                seconds=result,
+                records_per_sec=n_records / result,
+                peak_rss_mb=peak_rss_mb())
+
+
+def run_benchmark(name, vcf, complexity, case, control, repeats, tmp_dir):
+    ''' Run a benchmark in a new process and return its results. '''
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1) as pool:
+        return pool.apply(_run, ((name, vcf, complexity, case, control,
+                                  repeats, tmp_dir),))
+
+
+def result_key(result):
+    return tuple(result[x] for x in ('benchmark', 'function', 'format',
+                                     'records', 'samples', 'filter_samples',
+                                     'alts', 'complexity'))
+
+
+def print_results(results, previous=None):
+    old = dict()
+    if previous:
+        old = dict((result_key(x), x) for x in previous['results'])
+    cols = ['benchmark', 'function', 'format', 'records', 'samples',
+            'filter_samples', 'alts', 'complexity', 'records_per_sec',
+            'peak_rss_mb']
+    if old:
+        cols += ['previous_records_per_sec', 'speedup']
+    print('\t'.join(cols))
+    for result in results:
+        row = ['.' if result[x] is None else str(result[x]) for x in
+               cols[:8]]
+        row.append('{:.1f}'.format(result['records_per_sec']))
+        row.append('{:.1f}'.format(result['peak_rss_mb']))
+        if old:
+            prev = old.get(result_key(result))
+            if prev is None:
+                row.extend(['.', '.'])
+            else:
+                row.append('{:.1f}'.format(prev['records_per_sec']))
+                row.append('{:.2f}'.format(result['records_per_sec'] /
+                                           prev['records_per_sec']))
+        print('\t'.join(row))
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Benchmark CAFEx using synthetic VCFs.')
+    parser.add_argument('-r', '--records', type=int, nargs='+',
+                        default=[5000], help='''Number(s) of records per
+                        VCF. Default=5000.''')
+    parser.add_argument('-s', '--samples', type=int, nargs='+',
+                        default=[6, 60], help='''Number(s) of samples per
+                        VCF. Default=6 60.''')
+    parser.add_argument('-a', '--alts', type=int, nargs='+',
+                        default=[1, 2], help='''Number(s) of ALT alleles per
+                        record. Default=1 2.''')
+    parser.add_argument('-c', '--complexity', nargs='+',
+                        default=list(case_expressions),
+                        choices=list(case_expressions), help='''Expression
+                        complexities to test for main and FormatFilter
+                        benchmarks. Default=all.''')
+    parser.add_argument('-f', '--formats', nargs='+', default=FORMATS,
+                        choices=FORMATS, help='''VCF styles to benchmark VAF
+                        calculations for. main and FormatFilter benchmarks
+                        are only run for 'ad'. Default=all.''')
+    parser.add_argument('-b', '--benchmarks', nargs='+',
+                        default=list(benchmarks), choices=list(benchmarks),
+                        help='Benchmarks to run. Default=all.')
+    parser.add_argument('--filter_samples', type=int, metavar='N',
+                        help='''Only use the first N samples of each VCF as
+                        cases and controls. By default all samples are used.
+                        Half (at least one) are cases, the rest controls.''')
+    parser.add_argument('--repeats', type=int, default=3, help='''Report the
+                        fastest of this many repeats. Default=3.''')
+    parser.add_argument('-o', '--output', help='''Write results to this JSON
+                        file.''')
+    parser.add_argument('--compare', metavar='JSON', help='''Show speed
+                        relative to results in this JSON file from a
+                        previous run.''')
+    parser.add_argument('--keep_vcfs', metavar='DIR', help='''Write
+                        synthetic VCFs to this directory and keep them.
+                        Existing VCFs are reused.''')
+    parser.add_argument('--seed', type=int, default=1, help='''Random seed
+                        for generating VCFs. Default=1.''')
+    return parser.parse_args()
+
+
+def run(records, samples, alts, complexity, formats, benchmarks,
+        filter_samples=None, repeats=3, output=None, compare=None,
+        keep_vcfs=None, seed=1):
+    previous = None
+    if compare:
+        with open(compare, 'rt') as fh:
+            previous = json.load(fh)
+    tmp_dir = tempfile.mkdtemp(prefix='cafex_benchmark_')
+    vcf_dir = keep_vcfs or tmp_dir
+    os.makedirs(vcf_dir, exist_ok=True)
+    results = []
+    try:
+        for n_records in records:
+            for n_samples in samples:
+                for n_alts in alts:
+                    stem = os.path.join(vcf_dir, 'r{}_s{}_a{}_seed{}'.format(
+                        n_records, n_samples, n_alts, seed))
+                    ad_vcf = stem + '.ad.vcf'
+                    if not os.path.exists(ad_vcf):
+                        make_ad_vcf(ad_vcf, n_records,
+                                    ['Sample{}'.format(i + 1) for i in
+                                     range(n_samples)], n_alts, seed)
+                    case, control = get_samples(ad_vcf, filter_samples)
+                    tasks = []
+                    for name in ('main', 'FormatFilter.filter'):
+                        if name in benchmarks and 'ad' in formats:
+                            tasks.extend((name, 'ad', x) for x in
+                                         complexity)
+                    if 'vaf' in benchmarks:
+                        tasks.extend(('vaf', x, None) for x in formats)
+                    for name, fmt, cmplx in tasks:
+                        vcf = ad_vcf
+                        if fmt != 'ad':
+                            vcf = '{}.{}.vcf'.format(stem, fmt)
+                            if not os.path.exists(vcf):
+                                convert_vcf(ad_vcf, fmt, vcf)
+                        result = dict(benchmark=name, format=fmt,
+                                      records=n_records, samples=n_samples,
+                                      filter_samples=len(case + control),
+                                      alts=n_alts, complexity=cmplx)
+                        result.update(run_benchmark(name, vcf, cmplx, case,
+                                                    control, repeats,
+                                                    tmp_dir))
+                        results.append(result)
+                        sys.stderr.write("Finished {} ({}) for {}\n".format(
+                            name, cmplx or fmt, os.path.basename(stem)))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    print_results(results, previous)
+    if output:
+        with open(output, 'wt') as fh:
+            json.dump(dict(cafex_version=__version__,
+                           pysam_version=pysam.__version__,
+                           python_version=platform.python_version(),
+                           platform=platform.platform(),
+                           date=time.strftime("%Y-%m-%d %H:%M"),
+                           repeats=repeats,
+                           results=results), fh, indent=2)
+
+
+if __name__ == '__main__':
+    args = get_options()
+    run(**vars(args))
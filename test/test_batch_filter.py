@@ -0,0 +1,75 @@
+import os
+import pysam
+from nose.tools import *
+from .utils import get_variants
+from cafex.batch_filter import BatchFormatFilter
+from cafex.format_cache import FormatCache
+from cafex.genotype_filter import FormatFilter
+from cafex.samples import get_sample_handles
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
+nv_vcf = os.path.join(dir_path, 'test_data', 'nv_test.vcf')
+fb_vcf = os.path.join(dir_path, 'test_data', 'fb_test.vcf')
+svaba_vcf = os.path.join(dir_path, 'test_data', 'svaba_test.vcf')
+strelka_vcf = os.path.join(dir_path, 'test_data', 'strelka_test.vcf')
+
+sample_sets = [['Case1'], ['Case1', 'Case2', 'Case3'],
+               ['Control1', 'Control2', 'Control3', 'Case2'], []]
+
+
+def check_same_as_scalar(expressions, vcf):
+    records = get_variants(vcf)
+    with pysam.VariantFile(vcf) as variants:
+        format_filter = FormatFilter(variants, expressions)
+        handles = dict((x, get_sample_handles(variants, x)) for x in
+                       map(tuple, sample_sets))
+    batch_filter = BatchFormatFilter(format_filter)
+    for samples in sample_sets:
+        expected = [format_filter.filter(x, samples) for x in records]
+        assert_equal(batch_filter.filter(records, samples), expected)
+        caches = [FormatCache(x) for x in records]
+        assert_equal(batch_filter.filter(records, handles[tuple(samples)],
+                                         caches), expected)
+        for i in range(len(records)):  # blocks of one record
+            assert_equal(batch_filter.filter(records[i:i+1], samples),
+                         expected[i:i+1])
+
+
+def test_ad_expressions():
+    for expressions in (["GQ > 20"], ["AD > 5"], ["AD > 5 2"],
+                        ["AD > 5 all"], ["DP >= 20 and GQ >= 30 and AD > 3"],
+                        ["GQ < 30 or AD > 10", "DP < 30 all"],
+                        ["sum(AD) >= 30"], ["max(AD) > 20 2"],
+                        ["min(AD) < 1"], ["AD[0] > 20"], ["AD[1] == 0 all"],
+                        ["GT != 0/0"]):
+        check_same_as_scalar(expressions, ad_vcf)
+
+
+def test_ao_expressions():
+    for expressions in (["AO > 5"], ["AO >= 10 2", "RO < 30"],
+                        ["sum(AO) > 15 or GQ > 90"]):
+        check_same_as_scalar(expressions, fb_vcf)
+
+
+def test_nv_expressions():
+    for expressions in (["NV > 5"], ["NV > 5 all"], ["sum(NR) > 40"],
+                        ["NV[0] > 10 and NR[0] >= 20"]):
+        check_same_as_scalar(expressions, nv_vcf)
+
+
+def test_svaba_expressions():
+    for expressions in (["AD > 5"], ["AD > 5 and DP < 40 2"]):
+        check_same_as_scalar(expressions, svaba_vcf)
+
+
+def test_missing_fields():
+    ''' Fields not present in every record are treated as not matching '''
+    for expressions in (["AU[1] > 5"], ["sum(TIR) > 5 or DP < 10"],
+                        ["max(TU) < 3 all", "TAR[0] != 2"]):
+        check_same_as_scalar(expressions, strelka_vcf)
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
@@ -1,6 +1,6 @@
 from nose.tools import *
-from cafex.bit_utils import first_n_bits_set, flag_consensus
-from cafex.bit_utils import flip_bits, highest_set_bit
+from cafex.bit_utils import allele_bits, count_set_bits, first_n_bits_set
+from cafex.bit_utils import flag_consensus, flip_bits, highest_set_bit
 from cafex.bit_utils import set_bits_in_range, set_first_bits
 
 
@@ -12,12 +12,30 @@ def test_first_n_bits_set():
     assert_false(first_n_bits_set(0b1011, 4))
 
 
+def test_count_set_bits():
+    assert_equal(count_set_bits(0), 0)
+    assert_equal(count_set_bits(0b1), 1)
+    assert_equal(count_set_bits(0b1011), 3)
+    assert_equal(count_set_bits((1 << 100) - 1), 100)
+
+
 def test_flag_consensus():
     assert_equal(flag_consensus([0b0, 0b11, 0b111]), 0)
     assert_equal(flag_consensus([0b1, 0b11, 0b111]), 1)
     assert_equal(flag_consensus([0b101, 0b1110, 0b111]), 0b100)
 
 
+def test_allele_bits():
+    assert_equal(allele_bits((0, 0)), 0)
+    assert_equal(allele_bits((0, 1)), 0b1)
+    assert_equal(allele_bits((1, 1)), 0b1)
+    assert_equal(allele_bits((2, 3)), 0b110)
+    assert_equal(allele_bits((0, 2, 4)), 0b1010)
+    assert_equal(allele_bits((None, None)), 0)
+    assert_equal(allele_bits((None,)), 0)
+    assert_equal(allele_bits(()), 0)
+
+
 def test_flip_bits():
     assert_equal(flip_bits(0, 4), 0b1111)
     assert_equal(flip_bits(0b1010, 4), 0b101)
@@ -0,0 +1,119 @@
+import os
+import pysam
+import shutil
+import tempfile
+from nose.tools import *
+from .utils import get_variants
+from .test_vaf import write_short_values_vcf
+from cafex import CaseControlFilter
+from cafex.case_control_filter import genotype_flag
+from cafex.format_cache import FormatCache
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
+fb_vcf = os.path.join(dir_path, 'test_data', 'fb_test.vcf')
+nv_vcf = os.path.join(dir_path, 'test_data', 'nv_test.vcf')
+site_vcf = os.path.join(dir_path, 'test_data', 'site_test.vcf')
+
+
+def test_filter():
+    ''' Yield passing records and flags from an open VariantFile '''
+    with pysam.VariantFile(ad_vcf) as vcf:
+        ccf = CaseControlFilter(vcf.header,
+                                case=['Case1', 'Case2', 'Case3'],
+                                control=['Control1', 'Control2', 'Control3'])
+        results = list(ccf.filter(vcf))
+    assert_equal([x.pos for x, _ in results], [2, 3, 5, 6, 8, 9, 10])
+    assert_equal([x for _, x in results], [1, 1, 1, 3, 1, 1, 1])
+
+
+def test_evaluate():
+    ''' evaluate and filter methods give the same flags '''
+    records = get_variants(ad_vcf)
+    kwargs = dict(case=['Case1', 'Case2'],
+                  control=['Control1'],
+                  case_expressions=["AD > 5"],
+                  control_expressions=["DP >= 20"],
+                  vaf_ratio=2.0)
+    with pysam.VariantFile(ad_vcf) as vcf:
+        for batch_size in (None, 3):
+            ccf = CaseControlFilter(vcf, batch_size=batch_size, **kwargs)
+            flags = [ccf.evaluate(x) for x in records]
+            assert_equal([ccf.evaluate(x, FormatCache(x)) for x in records],
+                         flags)
+            assert_equal([(x.pos, f) for x, f in ccf.filter(records)],
+                         [(x.pos, f) for x, f in zip(records, flags) if f])
+            assert_true(any(flags))
+            assert_false(all(flags))
+
+
+def test_short_values_vaf_flag():
+    ''' VAF filters for multiallelics with short or zero-depth values '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for path in (ad_vcf, fb_vcf, nv_vcf):
+            tmp_vcf = write_short_values_vcf(path, tmp_dir)
+            records = get_variants(tmp_vcf)
+            with pysam.VariantFile(tmp_vcf) as vcf:
+                ccf = CaseControlFilter(vcf, case=['Case1'],
+                                        control=['Control1', 'Control2'],
+                                        min_case_vaf=0.1,
+                                        max_control_vaf=0.05,
+                                        vaf_ratio=2.0)
+                assert_equal([ccf.evaluate(x) for x in records], [2])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_site_filters():
+    ''' Site filters applied by evaluate and filter methods '''
+    records = get_variants(site_vcf)
+    with pysam.VariantFile(site_vcf) as vcf:
+        for batch_size in (None, 3):
+            ccf = CaseControlFilter(vcf,
+                                    case=['Case1', 'Case2', 'Case3'],
+                                    control=['Control1', 'Control2',
+                                             'Control3'],
+                                    info_expressions=["AC > 0"],
+                                    pass_only=True,
+                                    batch_size=batch_size)
+            assert_equal([ccf.evaluate(x) for x in records],
+                         [0, 1, 1, 0, 1, 1, 0, 0, 0, 1])
+            assert_equal([(x.pos, f) for x, f in ccf.filter(records)],
+                         [(2, 1), (3, 1), (5, 1), (6, 1), (10, 1)])
+
+
+def test_genotype_flag():
+    ''' ALT alleles carried by a case and no controls '''
+    gts = {('case1', 'GT'): (0, 1),
+           ('case2', 'GT'): (2, 3),
+           ('case3', 'GT'): (None, None),
+           ('control1', 'GT'): (0, 0),
+           ('control2', 'GT'): (0, 3),
+           ('control3', 'GT'): (None, 2)}
+    assert_equal(genotype_flag(gts, 3, ['case1'], []), 0b001)
+    assert_equal(genotype_flag(gts, 3, ['case1', 'case2'], []), 0b111)
+    assert_equal(genotype_flag(gts, 3, ['case1', 'case2'], ['control1']),
+                 0b111)
+    assert_equal(genotype_flag(gts, 3, ['case1', 'case2'], ['control2']),
+                 0b011)
+    assert_equal(genotype_flag(gts, 3, ['case1', 'case2'],
+                               ['control2', 'control3']), 0b001)
+    assert_equal(genotype_flag(gts, 3, ['case3'], ['control1']), 0)
+    assert_equal(genotype_flag(gts, 3, [], ['control2', 'control3']), 0b001)
+    assert_equal(genotype_flag(gts, 4, ['case2'], []), 0b0110)
+    # only ALT alleles in flag considered
+    assert_equal(genotype_flag(gts, 3, ['case1', 'case2'], [], 0b110), 0b110)
+    assert_equal(genotype_flag(gts, 3, ['case1'], [], 0b110), 0)
+
+
+def test_invalid_samples():
+    with pysam.VariantFile(ad_vcf) as vcf:
+        assert_raises(ValueError, CaseControlFilter, vcf.header)
+        assert_raises(ValueError, CaseControlFilter, vcf.header,
+                      case=['Case4'])
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
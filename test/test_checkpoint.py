@@ -0,0 +1,123 @@
+import os
+import pysam
+import shutil
+import tempfile
+from collections import namedtuple
+from nose.tools import *
+from .utils import get_variants
+from cafex.checkpoint import Checkpoint, read_checkpoint
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
+
+Record = namedtuple("Record", "chrom start pos")
+
+
+def run_checkpoints(checkpoint, out, records):
+    ''' Write records, returning a list of checkpoints saved. '''
+    saved = []
+    next_check = checkpoint.next_check
+    for i, record in enumerate(records):
+        if i >= next_check:
+            next_check = checkpoint.check(out, record, i, i)
+            state = read_checkpoint(checkpoint.path)
+            if state is not None and state not in saved:
+                saved.append(state)
+    return saved
+
+
+def test_check():
+    ''' Checkpoints saved only between records at different positions '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'checkpoint.json')
+        output = os.path.join(tmp_dir, 'out.vcf')
+        with pysam.VariantFile(ad_vcf) as vcf:
+            header = vcf.header
+        positions = [1, 2, 3, 4, 4, 4, 5, 6, 7, 8, 8, 9]
+        records = [Record('1', x - 1, x) for x in positions]
+        with pysam.VariantFile(output, 'w', header=header) as out:
+            saved = run_checkpoints(Checkpoint(path, output, interval=3), out,
+                                    records)
+        assert_equal([(x['pos'], x['read']) for x in saved],
+                     [(5, 6), (9, 11)])
+        for state in saved:
+            assert_equal(state['contig'], '1')
+            assert_false(state['finished'])
+        # resumed checkpoints are at the same positions
+        state = saved[0]
+        state['read'] = 6
+        with pysam.VariantFile(output, 'w', header=header) as out:
+            checkpoint = Checkpoint(path, output, interval=3, state=state)
+            assert_true(checkpoint.resumed)
+            assert_equal(checkpoint.next_check, 3)
+            resumed = run_checkpoints(checkpoint, out, records[6:])
+        assert_equal([(x['pos'], x['read']) for x in resumed], [(9, 11)])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_fresh_run_removes_checkpoint():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'checkpoint.json')
+        output = os.path.join(tmp_dir, 'out.vcf')
+        with open(path, 'wt') as fh:
+            fh.write('{}')
+        Checkpoint(path, output)
+        assert_is_none(read_checkpoint(path))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_wrong_output():
+    state = dict(output='/path/to/other.vcf', contig='1', pos=1, read=1,
+                 written=1, offset=100, finished=False)
+    assert_raises(ValueError, Checkpoint, 'checkpoint.json', 'out.vcf',
+                  state=state)
+    assert_raises(ValueError, Checkpoint, 'checkpoint.json', 'out.vcf',
+                  interval=0)
+
+
+def test_reopen_output():
+    ''' Output truncated to checkpoint and new records appended '''
+    tmp_dir = tempfile.mkdtemp()
+    records = get_variants(ad_vcf)
+    try:
+        path = os.path.join(tmp_dir, 'checkpoint.json')
+        for ext in ('vcf', 'vcf.gz', 'bcf'):
+            output = os.path.join(tmp_dir, 'out.' + ext)
+            checkpoint = Checkpoint(path, output)
+            with pysam.VariantFile(ad_vcf) as vcf:
+                out = pysam.VariantFile(output, 'w', header=vcf.header)
+            for record in records[:4]:
+                out.write(record)
+            checkpoint.save(out, records[4].chrom, records[4].pos, 4, 4)
+            out.close()
+            checkpoint._commit()  # output now on disk
+            state = read_checkpoint(path)
+            assert_equal(state['pos'], records[4].pos)
+            with open(output, 'ab') as fh:
+                fh.write(b'partially written block')
+            checkpoint = Checkpoint(path, output, state=state)
+            out = checkpoint.reopen_output()
+            for record in records[4:]:
+                out.write(record)
+            out.close()
+            checkpoint.finish(6, 6)
+            assert_equal([str(x) for x in get_variants(output)],
+                         [str(x) for x in records])
+            state = read_checkpoint(path)
+            assert_true(state['finished'])
+            assert_equal((state['read'], state['written']), (10, 10))
+            assert_equal(state['offset'], os.path.getsize(output))
+            assert_equal(sorted(os.listdir(tmp_dir)),
+                         sorted(['checkpoint.json', 'out.' + ext]))
+            os.remove(output)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,117 @@
+import os
+from nose.tools import *
+from .utils import get_variants
+from cafex.format_cache import ColumnarFormatCache, FormatCache
+from cafex.format_cache import get_backend, get_cache
+from cafex.samples import get_sample_handles
+from cafex.vaf import _get_ad_vaf, _get_strelka_vaf
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
+strelka_vcf = os.path.join(dir_path, 'test_data', 'strelka_test.vcf')
+
+
+class CountingCall(object):
+    ''' Wraps a VariantRecordSample, counting FORMAT value retrievals. '''
+
+    def __init__(self, call, counts):
+        self.call = call
+        self.counts = counts
+
+    def __getitem__(self, field):
+        self.counts[field] = self.counts.get(field, 0) + 1
+        return self.call[field]
+
+
+def _counting_cache(record, counts):
+    cache = FormatCache(record)
+    cache._calls = dict((s, CountingCall(record.samples[s], counts)) for s in
+                        record.samples)
+    return cache
+
+
+def test_values():
+    for record in get_variants(ad_vcf):
+        cache = FormatCache(record)
+        for s in record.samples:
+            for f in ('GT', 'AD', 'DP', 'GQ'):
+                assert_equal(cache[s, f], record.samples[s][f])
+        assert_true(cache.has_field('AD'))
+        assert_false(cache.has_field('AO'))
+        assert_raises(KeyError, cache.__getitem__, ('Case1', 'AO'))
+
+
+def test_decode_once():
+    ''' Each sample/field pair is only decoded once per record '''
+    record = get_variants(ad_vcf)[5]
+    counts = dict()
+    cache = _counting_cache(record, counts)
+    for i in range(1, len(record.alleles)):
+        for s in ('Case1', 'Case2'):
+            cache[s, 'GT']
+            _get_ad_vaf(record, s, i, cache)
+    assert_equal(counts, {'GT': 2, 'AD': 2})
+
+
+def test_strelka_cache():
+    ''' Strelka VAFs are the same with and without a shared cache '''
+    for record in get_variants(strelka_vcf):
+        cache = FormatCache(record)
+        for s in record.samples:
+            for i in range(1, len(record.alleles)):
+                assert_equal(_get_strelka_vaf(record, s, i),
+                             _get_strelka_vaf(record, s, i, cache))
+
+
+def test_columnar_values():
+    ''' ColumnarFormatCache returns the same values as FormatCache '''
+    records = get_variants(strelka_vcf)
+    handles = get_sample_handles(records[0], records[0].samples)
+    for record in records:
+        cache = FormatCache(record)
+        columnar = ColumnarFormatCache(record)
+        for field in record.header.formats:
+            if not cache.has_field(field):
+                assert_false(columnar.has_field(field))
+                assert_raises(KeyError, columnar.__getitem__,
+                              (handles[0], field))
+                continue
+            expected = [cache[s, field] for s in record.samples]
+            assert_equal([columnar[s, field] for s in handles], expected)
+            assert_equal([columnar[s, field] for s in record.samples],
+                         expected)
+            assert_equal(columnar.sample_values(field, handles[::-1]),
+                         expected[::-1])
+            assert_equal(cache.sample_values(field, handles[::-1]),
+                         expected[::-1])
+
+
+def test_columnar_format():
+    ''' format() returns a samples x values array '''
+    record = get_variants(ad_vcf)[5]
+    columnar = ColumnarFormatCache(record)
+    ad = columnar.format('AD')
+    assert_equal(ad.shape, (6, 3))
+    assert_equal(ad[3].tolist(), [12, 0, 12])
+    dp = columnar.format('DP')
+    assert_equal(dp.shape, (6, 1))
+    assert_equal(dp[:, 0].tolist(), [30, 30, 40, 24, 24, 30])
+    assert_raises(ValueError, columnar.format, 'GT')
+
+
+def test_get_backend():
+    assert_is(get_backend('pysam'), FormatCache)
+    assert_is(get_backend('columnar'), ColumnarFormatCache)
+    assert_raises(ValueError, get_backend, 'foo')
+
+
+def test_get_cache():
+    record = get_variants(ad_vcf)[0]
+    cache = FormatCache(record)
+    assert_is(get_cache(record, cache), cache)
+    assert_is_instance(get_cache(record), FormatCache)
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
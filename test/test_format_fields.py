@@ -0,0 +1,66 @@
+import os
+import pysam
+from nose.tools import *
+from .utils import get_variants
+from cafex.format_fields import remove_fields, remove_header_fields
+from cafex.format_fields import required_fields, unused_fields
+from cafex.genotype_filter import FormatFilter
+from cafex.vaf import VafMemo, get_vaf_method
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
+fb_vcf = os.path.join(dir_path, 'test_data', 'fb_test.vcf')
+
+
+def test_required_fields():
+    ''' Fields from genotypes, expressions and VAF method '''
+    with pysam.VariantFile(ad_vcf) as vcf:
+        case_filter = FormatFilter(vcf, ["sum(AD) > 5 and GQ > 20"])
+        control_filter = FormatFilter(vcf, ["DP >= 10 all"])
+        vaf_func = get_vaf_method(vcf, all_alleles=True)
+    assert_equal(required_fields(), set(['GT']))
+    assert_equal(required_fields(ignore_genotypes=True), set())
+    assert_equal(required_fields(format_filters=[case_filter, None]),
+                 set(['GT', 'AD', 'GQ']))
+    assert_equal(required_fields(ignore_genotypes=True,
+                                 format_filters=[None, control_filter]),
+                 set(['DP']))
+    assert_equal(required_fields(vaf_calculation=vaf_func),
+                 set(['GT', 'AD']))
+    assert_equal(required_fields(vaf_calculation=VafMemo(vaf_func)),
+                 set(['GT', 'AD']))
+    with pysam.VariantFile(fb_vcf) as vcf:
+        vaf_func = get_vaf_method(vcf)
+    assert_equal(required_fields(ignore_genotypes=True,
+                                 vaf_calculation=vaf_func),
+                 set(['AO', 'RO']))
+
+
+def test_unused_fields():
+    ''' Unused fields in header order, always keeping GT '''
+    with pysam.VariantFile(ad_vcf) as vcf:
+        header = vcf.header
+    assert_equal(unused_fields(header, set(['DP'])), ('AD', 'GQ'))
+    assert_equal(unused_fields(header, set(['GT', 'AD', 'DP', 'GQ'])), ())
+    assert_equal(unused_fields(header, set(), keep=()),
+                 ('AD', 'DP', 'GQ', 'GT'))
+
+
+def test_remove_fields():
+    ''' Removed fields absent from header and records written '''
+    records = get_variants(ad_vcf)
+    with pysam.VariantFile(ad_vcf) as vcf:
+        header = vcf.header.copy()
+    remove_header_fields(header, ('AD', 'GQ'))
+    for record in records:
+        remove_fields(record, ('AD', 'GQ'))
+        remove_fields(record, ('AD',))  # already removed
+        assert_equal(list(record.format), ['GT', 'DP'])
+    assert_equal(str(header).count('##FORMAT'), 2)
+    assert_not_in('ID=AD', str(header))
+    assert_not_in('ID=GQ', str(header))
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
@@ -2,6 +2,7 @@ import os
 import pysam
 from nose.tools import *
 from .utils import get_variants
+from cafex.format_cache import FormatCache
 from cafex.genotype_filter import FormatFilter
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -277,6 +278,54 @@ def test_subscript_ad():
     check_filters(expected, expressions)
 
 
+class RecordingCache(FormatCache):
+    ''' FormatCache recording which fields are retrieved '''
+
+    __slots__ = ('fields',)
+
+    def __init__(self, record):
+        super().__init__(record)
+        self.fields = []
+
+    def __getitem__(self, key):
+        self.fields.append(key[1])
+        return super().__getitem__(key)
+
+
+def test_short_circuit():
+    ''' Later sub-expressions and expressions are not evaluated if they
+        can not change the result '''
+    record = get_variants(ad_vcf)[0]
+    for expressions, expected_fields in (
+            (['DP > 100 and GQ > 0'], ['DP']),
+            (['DP < 100 or GQ > 0'], ['DP']),
+            (['DP < 100 and GQ > 0'], ['DP', 'GQ']),
+            (['DP > 100 or GQ > 0'], ['DP', 'GQ']),
+            (['DP > 100 and GQ > 0 or AD > 1'], ['DP', 'AD']),
+            (['DP > 100', 'GQ > 0'], ['DP']),
+            (['DP < 100', 'GQ > 100'], ['DP', 'GQ'])):
+        format_filter = _get_f_filter(expressions, ad_vcf)
+        cache = RecordingCache(record)
+        format_filter.filter(record, ['Case1'], cache)
+        assert_equal(cache.fields, expected_fields)
+
+
+def test_adaptive():
+    ''' Expressions are reordered without changing results '''
+    records = get_variants(ad_vcf) * 3
+    expressions = ['GQ >= 0', 'AD > 20 or DP > 100', 'DP > 24 all']
+    samples = ['Case1', 'Case2', 'Case3']
+    format_filter = _get_f_filter(expressions, ad_vcf)
+    with pysam.VariantFile(ad_vcf) as variants:
+        adaptive_filter = FormatFilter(variants, expressions, adaptive=True,
+                                       window=5)
+    for rec in records:
+        assert_equal(adaptive_filter.filter(rec, samples),
+                     format_filter.filter(rec, samples))
+    # 'GQ >= 0' never filters anything so should be evaluated last
+    assert_equal(adaptive_filter.order[-1], 0)
+
+
 if __name__ == '__main__':
     import nose
     nose.run(defaultTest=__name__)
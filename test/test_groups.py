@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+from nose.tools import *
+from cafex.groups import Group, info_tag_name, read_groups
+
+ped = '''#FID\tIID\tPID\tMID\tSEX\tPHENO
+fam1\tCase1\tControl1\tControl2\t1\t2
+fam1\tControl1\t0\t0\t1\t1
+fam1\tControl2\t0\t0\t2\t1
+fam2\tCase2\tControl3\t0\t2\t2
+fam2\tControl3\t0\t0\t1\t1
+fam2\tCase3\t0\t0\t1\t0
+fam3\tCase3\t0\t0\t1\t-9
+'''
+
+manifest = '''name\tcase\tcontrol\tcase_expressions\tmin_case_vaf
+trio1\tCase1\tControl1,Control2\tAD > 5;GQ > 20\t0.2
+trio2\tCase2,Case3\tControl3\t\t
+'''
+
+
+def write_tmp(content, suffix):
+    f, fname = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(f, 'wt') as fh:
+        fh.write(content)
+    return fname
+
+
+def check_groups(content, suffix, expected, **kwargs):
+    fname = write_tmp(content, suffix)
+    try:
+        assert_equal(read_groups(fname, **kwargs), expected)
+    finally:
+        os.remove(fname)
+
+
+def test_read_ped():
+    defaults = dict(case_expressions=['DP > 10'], max_control_vaf=0.05)
+    expected = [Group('fam1', ['Case1'], ['Control1', 'Control2'],
+                      ['DP > 10'], [], None, 0.05, None),
+                Group('fam2', ['Case2'], ['Control3'], ['DP > 10'], [],
+                      None, 0.05, None)]
+    check_groups(ped, '.ped', expected, defaults=defaults)
+
+
+def test_read_manifest():
+    defaults = dict(case_expressions=['DP > 10'], min_case_vaf=0.1)
+    expected = [Group('trio1', ['Case1'], ['Control1', 'Control2'],
+                      ['AD > 5', 'GQ > 20'], [], 0.2, None, None),
+                Group('trio2', ['Case2', 'Case3'], ['Control3'],
+                      ['DP > 10'], [], 0.1, None, None)]
+    check_groups(manifest, '.tsv', expected, defaults=defaults)
+
+
+def test_read_json():
+    groups = [dict(name='trio1', case=['Case1'],
+                   control=['Control1', 'Control2'],
+                   control_expressions=['DP > 20 all'], vaf_ratio=10),
+              dict(name=2, case='Case2,Case3')]
+    expected = [Group('trio1', ['Case1'], ['Control1', 'Control2'], [],
+                      ['DP > 20 all'], None, None, 10.0),
+                Group('2', ['Case2', 'Case3'], [], [], [], None, None,
+                      None)]
+    check_groups(json.dumps(groups), '.json', expected)
+    as_dict = dict((str(x.pop('name')), x) for x in groups)
+    check_groups(json.dumps(as_dict), '.json', expected)
+
+
+def test_invalid_groups():
+    for content, suffix in (
+            ('name\tcase\n', '.tsv'),  # no groups
+            ('name\tcase\tfoo\ntrio1\tCase1\tbar\n', '.tsv'),
+            ('name\tcase\ntrio1\t\n', '.tsv'),  # no samples
+            ('name\tcase\ntrio1\tCase1\ntrio1\tCase2\n', '.tsv'),
+            ('name\tcase\tvaf_ratio\ntrio1\tCase1\tten\n', '.tsv'),
+            ('name\tcase\ntrio1\tCase1\tCase2\n', '.tsv'),
+            ('fam1\tCase1\t0\t0\t1\n', '.ped'),
+            ('[{"case": ["Case1"]}]', '.json')):
+        fname = write_tmp(content, suffix)
+        try:
+            assert_raises(ValueError, read_groups, fname)
+        finally:
+            os.remove(fname)
+
+
+def test_info_tag_name():
+    assert_equal(info_tag_name('CAFEx', 'fam1'), 'CAFEx_fam1')
+    assert_equal(info_tag_name('TAG', 'fam 1/a.b'), 'TAG_fam_1_a.b')
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
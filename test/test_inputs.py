@@ -0,0 +1,85 @@
+import os
+import pysam
+import shutil
+import tempfile
+from nose.tools import *
+from cafex.inputs import Input, get_inputs, header_key, input_name
+from cafex.inputs import read_manifest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
+fb_vcf = os.path.join(dir_path, 'test_data', 'fb_test.vcf')
+site_vcf = os.path.join(dir_path, 'test_data', 'site_test.vcf')
+
+
+def write_manifest(tmp_dir, lines):
+    path = os.path.join(tmp_dir, 'manifest.txt')
+    with open(path, 'wt') as fh:
+        fh.write('\n'.join(lines) + '\n')
+    return path
+
+
+def test_read_manifest():
+    ''' Inputs and optional outputs relative to manifest directory '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = write_manifest(tmp_dir, ['# comment', 'a.vcf.gz\tout/a.bcf',
+                                        '', '/data/b.bcf'])
+        assert_equal(read_manifest(path),
+                     [Input(os.path.join(tmp_dir, 'a.vcf.gz'),
+                            os.path.join(tmp_dir, 'out', 'a.bcf')),
+                      Input('/data/b.bcf', None)])
+        path = write_manifest(tmp_dir, ['# nothing'])
+        assert_raises(ValueError, read_manifest, path)
+        path = write_manifest(tmp_dir, ['a.vcf\tb.vcf\tc.vcf'])
+        assert_raises(ValueError, read_manifest, path)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_input_name():
+    assert_equal(input_name('/data/chr1.vcf.gz'), 'chr1')
+    assert_equal(input_name('chr1.bcf'), 'chr1')
+    assert_equal(input_name('sample.chr1.vcf'), 'sample.chr1')
+    assert_equal(input_name('chr1.txt'), 'chr1.txt')
+
+
+def test_get_inputs():
+    ''' Outputs from template and duplicates rejected '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = write_manifest(tmp_dir, ['c.vcf.gz\tc_out.vcf'])
+        assert_equal(get_inputs(['a.vcf', 'b.bcf']),
+                     [Input('a.vcf', None), Input('b.bcf', None)])
+        assert_equal(get_inputs(['a.vcf'], manifest=path,
+                                output_template='out/{name}.bcf'),
+                     [Input('a.vcf', 'out/a.bcf'),
+                      Input(os.path.join(tmp_dir, 'c.vcf.gz'),
+                            os.path.join(tmp_dir, 'c_out.vcf'))])
+        assert_raises(ValueError, get_inputs, ['a.vcf', 'a.vcf'])
+        assert_raises(ValueError, get_inputs, ['a/x.vcf', 'b/x.vcf'],
+                      output_template='{name}.bcf')
+        assert_raises(ValueError, get_inputs, ['a.vcf'],
+                      output_template='out.bcf')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_header_key():
+    ''' Same key for headers with same samples and field definitions '''
+    with pysam.VariantFile(ad_vcf) as vcf:
+        header = vcf.header.copy()
+        ad_key = header_key(vcf.header)
+    with pysam.VariantFile(site_vcf) as vcf:
+        site_key = header_key(vcf.header)
+    with pysam.VariantFile(fb_vcf) as vcf:
+        fb_key = header_key(vcf.header)
+    header.contigs.add('chrX', length=1000)
+    assert_equal(header_key(header), ad_key)
+    assert_not_equal(site_key, ad_key)
+    assert_not_equal(fb_key, ad_key)
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
@@ -1,8 +1,12 @@
+import json
 import os
+import pysam
+import shutil
 import tempfile
 from nose.tools import *
 from cafex.case_control_filter import main
-from .utils import get_variants
+from cafex.checkpoint import Checkpoint
+from .utils import get_variants, make_indexed_vcf
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
@@ -10,6 +14,7 @@ nv_vcf = os.path.join(dir_path, 'test_data', 'nv_test.vcf')
 fb_vcf = os.path.join(dir_path, 'test_data', 'fb_test.vcf')
 svaba_vcf = os.path.join(dir_path, 'test_data', 'svaba_test.vcf')
 strelka_vcf = os.path.join(dir_path, 'test_data', 'strelka_test.vcf')
+site_vcf = os.path.join(dir_path, 'test_data', 'site_test.vcf')
 
 ad_records = get_variants(ad_vcf)
 
@@ -353,6 +358,732 @@ def test_add_info_tag():
         os.remove(out)
 
 
+def test_parallel():
+    ''' Output from multiple processes matches single process output '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    kwargs = dict(case=['Case1', 'Case2', 'Case3'],
+                  case_expressions=["AD > 5"],
+                  control=['Control1', 'Control2', 'Control3'],
+                  control_expressions=["DP >= 20 1"],
+                  vaf_ratio=10.0,
+                  info_tag="TEST_TAG",
+                  quiet=True)
+    try:
+        expected_out = os.path.join(tmp_dir, 'expected.vcf')
+        main(vcf, output=expected_out, **kwargs)
+        expected = [str(x) for x in get_variants(expected_out)]
+        for threads in (2, 3):
+            out = os.path.join(tmp_dir, 'parallel.vcf')
+            main(vcf, output=out, threads=threads, **kwargs)
+            results = [str(x) for x in get_variants(out)]
+            assert_equal(results, expected)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_batch_size():
+    ''' Output using batch evaluation matches record by record output '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    kwargs = dict(case=['Case1', 'Case2', 'Case3'],
+                  case_expressions=["AD > 5", "sum(AD) >= 20 and GQ > 20"],
+                  control=['Control1', 'Control2', 'Control3'],
+                  control_expressions=["DP >= 20 1", "AD < 10 all"],
+                  vaf_ratio=2.0,
+                  info_tag="TEST_TAG",
+                  quiet=True)
+    try:
+        expected_out = os.path.join(tmp_dir, 'expected.vcf')
+        main(vcf, output=expected_out, **kwargs)
+        expected = [str(x) for x in get_variants(expected_out)]
+        out = os.path.join(tmp_dir, 'batch.vcf')
+        for batch_size, threads in ((1, 1), (7, 1), (1000, 1), (7, 2)):
+            main(vcf, output=out, batch_size=batch_size, threads=threads,
+                 **kwargs)
+            results = [str(x) for x in get_variants(out)]
+            assert_equal(results, expected)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_columnar_backend():
+    ''' Output using the columnar backend matches the pysam backend '''
+    kwargs = dict(case=['Case1', 'Case2', 'Case3'],
+                  case_expressions=["AD > 5", "sum(AD) >= 20 and GQ > 20"],
+                  control=['Control1', 'Control2', 'Control3'],
+                  control_expressions=["DP >= 20 1", "AD < 10 all"],
+                  vaf_ratio=2.0,
+                  info_tag="TEST_TAG",
+                  quiet=True)
+    for vcf in (ad_vcf, fb_vcf):
+        if vcf == fb_vcf:
+            kwargs.update(case_expressions=["AO > 5"],
+                          control_expressions=["RO > 5 all"])
+        expected_out = get_tmp_out()
+        out = get_tmp_out()
+        main(vcf, output=expected_out, **kwargs)
+        expected = [str(x) for x in get_variants(expected_out)]
+        for batch_size in (None, 4):
+            main(vcf, output=out, backend='columnar', batch_size=batch_size,
+                 **kwargs)
+            assert_equal([str(x) for x in get_variants(out)], expected)
+        os.remove(expected_out)
+        os.remove(out)
+    assert_raises(ValueError, main, ad_vcf, backend='foo', **kwargs)
+
+
+def test_pipeline():
+    ''' Output using background reading/writing matches default output '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    kwargs = dict(case=['Case1', 'Case2', 'Case3'],
+                  case_expressions=["AD > 5"],
+                  control=['Control1', 'Control2', 'Control3'],
+                  vaf_ratio=2.0,
+                  info_tag="TEST_TAG",
+                  quiet=True)
+    try:
+        expected_out = os.path.join(tmp_dir, 'expected.vcf')
+        main(vcf, output=expected_out, **kwargs)
+        expected = [str(x) for x in get_variants(expected_out)]
+        for suffix in ('.vcf', '.vcf.gz', '.bcf'):
+            out = os.path.join(tmp_dir, 'out' + suffix)
+            for threads in (1, 2):
+                main(vcf, output=out, pipeline=True, io_threads=2,
+                     threads=threads, **kwargs)
+                results = [str(x) for x in get_variants(out)]
+                assert_equal(results, expected)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_subset():
+    ''' Only case and control samples are decoded and written '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    kwargs = dict(case=['Case2', 'Case1'],
+                  case_expressions=["AD > 5"],
+                  control=['Control3'],
+                  control_expressions=["DP >= 20"],
+                  max_control_vaf=0.1,
+                  quiet=True)
+    try:
+        expected_out = os.path.join(tmp_dir, 'expected.vcf')
+        main(vcf, output=expected_out, **kwargs)
+        expected = get_variants(expected_out)
+        out = os.path.join(tmp_dir, 'subset.vcf')
+        for threads in (1, 2):
+            main(vcf, output=out, subset=True, threads=threads, **kwargs)
+            results = get_variants(out)
+            assert_equal(len(results), len(expected))
+            for res, exp in zip(results, expected):
+                assert_equal(list(res.samples), ['Control3', 'Case1',
+                                                 'Case2'])
+                assert_equal((res.chrom, res.pos), (exp.chrom, exp.pos))
+                for smp in res.samples:
+                    assert_equal(dict(res.samples[smp]),
+                                 dict(exp.samples[smp]))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_groups():
+    ''' Single pass filtering of groups matches filtering each group '''
+    tmp_dir = tempfile.mkdtemp()
+    groups = [dict(name='grp1', case=['Case1'],
+                   control=['Control1', 'Control2'],
+                   case_expressions=['AD > 5'], vaf_ratio=2.0),
+              dict(name='grp2', case=['Case2', 'Case3'],
+                   control=['Control2', 'Control3'],
+                   control_expressions=['DP >= 20 1'])]
+    kwargs = dict(min_case_vaf=0.1, quiet=True)
+    try:
+        manifest = os.path.join(tmp_dir, 'groups.json')
+        with open(manifest, 'wt') as fh:
+            json.dump(groups, fh)
+        expected = dict()
+        for group in groups:
+            out = os.path.join(tmp_dir, 'expected_{}.vcf'.format(
+                group['name']))
+            group_args = dict(kwargs)
+            group_args.update((k, v) for k, v in group.items() if k !=
+                              'name')
+            main(ad_vcf, output=out, info_tag='TEST_TAG', **group_args)
+            expected[group['name']] = dict(
+                ((x.pos, x.alts), x.info['TEST_TAG']) for x in
+                get_variants(out))
+        for pipeline in (False, True):
+            template = os.path.join(tmp_dir, 'out_{group}.vcf')
+            main(ad_vcf, groups=manifest, group_outputs=template,
+                 info_tag='TEST_TAG', pipeline=pipeline, **kwargs)
+            for name, exp in expected.items():
+                results = get_variants(template.format(group=name))
+                assert_equal(dict(((x.pos, x.alts), x.info['TEST_TAG']) for
+                                  x in results), exp)
+            out = os.path.join(tmp_dir, 'out.vcf')
+            main(ad_vcf, groups=manifest, output=out, pipeline=pipeline,
+                 **kwargs)
+            results = get_variants(out)
+            passed = set()
+            for name, exp in expected.items():
+                tag = 'CAFEx_' + name
+                assert_equal(dict(((x.pos, x.alts), x.info[tag]) for x in
+                                  results if tag in x.info), exp)
+                passed.update(exp)
+            assert_equal(set((x.pos, x.alts) for x in results), passed)
+        assert_raises(ValueError, main, ad_vcf, groups=manifest,
+                      case=['Case1'], **kwargs)
+        assert_raises(ValueError, main, ad_vcf, groups=manifest,
+                      group_outputs=out, **kwargs)
+        assert_raises(ValueError, main, ad_vcf, case=['Case1'],
+                      group_outputs=template, **kwargs)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_stats():
+    ''' ALT alleles removed by each stage account for all filtered '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    kwargs = dict(case=['Case1', 'Case2', 'Case3'],
+                  case_expressions=["AD > 5", "GQ > 30"],
+                  control=['Control1', 'Control2', 'Control3'],
+                  control_expressions=["DP >= 20 1"],
+                  vaf_ratio=2.0,
+                  info_tag="TEST_TAG",
+                  quiet=True)
+    try:
+        out = os.path.join(tmp_dir, 'out.vcf')
+        results = []
+        for threads in (1, 2):
+            stats = os.path.join(tmp_dir, 'stats.json')
+            main(vcf, output=out, stats=stats, threads=threads, **kwargs)
+            with open(stats, 'rt') as fh:
+                results.append(json.load(fh))
+            records = get_variants(out)
+            passed_alts = sum(bin(x.info['TEST_TAG']).count('1') for x in
+                              records)
+            res = results[-1]
+            assert_equal(res['passed'], len(records))
+            assert_equal(res['records'], len(ad_records) * 4 * 3)
+            cleared = sum(x['alts_cleared'] for x in res['stages'].values())
+            assert_equal(res['alts'] - cleared, passed_alts)
+            assert_equal(res['stages']['genotypes']['calls'], res['records'])
+            for stage, exps in res['expressions'].items():
+                assert_equal(len(exps), len(kwargs[stage]))
+                assert_equal(sum(x['alts_cleared'] for x in exps),
+                             res['stages'][stage]['alts_cleared'])
+            assert_equal(list(res['contigs']), ['1', '2', '3'])
+            assert_equal(sum(x['records'] for x in res['contigs'].values()),
+                         res['records'])
+        for res in results:
+            del res['wall_seconds']
+            for x in [res] + list(res['contigs'].values()):
+                for stage in x['stages'].values():
+                    del stage['seconds']
+        assert_equal(results[0], results[1])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_site_filters():
+    ''' Site filters applied before FORMAT filters in all modes '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(site_vcf, tmp_dir)
+    kwargs = dict(case=['Case1', 'Case2', 'Case3'],
+                  control=['Control1', 'Control2', 'Control3'],
+                  info_tag="TEST_TAG",
+                  quiet=True)
+    site_args = dict(info_expressions=["AC > 0"], pass_only=True,
+                     min_qual=20)
+    try:
+        out = os.path.join(tmp_dir, 'out.vcf')
+        main(vcf, output=out, **kwargs)
+        unfiltered = get_variants(out)
+        main(vcf, output=out, **dict(kwargs, **site_args))
+        expected = [str(x) for x in get_variants(out)]
+        flags = [(x.pos, x.info['TEST_TAG']) for x in get_variants(out)]
+        # 2/3 fail QUAL, 4/8 FILTER, 9 has no AC and 6 AC=0 for second ALT
+        assert_equal(flags[:4], [(5, 1), (6, 1), (10, 1), (20_005, 1)])
+        assert_true(len(expected) < len(unfiltered))
+        stats = os.path.join(tmp_dir, 'stats.json')
+        for extra in (dict(batch_size=7), dict(threads=2),
+                      dict(threads=2, batch_size=7), dict(stats=stats)):
+            main(vcf, output=out, **dict(kwargs, **dict(site_args, **extra)))
+            assert_equal([str(x) for x in get_variants(out)], expected)
+        with open(stats, 'rt') as fh:
+            res = json.load(fh)
+        assert_equal(res['stages']['site']['calls'], res['records'])
+        # FORMAT values only read for the 4 of every 10 records passing
+        assert_equal(res['stages']['genotypes']['calls'],
+                     res['records'] * 4 // 10)
+        groups = os.path.join(tmp_dir, 'groups.json')
+        with open(groups, 'wt') as fh:
+            json.dump([dict(name='grp', case=kwargs['case'],
+                            control=kwargs['control'])], fh)
+        main(vcf, output=out, groups=groups, quiet=True, **site_args)
+        assert_equal([(x.pos, x.info['CAFEx_grp']) for x in
+                      get_variants(out)], flags)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_drop_unused_formats():
+    ''' Unused FORMAT fields removed from output in all modes '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    kwargs = dict(case=['Case1', 'Case2', 'Case3'],
+                  control=['Control1', 'Control2', 'Control3'],
+                  case_expressions=["GQ > 20"],
+                  min_case_vaf=0.1,
+                  quiet=True)
+    try:
+        out = os.path.join(tmp_dir, 'out.vcf')
+        main(vcf, output=out, **kwargs)
+        expected = []
+        for record in get_variants(out):
+            del record.format['DP']
+            expected.append(str(record))
+        for ext, extra in (('vcf', dict()), ('bcf', dict()),
+                           ('vcf.gz', dict(threads=2)),
+                           ('vcf', dict(batch_size=7, pipeline=True))):
+            out = os.path.join(tmp_dir, 'dropped.' + ext)
+            main(vcf, output=out, drop_unused_formats=True,
+                 **dict(kwargs, **extra))
+            with pysam.VariantFile(out) as result:
+                assert_equal(list(result.header.formats), ['AD', 'GQ', 'GT'])
+            assert_equal([str(x) for x in get_variants(out)], expected)
+        groups = os.path.join(tmp_dir, 'groups.json')
+        with open(groups, 'wt') as fh:
+            json.dump([dict(name='grp', case=kwargs['case'],
+                            control=kwargs['control'])], fh)
+        out = os.path.join(tmp_dir, 'groups.vcf')
+        main(vcf, output=out, groups=groups, drop_unused_formats=True,
+             quiet=True)
+        with pysam.VariantFile(out) as result:
+            assert_equal(list(result.header.formats), ['GT'])
+        for record in get_variants(out):
+            assert_equal(list(record.format), ['GT'])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_output_types():
+    ''' Output format and compression level override output extension '''
+    tmp_dir = tempfile.mkdtemp()
+    kwargs = dict(case=['Case1'], control=['Control1'], quiet=True)
+    try:
+        out = os.path.join(tmp_dir, 'out.vcf')
+        main(ad_vcf, output=out, **kwargs)
+        expected = [str(x) for x in get_variants(out)]
+        for output_type, level, compression, fmt in (
+                ('v', None, 'NONE', 'VCF'),
+                ('z', None, 'BGZF', 'VCF'),
+                ('z', 1, 'BGZF', 'VCF'),
+                ('b', 9, 'BGZF', 'BCF'),
+                ('u', None, 'BGZF', 'BCF')):
+            out = os.path.join(tmp_dir, 'out.' + output_type)
+            main(ad_vcf, output=out, output_type=output_type,
+                 compression_level=level, **kwargs)
+            with pysam.VariantFile(out) as result:
+                assert_equal((result.compression, result.format),
+                             (compression, fmt))
+            assert_equal([str(x) for x in get_variants(out)], expected)
+        assert_raises(ValueError, main, ad_vcf, output=out, output_type='x',
+                      **kwargs)
+        for output_type in ('v', 'u'):
+            assert_raises(ValueError, main, ad_vcf, output=out,
+                          output_type=output_type, compression_level=1,
+                          **kwargs)
+        assert_raises(ValueError, main, ad_vcf, output=out, output_type='z',
+                      compression_level=10, **kwargs)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_write_index():
+    ''' Output indexed after writing in all modes '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    kwargs = dict(case=['Case1'], control=['Control1'], quiet=True)
+    try:
+        for ext, extra in (('vcf.gz', dict()),
+                           ('bcf', dict()),
+                           ('vcf.gz', dict(threads=2)),
+                           ('bcf', dict(pipeline=True)),
+                           ('vcf', dict(output_type='z')),
+                           ('vcf', dict(output_type='u'))):
+            out = os.path.join(tmp_dir, 'out.' + ext)
+            main(vcf, output=out, write_index=True, **dict(kwargs, **extra))
+            with pysam.VariantFile(out) as result:
+                csi = result.format == 'BCF'
+                assert_true(os.path.exists(out + ('.csi' if csi else
+                                                  '.tbi')))
+                fetched = [(x.chrom, x.pos) for x in result.fetch('2')]
+            assert_equal(fetched, [(x.chrom, x.pos) for x in
+                                   get_variants(out) if x.chrom == '2'])
+            assert_true(fetched)
+            for idx in (out + '.csi', out + '.tbi'):
+                if os.path.exists(idx):
+                    os.remove(idx)
+        groups = os.path.join(tmp_dir, 'groups.json')
+        with open(groups, 'wt') as fh:
+            json.dump([dict(name=x, case=[x], control=['Control1']) for x
+                       in ('Case1', 'Case2')], fh)
+        template = os.path.join(tmp_dir, 'group_{group}.vcf.gz')
+        main(vcf, groups=groups, group_outputs=template, write_index=True,
+             quiet=True)
+        for name in ('Case1', 'Case2'):
+            assert_true(os.path.exists(template.format(group=name) + '.tbi'))
+        assert_raises(ValueError, main, vcf, write_index=True, **kwargs)
+        assert_raises(ValueError, main, vcf,
+                      output=os.path.join(tmp_dir, 'out.vcf'),
+                      write_index=True, **kwargs)
+        assert_raises(ValueError, main, vcf,
+                      output=os.path.join(tmp_dir, 'out.vcf.gz'),
+                      output_type='v', write_index=True, **kwargs)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_sites_only():
+    ''' Records written without samples in all modes '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    kwargs = dict(case=['Case1', 'Case2', 'Case3'],
+                  control=['Control1', 'Control2', 'Control3'],
+                  min_case_vaf=0.1,
+                  info_tag='TEST_TAG',
+                  quiet=True)
+    try:
+        out = os.path.join(tmp_dir, 'out.vcf')
+        main(vcf, output=out, **kwargs)
+        expected = ['\t'.join(str(x).split('\t')[:8]) + '\n' for x in
+                    get_variants(out)]
+        for ext, extra in (('vcf', dict(sites_only=True)),
+                           ('bcf', dict(output_samples='none')),
+                           ('vcf.gz', dict(sites_only=True, threads=2)),
+                           ('vcf', dict(sites_only=True, batch_size=7,
+                                        pipeline=True))):
+            out = os.path.join(tmp_dir, 'sites.' + ext)
+            main(vcf, output=out, **dict(kwargs, **extra))
+            with pysam.VariantFile(out) as result:
+                assert_equal(len(result.header.samples), 0)
+            assert_equal([str(x) for x in get_variants(out)], expected)
+        groups = os.path.join(tmp_dir, 'groups.json')
+        with open(groups, 'wt') as fh:
+            json.dump([dict(name=x, case=[x], control=['Control1']) for x
+                       in ('Case1', 'Case2')], fh)
+        template = os.path.join(tmp_dir, 'group_{group}.vcf')
+        main(vcf, groups=groups, group_outputs=template, sites_only=True,
+             quiet=True)
+        for name in ('Case1', 'Case2'):
+            records = get_variants(template.format(group=name))
+            assert_true(records)
+            assert_true(all(len(x.samples) == 0 for x in records))
+        assert_raises(ValueError, main, vcf, output=out,
+                      output_samples='some', **kwargs)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_output_samples():
+    ''' Only case and control samples written with output_samples '''
+    tmp_dir = tempfile.mkdtemp()
+    kwargs = dict(case=['Case1'], control=['Control2'], quiet=True)
+    try:
+        out = os.path.join(tmp_dir, 'out.vcf')
+        main(ad_vcf, output=out, subset=True, **kwargs)
+        expected = [str(x) for x in get_variants(out)]
+        main(ad_vcf, output=out, output_samples='case,control', **kwargs)
+        with pysam.VariantFile(out) as result:
+            assert_equal(list(result.header.samples), ['Control2', 'Case1'])
+        assert_equal([str(x) for x in get_variants(out)], expected)
+        main(ad_vcf, output=out, output_samples='all', **kwargs)
+        with pysam.VariantFile(out) as result:
+            assert_equal(len(result.header.samples), 6)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def _split_contigs(vcf, tmp_dir):
+    ''' Write each contig of an indexed VCF to its own file. '''
+    paths = []
+    with pysam.VariantFile(vcf) as variants:
+        for contig in variants.header.contigs:
+            path = os.path.join(tmp_dir, 'chr{}.vcf.gz'.format(contig))
+            with pysam.VariantFile(path, 'w', header=variants.header) as out:
+                for record in variants.fetch(contig):
+                    out.write(record)
+            paths.append(path)
+    return paths
+
+
+def test_multiple_inputs():
+    ''' Several inputs written to one output or one output per input '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    kwargs = dict(case=['Case1', 'Case2'],
+                  control=['Control1'],
+                  case_expressions=["GQ > 20"],
+                  min_case_vaf=0.1,
+                  info_tag='TEST_TAG',
+                  quiet=True)
+    try:
+        out = os.path.join(tmp_dir, 'expected.vcf')
+        main(vcf, output=out, **kwargs)
+        expected = [str(x) for x in get_variants(out)]
+        inputs = _split_contigs(vcf, tmp_dir)
+        for threads in (1, 2):
+            out = os.path.join(tmp_dir, 'combined.vcf.gz')
+            main(inputs, output=out, threads=threads, write_index=True,
+                 **kwargs)
+            assert_equal([str(x) for x in get_variants(out)], expected)
+            assert_true(os.path.exists(out + '.tbi'))
+            template = os.path.join(tmp_dir, 'out', '{name}.bcf')
+            os.mkdir(os.path.dirname(template))
+            main(inputs[:1], output_template=template, threads=threads,
+                 **kwargs)
+            manifest = os.path.join(tmp_dir, 'manifest.txt')
+            with open(manifest, 'wt') as fh:
+                for path in inputs[1:]:
+                    fh.write(os.path.basename(path) + '\n')
+            main([], manifest=manifest, output_template=template,
+                 threads=threads, sites_only=True, **kwargs)
+            results = []
+            for contig in ('1', '2', '3'):
+                path = template.format(name='chr' + contig)
+                with pysam.VariantFile(path) as result:
+                    n_samples = len(result.header.samples)
+                assert_equal(n_samples, 0 if contig != '1' else 6)
+                results.extend(get_variants(path))
+            assert_equal(['\t'.join(str(x).rstrip().split('\t')[:8]) for
+                          x in results],
+                         ['\t'.join(x.rstrip().split('\t')[:8]) for x in
+                          expected])
+            shutil.rmtree(os.path.dirname(template))
+        assert_raises(ValueError, main, inputs, output=out, stats='x.json',
+                      **kwargs)
+        assert_raises(ValueError, main, inputs, output=out,
+                      output_template=template, **kwargs)
+        subset = os.path.join(tmp_dir, 'subset.vcf')
+        with pysam.VariantFile(ad_vcf) as variants:
+            variants.subset_samples(['Case1', 'Case2', 'Control1'])
+            with pysam.VariantFile(subset, 'w',
+                                   header=variants.header) as sub:
+                for record in variants:
+                    sub.write(record)
+        assert_raises(ValueError, main, inputs + [subset], output=out,
+                      **kwargs)
+        assert_raises(ValueError, main, [], **kwargs)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_multiple_inputs_rerun():
+    ''' Filters from a previous run are not reused by the next '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    try:
+        inputs = _split_contigs(vcf, tmp_dir)
+        for kwargs in (dict(case=['Case1']),
+                       dict(case=['Case1'], case_expressions=["GQ > 99"]),
+                       dict(case=['Case2'], control=['Case1'])):
+            out = os.path.join(tmp_dir, 'expected.vcf')
+            main(vcf, output=out, quiet=True, **kwargs)
+            expected = [str(x) for x in get_variants(out)]
+            out = os.path.join(tmp_dir, 'combined.vcf')
+            main(inputs, output=out, quiet=True, **kwargs)
+            assert_equal([str(x) for x in get_variants(out)], expected)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_shard():
+    ''' Shards together give each output record exactly once '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    kwargs = dict(case=['Case1', 'Case2'],
+                  control=['Control1'],
+                  case_expressions=["GQ > 20"],
+                  min_case_vaf=0.1,
+                  quiet=True)
+    try:
+        for regions in (None, ['1:5-40000', '3']):
+            out = os.path.join(tmp_dir, 'expected.vcf')
+            main(vcf, output=out, regions=regions, **kwargs)
+            expected = [str(x) for x in get_variants(out)]
+            for threads in (1, 2):
+                results = []
+                for i in range(1, 6):
+                    out = os.path.join(tmp_dir, 'shard.vcf')
+                    main(vcf, output=out, regions=regions, threads=threads,
+                         shard='{}/5'.format(i), **kwargs)
+                    results.extend(str(x) for x in get_variants(out))
+                assert_equal(results, expected)
+        assert_raises(ValueError, main, ad_vcf, shard='1/2', **kwargs)
+        assert_raises(ValueError, main, vcf, shard='3/2', **kwargs)
+        assert_raises(ValueError, main, [vcf, vcf], shard='1/2', **kwargs)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_status_file():
+    ''' Final status file gives records read and written '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    try:
+        out = os.path.join(tmp_dir, 'out.vcf')
+        status_file = os.path.join(tmp_dir, 'status.json')
+        for threads in (1, 2):
+            main(vcf, output=out, case=['Case1'], control=['Control1'],
+                 status_file=status_file, progress_seconds=1,
+                 threads=threads, quiet=True)
+            with open(status_file, 'rt') as fh:
+                status = json.load(fh)
+            assert_true(status['finished'])
+            assert_equal(status['records'], len(ad_records) * 4 * 3)
+            assert_equal(status['written'], len(get_variants(out)))
+            assert_equal(status['fraction'], 1.0)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def run_interrupted(n_checkpoints, **kwargs):
+    ''' Run main, raising Interrupted after writing n_checkpoints '''
+    write = Checkpoint._write
+    written = []
+
+    def interrupt(self, state):
+        write(self, state)
+        written.append(state)
+        if len(written) >= n_checkpoints:
+            raise Interrupted()
+
+    Checkpoint._write = interrupt
+    try:
+        assert_raises(Interrupted, main, **kwargs)
+    finally:
+        Checkpoint._write = write
+    return written[-1]
+
+
+def test_resume():
+    ''' Resumed run gives the same output as an uninterrupted run '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir, n_copies=400, spacing=100)
+    kwargs = dict(vcf=vcf,
+                  case=['Case1', 'Case2', 'Case3'],
+                  control=['Control1', 'Control2', 'Control3'],
+                  vaf_ratio=2.0,
+                  info_tag="TEST_TAG",
+                  checkpoint=os.path.join(tmp_dir, 'checkpoint.json'),
+                  checkpoint_interval=500,
+                  quiet=True)
+    try:
+        for ext in ('vcf.gz', 'bcf'):
+            for threads in (1, 2):
+                expected = os.path.join(tmp_dir, 'expected.' + ext)
+                main(output=expected, threads=threads, **kwargs)
+                with open(kwargs['checkpoint'], 'rt') as fh:
+                    final = json.load(fh)
+                assert_true(final['finished'])
+                out = os.path.join(tmp_dir, 'out.' + ext)
+                state = run_interrupted(2, output=out, threads=threads,
+                                        **kwargs)
+                assert_false(state['finished'])
+                assert_true(0 < state['read'] < final['read'])
+                assert_true(0 < state['offset'] < os.path.getsize(out))
+                main(output=out, threads=threads, resume=True, **kwargs)
+                with open(kwargs['checkpoint'], 'rt') as fh:
+                    resumed = json.load(fh)
+                assert_equal((resumed['read'], resumed['written']),
+                             (final['read'], final['written']))
+                assert_equal([str(x) for x in get_variants(out)],
+                             [str(x) for x in get_variants(expected)])
+                # nothing to do if already finished
+                main(output=out, threads=threads, resume=True, **kwargs)
+                assert_equal(len(get_variants(out)), final['written'])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_resume_without_checkpoint():
+    ''' Run starts from the beginning if no checkpoint file exists '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    try:
+        out = os.path.join(tmp_dir, 'out.vcf')
+        checkpoint = os.path.join(tmp_dir, 'checkpoint.json')
+        main(vcf, output=out, case=['Case1'], control=['Control1'],
+             checkpoint=checkpoint, resume=True, quiet=True)
+        with open(checkpoint, 'rt') as fh:
+            state = json.load(fh)
+        assert_true(state['finished'])
+        assert_equal(state['read'], len(ad_records) * 4 * 3)
+        assert_raises(ValueError, main, vcf, case=['Case1'], resume=True)
+        assert_raises(ValueError, main, vcf, case=['Case1'],
+                      checkpoint=checkpoint)
+        assert_raises(ValueError, main, vcf, case=['Case1'], output=out,
+                      checkpoint=checkpoint, pipeline=True)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_regions():
+    ''' Only output variants in regions and sites from indexed input '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    bed = os.path.join(tmp_dir, 'regions.bed')
+    with open(bed, 'wt') as fh:
+        fh.write("2\t0\t5\n2\t3\t6\n3\t20004\t20010\n")
+    sites = os.path.join(tmp_dir, 'sites.txt')
+    with open(sites, 'wt') as fh:
+        fh.write("1\t1\n1\t5\n3\t20008\n3\t20010\n")
+    kwargs = dict(case=['Case1'], quiet=True)
+    expected_indices = [True, True, False, True, False, True, False, True,
+                        False, True]
+    expected_pos = [x.pos for x, y in zip(ad_records, expected_indices) if y]
+    try:
+        out = os.path.join(tmp_dir, 'out.vcf')
+        for threads in (1, 2):
+            main(vcf, output=out, regions=['1:3-6', '1:5-8'], threads=threads,
+                 **kwargs)
+            results = [(x.chrom, x.pos) for x in get_variants(out)]
+            assert_equal(results, [('1', x) for x in expected_pos if
+                                   3 <= x <= 8])
+            main(vcf, output=out, regions_file=bed, threads=threads, **kwargs)
+            results = [(x.chrom, x.pos) for x in get_variants(out)]
+            assert_equal(results, [('2', x) for x in expected_pos if x <= 6] +
+                         [('3', x + 20000) for x in expected_pos if 5 <= x])
+            main(vcf, output=out, sites=sites, threads=threads, **kwargs)
+            results = [(x.chrom, x.pos) for x in get_variants(out)]
+            assert_equal(results, [('1', 1), ('3', 20008), ('3', 20010)])
+            main(vcf, output=out, exclude_contigs=['^[12]$'], threads=threads,
+                 **kwargs)
+            results = [(x.chrom, x.pos) for x in get_variants(out)]
+            assert_equal(results, [('3', x + i * 20000) for i in range(4) for
+                                   x in expected_pos])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_regions_without_index():
+    ''' Raise ValueError if regions used with unindexed input '''
+    out = get_tmp_out()
+    kwargs = dict(case=['Case1'], output=out, quiet=True)
+    assert_raises(ValueError, main, ad_vcf, regions=['1:1-5'], **kwargs)
+    main(ad_vcf, exclude_contigs=['^1$'], **kwargs)
+    assert_equal(get_variants(out), [])
+    if os.path.exists(out):
+        os.remove(out)
+
+
 if __name__ == '__main__':
     import nose
     nose.run(defaultTest=__name__)
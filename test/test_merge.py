@@ -0,0 +1,105 @@
+import json
+import os
+import pysam
+import shutil
+import tempfile
+from nose.tools import *
+from .utils import get_variants, make_indexed_vcf
+from cafex.case_control_filter import main as filter_main
+from cafex.merge import get_shard, main, merge_header, merge_stats
+from cafex.merge import order_shards
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
+kwargs = dict(case=['Case1', 'Case2'],
+              control=['Control1'],
+              case_expressions=["GQ > 20"],
+              min_case_vaf=0.1,
+              info_tag='TEST_TAG',
+              quiet=True)
+
+
+def run_shards(vcf, tmp_dir, n_shards, stats=False):
+    outputs, reports = [], []
+    for i in range(1, n_shards + 1):
+        out = os.path.join(tmp_dir, 'shard_{}.bcf'.format(i))
+        report = None
+        if stats:
+            report = os.path.join(tmp_dir, 'shard_{}.json'.format(i))
+            reports.append(report)
+        filter_main(vcf, output=out, shard='{}/{}'.format(i, n_shards),
+                    stats=report, **kwargs)
+        outputs.append(out)
+    return outputs, reports
+
+
+def test_order_shards():
+    ''' Shards sorted by header and missing or duplicate shards rejected '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+        shards, _ = run_shards(vcf, tmp_dir, 3)
+        for i, shard in enumerate(shards):
+            with pysam.VariantFile(shard) as variants:
+                assert_equal(get_shard(variants.header), (i + 1, 3))
+        assert_equal(order_shards(shards[::-1]), shards)
+        assert_raises(ValueError, order_shards, shards[:2])
+        assert_raises(ValueError, order_shards, shards + shards[:1])
+        assert_raises(ValueError, order_shards, shards + [ad_vcf])
+        assert_equal(order_shards([ad_vcf, vcf]), [ad_vcf, vcf])
+        header = merge_header(shards)
+        assert_equal(get_shard(header), None)
+        assert_true('TEST_TAG' in header.info)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_merge():
+    ''' Merged shards give the same records and stats as a single run '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+        expected_out = os.path.join(tmp_dir, 'expected.vcf')
+        expected_stats = os.path.join(tmp_dir, 'expected.json')
+        filter_main(vcf, output=expected_out, stats=expected_stats, **kwargs)
+        expected = [str(x) for x in get_variants(expected_out)]
+        shards, reports = run_shards(vcf, tmp_dir, 4, stats=True)
+        out = os.path.join(tmp_dir, 'merged.vcf.gz')
+        stats = os.path.join(tmp_dir, 'merged.json')
+        main(shards[::-1], output=out, write_index=True, stats=stats,
+             input_stats=reports, quiet=True)
+        assert_equal([str(x) for x in get_variants(out)], expected)
+        assert_true(os.path.exists(out + '.tbi'))
+        with open(expected_stats, 'rt') as fh:
+            expected = json.load(fh)
+        with open(stats, 'rt') as fh:
+            result = json.load(fh)
+        for k in ('records', 'alts', 'passed', 'expressions'):
+            assert_equal(result[k], expected[k])
+        assert_equal(list(result['contigs']), list(expected['contigs']))
+        assert_raises(ValueError, main, shards, output=out, stats=stats)
+        assert_raises(ValueError, main, shards, write_index=True)
+        assert_raises(ValueError, main, [])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_merge_stats():
+    ''' Reports for different expressions can not be merged '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+        _, reports = run_shards(vcf, tmp_dir, 2, stats=True)
+        other = os.path.join(tmp_dir, 'other.json')
+        filter_main(vcf, output=os.path.join(tmp_dir, 'other.vcf'),
+                    stats=other, **dict(kwargs, case_expressions=["DP > 5"]))
+        merged = merge_stats(reports)
+        assert_equal(merged.case_expressions, ["GQ > 20"])
+        assert_raises(ValueError, merge_stats, reports + [other])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,75 @@
+import os
+import pysam
+import tempfile
+from nose.tools import *
+from .utils import get_variants
+from cafex.pipeline import ThreadedWriter, read_ahead
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
+
+
+def _failing_iter(n):
+    for i in range(n):
+        yield i
+    raise ValueError("Failed after {}".format(n))
+
+
+class FailingOut(object):
+    def write(self, record):
+        raise IOError("Can not write")
+
+
+def test_read_ahead():
+    for chunk_size in (1, 3, 1000):
+        assert_equal(list(read_ahead(range(100), chunk_size=chunk_size,
+                                     queue_size=2)), list(range(100)))
+    assert_equal(list(read_ahead([])), [])
+
+
+def test_read_ahead_error():
+    ''' Errors while reading are raised by the consumer '''
+    results = []
+    with assert_raises(ValueError):
+        for x in read_ahead(_failing_iter(10), chunk_size=3):
+            results.append(x)
+    assert_equal(results, list(range(9)))
+
+
+def test_read_ahead_stop():
+    ''' Reading thread stops if consumer stops early '''
+    reader = read_ahead(range(10_000), chunk_size=1, queue_size=1)
+    assert_equal(next(reader), 0)
+    reader.close()
+
+
+def test_threaded_writer():
+    f, out = tempfile.mkstemp(suffix='.vcf')
+    try:
+        records = get_variants(ad_vcf)
+        with pysam.VariantFile(ad_vcf) as variants:
+            vcf_out = pysam.VariantFile(out, 'w', header=variants.header)
+            writer = ThreadedWriter(vcf_out, chunk_size=3, queue_size=1)
+            for record in records:
+                writer.write(record)
+            writer.close()
+            vcf_out.close()
+        assert_equal([str(x) for x in get_variants(out)],
+                     [str(x) for x in records])
+    finally:
+        os.remove(out)
+
+
+def test_threaded_writer_error():
+    writer = ThreadedWriter(FailingOut(), chunk_size=2)
+    for i in range(10):
+        try:
+            writer.write(i)
+        except IOError:
+            break
+    assert_raises(IOError, writer.close)
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
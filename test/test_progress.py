@@ -0,0 +1,110 @@
+import json
+import os
+import pysam
+import shutil
+import tempfile
+from nose.tools import *
+from .utils import get_variants, make_indexed_vcf
+from cafex.progress import Progress, format_seconds, genome_spans
+from cafex.regions import Interval
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
+
+
+class ListLogger(object):
+    def __init__(self):
+        self.messages = []
+
+    def info(self, msg):
+        self.messages.append(msg)
+
+
+def test_genome_spans():
+    with pysam.VariantFile(ad_vcf) as vcf:
+        assert_equal(genome_spans(vcf.header), [('1', 0, 100)])
+        assert_equal(genome_spans(vcf.header, [Interval('1', 10, None),
+                                               Interval('2', 5, 20)]),
+                     [('1', 10, 100), ('2', 5, 20)])
+        assert_is_none(genome_spans(vcf.header, [Interval('2', 0, None)]))
+
+
+def test_fraction():
+    progress = Progress(spans=[('1', 0, 100), ('2', 0, 50), ('3', 10, 60)])
+    assert_is_none(progress.fraction())
+    assert_equal(progress.fraction('1', 50), 0.25)
+    assert_equal(progress.fraction('2', 50), 0.75)
+    assert_equal(progress.fraction('3', 5), 0.75)
+    assert_equal(progress.fraction('3', 35), 0.875)
+    assert_equal(progress.fraction('3', 100), 1.0)
+    assert_equal(progress.fraction('4', 100), 1.0)  # unknown, unchanged
+
+
+def test_file_offset_fraction():
+    ''' Fraction estimated from position in bgzip compressed file '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf = make_indexed_vcf(ad_vcf, tmp_dir, n_copies=200, spacing=100)
+        fractions = []
+        with pysam.VariantFile(vcf) as variants:
+            progress = Progress(vcf=variants)
+            for record in variants:
+                fractions.append(progress.fraction())
+        assert_equal(fractions, sorted(fractions))
+        assert_true(0 <= fractions[0] < 0.5 < fractions[-1] <= 1.0)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_check():
+    logger = ListLogger()
+    progress = Progress(logger, interval=4, spans=[('1', 0, 10)])
+    records = get_variants(ad_vcf)
+    next_check = progress.next_check
+    for read, record in enumerate(records):
+        if read >= next_check:
+            next_check = progress.check(read, read // 2, record)
+    assert_equal(len(logger.messages), 2)
+    assert_true(logger.messages[0].startswith(
+        "4 variants processed, 2 written. At 1:5 ("))
+    assert_true("50.0% complete, ETA" in logger.messages[0])
+    assert_true(logger.messages[1].startswith(
+        "8 variants processed, 4 written. At 1:9 ("))
+
+
+def test_status_file():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        status_file = os.path.join(tmp_dir, 'status.json')
+        progress = Progress(interval=None, status_file=status_file)
+        assert_equal(progress.seconds, 30)
+        with open(status_file, 'rt') as fh:
+            status = json.load(fh)
+        assert_equal(status['records'], 0)
+        assert_false(status['finished'])
+        progress.report(10, 5, '1', 100, fraction=0.5)
+        with open(status_file, 'rt') as fh:
+            status = json.load(fh)
+        assert_equal((status['records'], status['written']), (10, 5))
+        assert_equal((status['contig'], status['pos']), ('1', 100))
+        assert_equal(status['fraction'], 0.5)
+        assert_true(status['eta_seconds'] >= 0)
+        progress.finish(20, 8)
+        with open(status_file, 'rt') as fh:
+            status = json.load(fh)
+        assert_true(status['finished'])
+        assert_equal(status['fraction'], 1.0)
+        assert_equal(os.listdir(tmp_dir), ['status.json'])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_format_seconds():
+    assert_equal(format_seconds(0), '0:00:00')
+    assert_equal(format_seconds(61.4), '0:01:01')
+    assert_equal(format_seconds(3600 * 25 + 59), '25:00:59')
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,220 @@
+import os
+import pysam
+import shutil
+import tempfile
+from nose.tools import *
+from .utils import make_indexed_vcf
+from cafex.regions import Interval, contig_intervals, exclude_contigs
+from cafex.regions import fetch_intervals, merge_intervals, parse_region
+from cafex.regions import parse_shard, partition_intervals, resume_intervals
+from cafex.regions import shard_intervals
+from cafex.vcf_index import index_vcf, needs_csi, read_index
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
+
+
+def _record_keys(records):
+    return [(r.chrom, r.pos, r.ref, r.alts) for r in records]
+
+
+def check_partition(csi, n_parts):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf = make_indexed_vcf(ad_vcf, tmp_dir, csi=csi)
+        with pysam.VariantFile(vcf) as variants:
+            expected = _record_keys(variants)
+            index = read_index(vcf, variants.header.contigs)
+            chunks = partition_intervals(contig_intervals(index), index,
+                                         n_parts)
+            assert_true(1 < len(chunks) <= n_parts)
+            results = []
+            for intervals, previous in chunks:
+                results.extend(_record_keys(
+                    fetch_intervals(variants, intervals, previous)))
+        assert_equal(results, expected)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_read_tbi():
+    ''' Record counts per contig from tabix index '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+        index = read_index(vcf)
+        assert_equal(index.contigs, ['1', '2', '3'])
+        assert_equal(index.n_mapped, {'1': 40, '2': 40, '3': 40})
+        assert_almost_equal(sum(w for _, w in index.density('2')), 40)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_read_csi():
+    ''' Record counts per contig from CSI index '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf = make_indexed_vcf(ad_vcf, tmp_dir, csi=True)
+        index = read_index(vcf)
+        assert_equal(index.contigs, ['1', '2', '3'])
+        assert_equal(index.n_mapped, {'1': 40, '2': 40, '3': 40})
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_no_index():
+    assert_is_none(read_index(ad_vcf))
+
+
+def test_index_vcf():
+    ''' Index written VCF/BCF, using CSI for BCF and long contigs '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+        with pysam.VariantFile(vcf) as variants:
+            header = variants.header
+            expected = _record_keys(variants.fetch('2'))
+            assert_false(needs_csi(header))
+            assert_true(needs_csi(header, bcf=True))
+            for ext in ('vcf.gz', 'bcf'):
+                out = os.path.join(tmp_dir, 'out.' + ext)
+                with pysam.VariantFile(out, 'w', header=header) as fh:
+                    for record in variants.fetch():
+                        fh.write(record)
+                idx = index_vcf(out)
+                assert_equal(idx, out + ('.csi' if ext == 'bcf' else '.tbi'))
+                assert_true(os.path.exists(idx))
+                with pysam.VariantFile(out) as result:
+                    assert_equal(_record_keys(result.fetch('2')), expected)
+        header = header.copy()
+        header.contigs.add('long', length=1 << 30)
+        assert_true(needs_csi(header))
+        assert_raises(ValueError, index_vcf, ad_vcf)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_partition_tbi():
+    ''' Each record fetched once from partitioned intervals (tabix) '''
+    for n in (2, 5, 12, 40):
+        check_partition(False, n)
+
+
+def test_partition_csi():
+    ''' Each record fetched once from partitioned intervals (CSI) '''
+    for n in (2, 5, 12, 40):
+        check_partition(True, n)
+
+
+def test_fetch_overlapping_previous():
+    ''' Records overlapping previous interval are skipped '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+        with pysam.VariantFile(vcf) as variants:
+            # deletion at pos 10 overlaps both intervals
+            intervals = [Interval('1', 5, 10), Interval('1', 10, 20)]
+            results = [r.pos for r in fetch_intervals(variants, intervals)]
+            assert_equal(results, [6, 7, 8, 9, 10])
+            results = [r.pos for r in fetch_intervals(variants, intervals[1:],
+                                                      intervals[0])]
+            assert_equal(results, [])
+            results = [r.pos for r in fetch_intervals(variants, intervals[1:])]
+            assert_equal(results, [10])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_shard_intervals():
+    ''' Each record fetched from exactly one shard '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+        with pysam.VariantFile(vcf) as variants:
+            expected = _record_keys(variants)
+            index = read_index(vcf, variants.header.contigs)
+            for n in (1, 3, 7, 1000):
+                results = []
+                for i in range(1, n + 1):
+                    intervals, previous = shard_intervals(
+                        contig_intervals(index), index, i, n)
+                    assert_equal((intervals, previous), shard_intervals(
+                        contig_intervals(index), index, i, n))
+                    results.extend(_record_keys(
+                        fetch_intervals(variants, intervals, previous)))
+                assert_equal(results, expected)
+            assert_equal(shard_intervals(contig_intervals(index), index,
+                                         1000, 1000), ([], None))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_parse_shard():
+    assert_equal(parse_shard('1/10'), (1, 10))
+    assert_equal(parse_shard('10/10'), (10, 10))
+    for shard in ('0/10', '11/10', '1', '1/', 'a/b', '-1/2'):
+        assert_raises(ValueError, parse_shard, shard)
+
+
+def test_resume_intervals():
+    ''' Records from resume position onwards fetched exactly once '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+        intervals = [Interval('1', 5, 10), Interval('1', 10, 20),
+                     Interval('2', 0, None), Interval('3', 0, 40_000)]
+        with pysam.VariantFile(vcf) as variants:
+            expected = _record_keys(fetch_intervals(variants, intervals))
+            for i, (contig, pos, _, _) in enumerate(expected):
+                if i and expected[i - 1][:2] == (contig, pos):
+                    continue  # can only resume at first record at pos
+                remaining, previous = resume_intervals(intervals, contig,
+                                                       pos - 1)
+                results = _record_keys(fetch_intervals(variants, remaining,
+                                                       previous))
+                assert_equal(results, expected[i:])
+    finally:
+        shutil.rmtree(tmp_dir)
+    assert_equal(resume_intervals(intervals, '2', 5),
+                 ([Interval('2', 5, None), Interval('3', 0, 40_000)],
+                  Interval('2', 0, 5)))
+    assert_equal(resume_intervals(intervals, '1', 12)[0][0],
+                 Interval('1', 12, 20))
+    assert_equal(resume_intervals(intervals, '3', 40_000), ([], None))
+
+
+def test_parse_region():
+    assert_equal(parse_region('chr1'), Interval('chr1', 0, None))
+    assert_equal(parse_region('chr1:1,001'), Interval('chr1', 1000, None))
+    assert_equal(parse_region('chr1:101-200'), Interval('chr1', 100, 200))
+    assert_equal(parse_region('HLA-A*01:01:01:01', ['HLA-A*01:01:01:01']),
+                 Interval('HLA-A*01:01:01:01', 0, None))
+    assert_raises(ValueError, parse_region, 'chr1:200-100')
+    assert_raises(ValueError, parse_region, 'chr1:0-100')
+
+
+def test_merge_intervals():
+    intervals = [Interval('2', 10, 20),
+                 Interval('1', 50, 60),
+                 Interval('1', 0, 10),
+                 Interval('1', 5, 15),
+                 Interval('1', 15, 20),
+                 Interval('2', 15, None),
+                 Interval('2', 100, 200),
+                 Interval('X', 0, 10)]
+    expected = [Interval('1', 0, 20),
+                Interval('1', 50, 60),
+                Interval('2', 10, None)]
+    assert_equal(merge_intervals(intervals, ['1', '2']), expected)
+
+
+def test_exclude_contigs():
+    contigs = ['chr1', 'chr1_KI270706v1_random', 'chr6_GL000251v2_alt',
+               'chrEBV', 'chrUn_JTFH01000001v1_decoy', 'HLA-A*01:01:01:01']
+    assert_equal(exclude_contigs(contigs, ['_decoy$', '_alt$', '^HLA']),
+                 ['chr1', 'chr1_KI270706v1_random', 'chrEBV'])
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
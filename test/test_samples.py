@@ -0,0 +1,53 @@
+import os
+import pickle
+import pysam
+from nose.tools import *
+from .utils import get_variants
+from cafex.genotype_filter import FormatFilter
+from cafex.samples import SampleHandle, get_sample_handles, sample_name
+from cafex.vaf import get_vaf_method
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
+samples = ['Case1', 'Case2', 'Control3']
+
+
+def test_get_sample_handles():
+    with pysam.VariantFile(ad_vcf) as vcf:
+        handles = get_sample_handles(vcf, samples)
+    assert_equal(handles, [3, 4, 2])
+    assert_equal([sample_name(x) for x in handles], samples)
+    assert_equal(sample_name('Case1'), 'Case1')
+
+
+def test_missing_samples():
+    with pysam.VariantFile(ad_vcf) as vcf:
+        assert_raises(ValueError, get_sample_handles, vcf, ['Case1', 'Foo'])
+
+
+def test_pickle():
+    handle = SampleHandle(3, 'Case1')
+    unpickled = pickle.loads(pickle.dumps(handle))
+    assert_equal(unpickled, 3)
+    assert_equal(unpickled.name, 'Case1')
+
+
+def test_handle_access():
+    ''' Results are the same using sample names or handles '''
+    records = get_variants(ad_vcf)
+    with pysam.VariantFile(ad_vcf) as vcf:
+        handles = get_sample_handles(vcf, samples)
+        f_filter = FormatFilter(vcf, ['AD > 3 and GQ > 50 or DP > 20'])
+        vaf_func = get_vaf_method(vcf)
+    for rec in records:
+        assert_equal(f_filter.filter(rec, samples),
+                     f_filter.filter(rec, handles))
+        for name, handle in zip(samples, handles):
+            assert_equal(rec.samples[handle].name, name)
+            for i in range(1, len(rec.alleles)):
+                assert_equal(vaf_func(rec, name, i), vaf_func(rec, handle, i))
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
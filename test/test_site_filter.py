@@ -0,0 +1,67 @@
+import os
+import pysam
+from nose.tools import *
+from .utils import get_variants
+from cafex.site_filter import SiteFilter
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+site_vcf = os.path.join(dir_path, 'test_data', 'site_test.vcf')
+
+
+def _get_site_filter(**kwargs):
+    with pysam.VariantFile(site_vcf) as variants:
+        site_filter = SiteFilter(variants, **kwargs)
+    return site_filter
+
+
+def check_flags(expected, **kwargs):
+    site_filter = _get_site_filter(**kwargs)
+    assert_equal([site_filter.filter(x) for x in get_variants(site_vcf)],
+                 expected)
+
+
+def test_no_filters():
+    ''' All ALT alleles pass if no filters given '''
+    check_flags([1, 1, 1, 1, 1, 3, 1, 1, 1, 1])
+
+
+def test_pass_only():
+    ''' Records without FILTER PASS fail, including missing FILTER '''
+    check_flags([1, 1, 1, 0, 1, 3, 1, 0, 1, 1], pass_only=True)
+
+
+def test_min_qual():
+    ''' Records with QUAL below threshold or missing QUAL fail '''
+    check_flags([1, 0, 0, 1, 1, 3, 1, 1, 1, 1], min_qual=20)
+    check_flags([1, 1, 0, 1, 1, 3, 1, 1, 1, 1], min_qual=10)
+
+
+def test_info_expressions():
+    ''' INFO expressions evaluated per ALT allele '''
+    check_flags([1, 1, 1, 1, 1, 1, 0, 1, 0, 1], info_expressions=["AC > 0"])
+    check_flags([1, 1, 1, 1, 0, 1, 0, 1, 0, 1],
+                info_expressions=["AC > 0", "MQ >= 40"])
+    check_flags([1, 0, 0, 1, 1, 0, 0, 1, 0, 1],
+                info_expressions=["AC > 1 or MQ < 40"])
+    check_flags([0, 0, 0, 0, 0, 3, 1, 0, 0, 0],
+                info_expressions=["AC < 2 and MQ > 50"], min_qual=20)
+
+
+def test_invalid_info_expressions():
+    ''' Raise ValueError for unknown, Flag or FORMAT fields '''
+    assert_raises(ValueError, _get_site_filter, info_expressions=["XX > 1"])
+    assert_raises(ValueError, _get_site_filter, info_expressions=["DP > 1"])
+    assert_raises(ValueError, _get_site_filter, info_expressions=["DB = 1"])
+
+
+def test_min_samples_not_allowed():
+    ''' Raise ValueError if a minimum number of samples is given '''
+    assert_raises(ValueError, _get_site_filter,
+                  info_expressions=["AC > 0 2"])
+    assert_raises(ValueError, _get_site_filter,
+                  info_expressions=["AC > 0 all"])
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,39 @@
+import os
+import pysam
+from nose.tools import *
+from .utils import get_variants
+from cafex.sites_only import get_sites_header, sites_record
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+site_vcf = os.path.join(dir_path, 'test_data', 'site_test.vcf')
+svaba_vcf = os.path.join(dir_path, 'test_data', 'svaba_test.vcf')
+
+
+def test_sites_header():
+    ''' Header without samples keeps all other lines '''
+    with pysam.VariantFile(site_vcf) as vcf:
+        header = get_sites_header(vcf.header)
+        assert_equal(len(header.samples), 0)
+        assert_equal(len(vcf.header.samples), 6)
+        assert_equal(header.version, vcf.header.version)
+        assert_equal(str(header).split('\n')[:-2],
+                     str(vcf.header).split('\n')[:-2])
+        assert_equal(str(header).split('\n')[-2],
+                     '\t'.join(str(vcf.header).split('\n')[-2].split('\t')
+                               [:8]))
+
+
+def test_sites_record():
+    ''' Sites-only records have the first eight columns of the original '''
+    for path in (site_vcf, svaba_vcf):
+        with pysam.VariantFile(path) as vcf:
+            header = get_sites_header(vcf.header)
+        for record in get_variants(path):
+            expected = str(record).split('\t')[:8]
+            assert_equal(str(sites_record(header, record)).rstrip('\n'),
+                         '\t'.join(expected))
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
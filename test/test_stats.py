@@ -0,0 +1,67 @@
+import time
+from nose.tools import *
+from cafex.stats import RunStats, STAGES
+
+
+def test_add_stage():
+    stats = RunStats(['AD > 5', 'GQ > 20'], ['DP > 10 all'])
+    contig = stats.contig('chr1')
+    assert_true(stats.contig('chr1') is contig)
+    contig.add_stage('genotypes', time.perf_counter(), 0b111, 0b010)
+    contig.add_stage('genotypes', time.perf_counter(), 0b1, 0b1)
+    contig.add_stage('vaf', time.perf_counter(), 0b10, 0)
+    assert_equal(contig.calls['genotypes'], 2)
+    assert_equal(contig.cleared['genotypes'], 2)
+    assert_equal(contig.cleared['vaf'], 1)
+    assert_equal(contig.calls['case_expressions'], 0)
+    assert_equal(contig.expressions['case_expressions'], [0, 0])
+    assert_equal(contig.expressions['control_expressions'], [0])
+
+
+def test_merge():
+    stats = RunStats(['AD > 5'], [])
+    other = RunStats(['AD > 5'], [])
+    for s, contigs in ((stats, ('chr1', 'chr2')), (other, ('chr2', 'chr3'))):
+        for c in contigs:
+            contig = s.contig(c)
+            contig.records += 2
+            contig.alts += 3
+            contig.passed += 1
+            contig.expressions['case_expressions'][0] += 1
+            contig.add_stage('case_expressions', time.perf_counter(), 0b11,
+                             0b10)
+    stats.merge(other)
+    result = stats.to_dict()
+    assert_equal(list(result['contigs']), ['chr1', 'chr2', 'chr3'])
+    assert_equal(result['records'], 8)
+    assert_equal(result['alts'], 12)
+    assert_equal(result['passed'], 4)
+    assert_equal(result['contigs']['chr2']['records'], 4)
+    assert_equal(result['expressions']['case_expressions'],
+                 [dict(expression='AD > 5', alts_cleared=4)])
+    assert_equal(result['expressions']['control_expressions'], [])
+    assert_equal(list(result['stages']), list(STAGES))
+    assert_equal(result['stages']['case_expressions']['calls'], 4)
+    assert_equal(result['stages']['case_expressions']['alts_cleared'], 4)
+
+
+def test_from_dict():
+    ''' RunStats recreated from to_dict output '''
+    stats = RunStats(['AD > 5'], ['DP > 10'])
+    for c in ('chr1', 'chr2'):
+        contig = stats.contig(c)
+        contig.records += 2
+        contig.alts += 3
+        contig.passed += 1
+        contig.expressions['control_expressions'][0] += 1
+        contig.add_stage('vaf', time.perf_counter(), 0b11, 0b10)
+    expected = stats.to_dict()
+    result = RunStats.from_dict(expected)
+    assert_equal(result.case_expressions, ['AD > 5'])
+    assert_equal(result.control_expressions, ['DP > 10'])
+    assert_equal(result.to_dict(), expected)
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
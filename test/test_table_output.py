@@ -0,0 +1,319 @@
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pysam
+import shutil
+import tempfile
+from nose.tools import *
+from .utils import get_variants, make_indexed_vcf
+from cafex.case_control_filter import get_max_vafs, main
+from cafex.samples import get_sample_handles
+from cafex.table_output import SITE_COLUMNS, TableWriter, get_table_format
+from cafex.vaf import get_vaf_method
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+ad_vcf = os.path.join(dir_path, 'test_data', 'ad_test.vcf')
+fb_vcf = os.path.join(dir_path, 'test_data', 'fb_test.vcf')
+
+
+def read_table(path):
+    if get_table_format(path) == 'parquet':
+        return pq.read_table(path)
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def write_table(path, vcf, flags, **kwargs):
+    with pysam.VariantFile(vcf) as variants:
+        header = variants.header
+        vaf_calculation = get_vaf_method(variants, all_alleles=True)
+    with TableWriter(path, header, vaf_calculation=vaf_calculation,
+                     **kwargs) as table:
+        for record, flag in zip(get_variants(vcf), flags):
+            table.write(record, flag)
+    return read_table(path)
+
+
+def test_table_format():
+    ''' Table format from extension '''
+    assert_equal(get_table_format('out.parquet'), 'parquet')
+    assert_equal(get_table_format('out.PQ'), 'parquet')
+    assert_equal(get_table_format('out.arrow'), 'arrow')
+    assert_equal(get_table_format('out.feather'), 'arrow')
+    assert_raises(ValueError, get_table_format, 'out.tsv')
+
+
+def test_rows_per_alt():
+    ''' One row per passing ALT allele with per-allele values '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        with pysam.VariantFile(fb_vcf) as variants:
+            case = get_sample_handles(variants, ['Case1', 'Case3'])
+            control = get_sample_handles(variants, ['Control1'])
+        for ext in ('parquet', 'arrow'):
+            path = os.path.join(tmp_dir, 'out.' + ext)
+            flags = [0] * 5 + [3] + [0] * 3 + [1]
+            table = write_table(path, fb_vcf, flags, case=case,
+                                control=control,
+                                fields=['GT', 'AO', 'RO'])
+            assert_equal(table.column_names,
+                         ['chrom', 'pos', 'id', 'ref', 'alt', 'allele',
+                          'filter_flag', 'case_max_vaf', 'control_max_vaf',
+                          'Case1:GT', 'Case3:GT', 'Control1:GT',
+                          'Case1:AO', 'Case3:AO', 'Control1:AO',
+                          'Case1:RO', 'Case3:RO', 'Control1:RO'])
+            assert_equal(table.schema.field('pos').type, pa.int64())
+            assert_equal(table.schema.field('Case1:AO').type, pa.int32())
+            rows = table.to_pylist()
+            assert_equal([(x['pos'], x['alt'], x['allele']) for x in rows],
+                         [(6, 'G', 1), (6, 'T', 2), (10, 'C', 1)])
+            assert_equal([x['filter_flag'] for x in rows], [3, 3, 1])
+            assert_equal([x['Case1:AO'] for x in rows], [0, 12, 10])
+            assert_equal([x['Case3:AO'] for x in rows], [15, 0, 15])
+            assert_equal([x['Case1:RO'] for x in rows], [12, 12, 10])
+            assert_equal([x['Case1:GT'] for x in rows], ['0/2', '0/2', '0/1'])
+            assert_equal([x['case_max_vaf'] for x in rows], [0.5, 0.5, 0.5])
+            assert_equal([x['control_max_vaf'] for x in rows],
+                         [1.0, 0.0, 3 / 33])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_ref_alt_values():
+    ''' Number=R fields give REF and ALT values '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'out.parquet')
+        table = write_table(path, ad_vcf, [0] * 5 + [2], case=['Case1'],
+                            fields=['AD', 'DP'])
+        assert_equal(table.column_names,
+                     ['chrom', 'pos', 'id', 'ref', 'alt', 'allele',
+                      'filter_flag', 'case_max_vaf', 'Case1:AD',
+                      'Case1:DP'])
+        assert_equal(table.schema.field('Case1:AD').type,
+                     pa.list_(pa.int32()))
+        assert_equal(table.to_pylist()[0]['Case1:AD'], [12, 12])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_no_call_values():
+    ''' Missing values for no-calls with one value at multiallelics '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        tmp_vcf = os.path.join(tmp_dir, 'no_call.vcf')
+        with open(ad_vcf, 'rt') as fh, open(tmp_vcf, 'wt') as out:
+            for line in fh:
+                if line.startswith('#'):
+                    out.write(line)
+            out.write('\t'.join(['1', '1', '.', 'C', 'G,T', '.', 'PASS', '.',
+                                 'GT:AD', './.:.'] + ['0/2:5,0,5'] * 5) +
+                      '\n')
+        path = os.path.join(tmp_dir, 'out.parquet')
+        table = write_table(path, tmp_vcf, [3], case=['Case1'],
+                            control=['Control1'], fields=['GT', 'AD'])
+        rows = table.to_pylist()
+        assert_equal([x['Control1:AD'] for x in rows], [None, None])
+        assert_equal([x['Control1:GT'] for x in rows], ['./.', './.'])
+        assert_equal([x['Case1:AD'] for x in rows], [[5, 0], [5, 5]])
+        with open(fb_vcf, 'rt') as fh, open(tmp_vcf, 'wt') as out:
+            for line in fh:
+                if line.startswith('#'):
+                    out.write(line)
+            out.write('\t'.join(['1', '1', '.', 'C', 'G,T', '.', 'PASS', '.',
+                                 'GT:RO:AO', './.:.:.'] + ['0/2:5:0,5'] * 5) +
+                      '\n')
+        table = write_table(path, tmp_vcf, [3], case=['Case1'],
+                            control=['Control1'], fields=['AO'])
+        rows = table.to_pylist()
+        assert_equal([x['Control1:AO'] for x in rows], [None, None])
+        assert_equal([x['Case1:AO'] for x in rows], [0, 5])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_row_groups():
+    ''' Rows written in row groups of bounded size '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'out.parquet')
+        n = len(get_variants(ad_vcf))
+        table = write_table(path, ad_vcf, [1] * n, case=['Case1'],
+                            row_group_size=3)
+        assert_equal(table.num_rows, n)
+        meta = pq.ParquetFile(path).metadata
+        assert_equal(meta.num_row_groups, -(-n // 3))
+        assert_true(all(meta.row_group(i).num_rows <= 3 for i in
+                        range(meta.num_row_groups)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_append():
+    ''' Rows from Arrow IPC tables appended in order '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        records = get_variants(ad_vcf)
+        with pysam.VariantFile(ad_vcf) as variants:
+            header = variants.header
+        parts = []
+        for i, chunk in enumerate((records[:4], records[4:])):
+            part = os.path.join(tmp_dir, 'part{}.arrow'.format(i))
+            with TableWriter(part, header, case=['Case1']) as table:
+                for record in chunk:
+                    table.write(record, 1)
+            parts.append(part)
+        path = os.path.join(tmp_dir, 'out.parquet')
+        with TableWriter(path, header, case=['Case1']) as table:
+            for part in parts:
+                table.append(part)
+        assert_equal(read_table(path)['pos'].to_pylist(),
+                     [x.pos for x in records])
+        assert_false(any(os.path.exists(x) for x in parts))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_case_or_control_only():
+    ''' VAF columns filled when only case or only control samples given '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'out.arrow')
+        for samples, fields in ((dict(control=['Control1']), []),
+                                (dict(control=['Control1']), ['DP']),
+                                (dict(case=['Case1']), []),
+                                (dict(case=['Case1']), ['DP'])):
+            (group, names), = samples.items()
+            table = write_table(path, fb_vcf, [0] * 9 + [1], fields=fields,
+                                **samples)
+            assert_equal(table.column_names,
+                         [x for x, _ in SITE_COLUMNS] +
+                         [group + '_max_vaf'] +
+                         [names[0] + ':' + x for x in fields])
+            rows = table.to_pylist()
+            assert_equal(len(rows), 1)
+            expected = 3 / 33 if group == 'control' else 0.5
+            assert_equal(rows[0][group + '_max_vaf'], expected)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_main_control_only():
+    ''' Table output for runs with only control samples '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        out = os.path.join(tmp_dir, 'out.vcf')
+        table_out = os.path.join(tmp_dir, 'out.arrow')
+        for fields in ([], ['DP']):
+            main(ad_vcf, control=['Control1'], output=out,
+                 table_output=table_out, ignore_genotypes=True,
+                 table_fields=fields, quiet=True)
+            table = read_table(table_out)
+            assert_equal(table.num_rows,
+                         sum(len(x.alts) for x in get_variants(out)))
+            assert_true(table.num_rows)
+            assert_equal(table.column_names[len(SITE_COLUMNS):],
+                         ['control_max_vaf'] +
+                         ['Control1:' + x for x in fields])
+            assert_true(None not in table['control_max_vaf'].to_pylist())
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_given_vafs():
+    ''' VAFs calculated when filtering are written instead of recalculated '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        record = get_variants(fb_vcf)[5]
+        with pysam.VariantFile(fb_vcf) as variants:
+            header = variants.header
+            vaf_calculation = get_vaf_method(variants, all_alleles=True)
+        path = os.path.join(tmp_dir, 'out.parquet')
+        with TableWriter(path, header, case=['Case1'], control=['Control1'],
+                         vaf_calculation=vaf_calculation) as table:
+            table.write(record, 3, case_vafs=[0.25, 0.75])
+        rows = read_table(path).to_pylist()
+        assert_equal([x['case_max_vaf'] for x in rows], [0.25, 0.75])
+        assert_equal([x['control_max_vaf'] for x in rows], [1.0, 0.0])
+        with TableWriter(path, header, case=['Case1']) as table:
+            table.write(record, 3)
+        assert_false('case_max_vaf' in read_table(path).column_names)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_invalid_fields():
+    ''' Raise ValueError for FORMAT fields not in header '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        with pysam.VariantFile(ad_vcf) as variants:
+            assert_raises(ValueError, TableWriter,
+                          os.path.join(tmp_dir, 'out.parquet'), variants,
+                          case=['Case1'], fields=['AO'])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_main_table_output():
+    ''' Table of passing ALT alleles matches VCF output in all modes '''
+    tmp_dir = tempfile.mkdtemp()
+    vcf = make_indexed_vcf(ad_vcf, tmp_dir)
+    with pysam.VariantFile(vcf) as variants:
+        vaf_calculation = get_vaf_method(variants, all_alleles=True)
+    input_records = dict(((x.chrom, x.pos, x.alleles), x) for x in
+                         get_variants(vcf))
+    kwargs = dict(case=['Case1', 'Case2', 'Case3'],
+                  control=['Control1', 'Control2', 'Control3'],
+                  info_tag='TEST_TAG',
+                  table_fields=['GQ', 'AD'],
+                  quiet=True)
+    try:
+        for ext, extra in (('parquet', dict()),
+                           ('arrow', dict()),
+                           ('parquet', dict(threads=2)),
+                           ('arrow', dict(batch_size=7, pipeline=True)),
+                           ('parquet', dict(drop_unused_formats=True)),
+                           ('parquet', dict(min_case_vaf=0.1,
+                                            max_control_vaf=0.2)),
+                           ('parquet', dict(min_case_vaf=0.1, vaf_ratio=2,
+                                            stats=os.path.join(
+                                                tmp_dir, 'stats.json'))),
+                           ('arrow', dict(max_control_vaf=0.2,
+                                          batch_size=3))):
+            out = os.path.join(tmp_dir, 'out.vcf')
+            table_out = os.path.join(tmp_dir, 'out.' + ext)
+            main(vcf, output=out, table_output=table_out,
+                 **dict(kwargs, **extra))
+            table = read_table(table_out)
+            expected = []
+            for record in get_variants(out):
+                flag = record.info['TEST_TAG']
+                key = (record.chrom, record.pos, record.alleles)
+                vafs = [get_max_vafs(input_records[key], x, vaf_calculation)
+                        for x in (kwargs['case'], kwargs['control'])]
+                expected.extend((record.chrom, record.pos, i + 1, flag,
+                                 vafs[0][i], vafs[1][i]) for
+                                i in range(len(record.alts)) if
+                                flag >> i & 1)
+            assert_true(expected)
+            assert_equal([(x['chrom'], x['pos'], x['allele'],
+                           x['filter_flag'], x['case_max_vaf'],
+                           x['control_max_vaf']) for x in table.to_pylist()],
+                         expected)
+            assert_equal(table.column_names[7:10],
+                         ['case_max_vaf', 'control_max_vaf', 'Case1:GQ'])
+        assert_raises(ValueError, main, vcf, output=out,
+                      table_output=os.path.join(tmp_dir, 'out.tsv'),
+                      **kwargs)
+        assert_raises(ValueError, main, vcf, output=out, **kwargs)
+        assert_raises(ValueError, main, vcf, output=out,
+                      table_output=table_out,
+                      checkpoint=os.path.join(tmp_dir, 'ckpt.json'),
+                      **kwargs)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    import nose
+    nose.run(defaultTest=__name__)
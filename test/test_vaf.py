@@ -1,8 +1,12 @@
 import os
 import pysam
+import shutil
+import tempfile
 from nose.tools import *
 from .utils import get_variants
-from cafex.vaf import get_vaf_method, _get_ad_vaf
+from cafex.format_cache import FormatCache
+from cafex.vaf import ALL_ALLELE_METHODS, VafMemo, get_vaf_method
+from cafex.vaf import _get_ad_vaf, _get_ad_vafs, _get_strelka_vafs
 from cafex.vaf import _get_platypus_vaf, _get_svaba_vaf
 from cafex.vaf import _get_strelka_vaf, _get_freebayes_vaf
 
@@ -140,6 +144,136 @@ def test_svaba_vaf_values():
                 assert_almost_equals(result, exp[i][j])
 
 
+def test_all_allele_vafs():
+    ''' All-allele methods give the same VAFs as single allele methods '''
+    for path in (ad_vcf, fb_vcf, nv_vcf, strelka_vcf, svaba_vcf):
+        with pysam.VariantFile(path) as vcf:
+            vaf_func = get_vaf_method(vcf)
+            vafs_func = get_vaf_method(vcf, all_alleles=True)
+            assert_equal(vafs_func, ALL_ALLELE_METHODS[vaf_func])
+            records = list(vcf)
+        for rec in records:
+            n_alts = len(rec.alts)
+            for smp in ('Case1', 'Case2', 'Case3'):
+                expected = [vaf_func(rec, smp, i + 1) for i in range(n_alts)]
+                cache = FormatCache(rec)
+                for mask in (None, (1 << n_alts) - 1):
+                    assert_equal(vafs_func(rec, smp, cache, mask), expected)
+                    assert_equal(vafs_func(rec, smp, None, mask), expected)
+                for i in range(n_alts):
+                    vafs = vafs_func(rec, smp, cache, 1 << i)
+                    assert_equal(len(vafs), n_alts)
+                    assert_equal(vafs[i], expected[i])
+
+
+def test_no_call_vafs():
+    ''' VAFs of 0.0 for every ALT allele of no-calls '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for path in (ad_vcf, fb_vcf, nv_vcf):
+            tmp_vcf = os.path.join(tmp_dir, os.path.basename(path))
+            with open(path, 'rt') as fh, open(tmp_vcf, 'wt') as out:
+                for line in fh:
+                    if line.startswith('#'):
+                        out.write(line)
+                        continue
+                    split = line.rstrip().split('\t')
+                    n_fields = len(split[8].split(':'))
+                    missing = ':'.join(['.'] * n_fields)
+                    split[4] = 'G,T'
+                    out.write('\t'.join(split[:9] + [missing] *
+                                        (len(split) - 9)) + '\n')
+                    break
+            with pysam.VariantFile(tmp_vcf) as vcf:
+                vafs_func = get_vaf_method(vcf, all_alleles=True)
+                rec = next(vcf)
+            assert_equal(vafs_func(rec, 'Case1'), [0.0, 0.0])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def write_short_values_vcf(path, tmp_dir):
+    '''
+    Write the header of path and a C>G,T record where Control1 has fewer
+    values than alleles, Control2 zero depth and Case1 one value per allele.
+    '''
+    values = {ad_vcf: ('GT:AD', '0/0:5', '0/0:0,0,0', '0/2:5,0,5'),
+              fb_vcf: ('GT:RO:AO', '0/0:5:0', '0/0:0:0,0', '0/2:5:0,5'),
+              nv_vcf: ('GT:NR:NV', '0/0:5:0', '0/0:0,0:0,0', '0/2:10,10:0,5')}
+    fmt, short, zero, call = values[path]
+    tmp_vcf = os.path.join(tmp_dir, os.path.basename(path))
+    with open(path, 'rt') as fh, open(tmp_vcf, 'wt') as out:
+        for line in fh:
+            if line.startswith('#'):
+                out.write(line)
+                n_samples = len(line.split('\t')) - 9
+        out.write('\t'.join(['1', '1', '.', 'C', 'G,T', '.', 'PASS', '.',
+                             fmt, short, zero] +
+                            [call] * (n_samples - 2)) + '\n')
+    return tmp_vcf
+
+
+def test_short_values_vafs():
+    ''' One VAF per ALT for short and zero-depth values at multiallelics '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for path in (ad_vcf, fb_vcf, nv_vcf):
+            tmp_vcf = write_short_values_vcf(path, tmp_dir)
+            with pysam.VariantFile(tmp_vcf) as vcf:
+                vaf_func = get_vaf_method(vcf)
+                vafs_func = get_vaf_method(vcf, all_alleles=True)
+                rec = next(vcf)
+            assert_equal(vafs_func(rec, 'Control1'), [0.0, 0.0])
+            assert_equal(vafs_func(rec, 'Control2'), [0.0, 0.0])
+            assert_equal(vafs_func(rec, 'Case1'), [0.0, 0.5])
+            for smp in ('Control1', 'Control2', 'Case1'):
+                assert_equal(vafs_func(rec, smp),
+                             [vaf_func(rec, smp, i) for i in (1, 2)])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_strelka_mask():
+    ''' Only FORMAT fields for masked ALT alleles are read '''
+    with pysam.VariantFile(strelka_vcf) as vcf:
+        records = [x for x in vcf if len(x.alts) > 1 and 'AU' in x.format]
+    assert_true(records)
+    for rec in records:
+        cache = FormatCache(rec)
+        vafs = _get_strelka_vafs(rec, 'Case1', cache, 0b10)
+        assert_equal(vafs[0], 0.0)
+        assert_false(('Case1', rec.alts[0] + 'U') in cache)
+        assert_true(('Case1', rec.alts[1] + 'U') in cache)
+
+
+def test_vaf_memo():
+    ''' VAFs are calculated once per record and sample '''
+    calls = []
+
+    def vaf_func(record, sample, cache=None, mask=None):
+        calls.append((record.pos, sample, mask))
+        return _get_ad_vafs(record, sample, cache, mask)
+
+    memo = VafMemo(vaf_func)
+    records = get_variants(ad_vcf)
+    for rec in records:
+        for smp in ('Case1', 'Case2', 'Case1'):
+            assert_equal(memo(rec, smp), _get_ad_vafs(rec, smp))
+    assert_equal(len(calls), 2 * len(records))
+    memo(records[0], 'Case1')  # new record, recalculated
+    assert_equal(len(calls), 2 * len(records) + 1)
+    # only recalculated if more alleles are required
+    calls = []
+    rec = records[5]
+    memo(rec, 'Case1', mask=0b01)
+    memo(rec, 'Case1', mask=0b01)
+    memo(rec, 'Case1', mask=0b10)
+    memo(rec, 'Case1', mask=0b11)
+    memo(rec, 'Case1')
+    memo(rec, 'Case1', mask=0b10)
+    assert_equal([x[2] for x in calls], [0b01, 0b11, None])
+
+
 if __name__ == '__main__':
     import nose
     nose.run(defaultTest=__name__)
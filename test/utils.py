@@ -1,3 +1,4 @@
+import os
 import pysam
 
 
@@ -7,3 +8,33 @@ def get_variants(path):
         for rec in vcf:
             records.append(rec)
     return records
+
+
+def make_indexed_vcf(path, out_dir, n_contigs=3, n_copies=4, spacing=20_000,
+                     csi=False):
+    '''
+    Create a bgzip compressed and indexed VCF from the records in path,
+    repeating records n_copies times on each of n_contigs contigs. Returns
+    the path of the new VCF.
+    '''
+    header, body = [], []
+    with open(path, 'rt') as fh:
+        for line in fh:
+            if line.startswith('##contig'):
+                continue
+            if line.startswith('#'):
+                header.append(line)
+            else:
+                body.append(line.split('\t'))
+    length = n_copies * spacing + 1000
+    contigs = ['##contig=<ID={},length={}>\n'.format(i + 1, length) for i in
+               range(n_contigs)]
+    out = os.path.join(out_dir, os.path.basename(path))
+    with open(out, 'wt') as fh:
+        fh.write(header[0] + ''.join(contigs) + ''.join(header[1:]))
+        for i in range(n_contigs):
+            for j in range(n_copies):
+                for split in body:
+                    pos = int(split[1]) + j * spacing
+                    fh.write('\t'.join([str(i + 1), str(pos)] + split[2:]))
+    return pysam.tabix_index(out, preset='vcf', force=True, csi=csi)